@@ -3,12 +3,17 @@ import os
 import json
 
 from pyrtstools.base import *
+from pyrtstools.tracing import Tracer
+from pyrtstools.scheduler import Scheduler
+from pyrtstools.profiling import Profiler
+from pyrtstools.dispatch import Dispatcher
 import pyrtstools.vad
 import pyrtstools.listenner
 import pyrtstools.kws
 import pyrtstools.features
 import pyrtstools.utils
 import pyrtstools.transform
+import pyrtstools.process
 
 if getattr(sys, 'frozen', False):
     DIR_PATH = os.path.dirname(sys.executable)
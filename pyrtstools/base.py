@@ -1,3 +1,4 @@
+import time
 from collections.abc import Iterable
 from typing import Union, Type
 from threading import Thread, Condition
@@ -18,9 +19,92 @@ class _Element(Thread):
         self._running = False
         self._paused = False
         self._condition = Condition()
+        self._processing = False
+        self._scheduler = None # Set when the element is run by a Scheduler instead of its own thread
+        self.tracer = None # Optional Tracer
+        self._trace_arrival = None
+        self.profiler = None # Optional Profiler
+        self.dispatcher = None # Optional Dispatcher delivering callbacks
+        self._dispatch_stream = None # Dispatcher stream of the element events
     
     def run(self):
+        """ Element thread loop: process while enough data is available, wait for input otherwise."""
+        self._running = True
+        while self._running:
+            with self._condition:
+                if self._paused and self._running:
+                    self._condition.wait()
+                    continue
+            if self._ready():
+                self._run_step()
+            else:
+                with self._condition:
+                    if not self._ready() and self._running and not self._paused:
+                        self._condition.wait()
+        self._finalize()
+
+    def _ready(self) -> bool:
+        """ Return True if enough data is buffered for a processing step."""
+        return False
+
+    def _step(self):
+        """ Run one processing step."""
+        pass
+
+    def _finalize(self):
+        """ Called once the element is closed, after its last processing step."""
         pass
+
+    def _run_step(self):
+        """ Run one processing step, measured if a profiler is set."""
+        profiler = self.profiler
+        if profiler is None:
+            self._step()
+        elif profiler.active:
+            profiler.run(self, self._step)
+        else:
+            self.profiler = None
+            self._step()
+
+    def _emit(self, callback: callable, *args):
+        """ Call a user callback (detection, utterance, error), through the dispatcher if set."""
+        if self.dispatcher is None:
+            callback(*args)
+        else:
+            self.dispatcher.dispatch(callback, args, self._dispatch_stream)
+
+    def _notify(self):
+        """ Signal new data or state change to the element thread or scheduler."""
+        with self._condition:
+            self._condition.notify()
+        if self._scheduler is not None:
+            self._scheduler.submit(self)
+
+    @property
+    def schedulable(self) -> bool:
+        """ True if the element can be run by a Scheduler (it uses the generic element loop)."""
+        return type(self).run is _Element.run
+
+    def _trace_input(self):
+        """ Mark the arrival of unprocessed data, for tracing."""
+        if self.tracer is not None and self._trace_arrival is None:
+            self._trace_arrival = time.perf_counter()
+
+    def _trace_start(self):
+        """ Return the tracing context of a processing step, None if tracing is disabled."""
+        if self.tracer is None:
+            return None
+        arrival, self._trace_arrival = self._trace_arrival, None
+        return (time.perf_counter(), arrival)
+
+    def _trace_end(self, context, **args):
+        """ Record queueing and processing spans of a processing step started with _trace_start."""
+        if context is None or self.tracer is None:
+            return
+        start, arrival = context
+        if arrival is not None:
+            self.tracer.span("queue", arrival, start, track="{}:queue".format(self.__name__), **args)
+        self.tracer.span(self.__name__, start, time.perf_counter(), **args)
     
     def stop(self):
         if not self._paused:
@@ -29,13 +113,14 @@ class _Element(Thread):
     def resume(self):
         if self._paused:
             self._paused = False
-            with self._condition:
-                self._condition.notify()
+            self._notify()
 
     def close(self):
         self._running = False
         with self._condition:
-            self._condition.notifyAll()
+            self._condition.notify_all()
+        if self._scheduler is not None:
+            self._scheduler.detach(self)
 
 class _Consumer(_Element):
     """ ABSTRACT _Consumer is the base class for all data consuming elements."""
@@ -66,6 +151,7 @@ class _Producer(_Element):
         _Element.__init__(self)
         self._output_type = None # Output type
         self._consumer = None
+        self.history = None # Optional AudioHistory recording source output
     
     def get_output_cap(self):
         return self._output_cap
@@ -102,12 +188,28 @@ class _Processor(_Producer, _Consumer):
 
 class Pipeline:
     """ The Pipeline class allow to group of elements used in a process, and control their behavior (start/stop/resume/close) collectively."""
-    def __init__(self, elements: list = []):
+    def __init__(self, elements: list = [], history = None, tracer = None, scheduler = None, dispatcher = None):
+        """ Keyword arguments:
+        ==================
+        elements (list) -- pipeline elements, in order. Successive elements are connected on start
+
+        history (AudioHistory) -- if set, the first element records its output audio into it (default None)
+
+        tracer (Tracer) -- if set, elements record capture timestamps, processing spans and detection latencies into it (default None)
+
+        scheduler (Scheduler) -- if set, schedulable elements are run by the scheduler worker pool instead of their own thread (default None)
+
+        dispatcher (Dispatcher) -- if set, elements callbacks (detections, utterances, errors) are delivered by the dispatcher, in order for the pipeline (default None)
+        """
         self._running = False
         self._paused = False
         self._closed = False
 
         self.elements = []
+        self.history = history
+        self.tracer = tracer
+        self.scheduler = scheduler
+        self.dispatcher = dispatcher
         self.add(elements)
     
     def add(self, element):
@@ -127,8 +229,20 @@ class Pipeline:
             self._running = True
             for i, element in enumerate(self.elements[:-1]):
                 element.connect_to(self.elements[i+1])
+            if self.history is not None:
+                self.elements[0].history = self.history
+            if self.tracer is not None:
+                for element in self.elements:
+                    element.tracer = self.tracer
+            if self.dispatcher is not None:
+                for element in self.elements:
+                    element.dispatcher = self.dispatcher
+                    element._dispatch_stream = self
             for element in self.elements:
-                element.start()
+                if self.scheduler is not None and element.schedulable:
+                    self.scheduler.attach(element, self)
+                else:
+                    element.start()
 
     def stop(self):
         """ Stop all elements """
@@ -144,6 +258,16 @@ class Pipeline:
             for element in self.elements:
                 element.resume()
 
+    def profile(self, duration: float = 10.0, capture: str = None, **kwargs):
+        """ Profile elements processing steps for duration seconds and return the Profiler, see pyrtstools.profiling.Profiler.
+        Can be called on a running pipeline, the report is available from the profiler at any time.
+        """
+        from pyrtstools.profiling import Profiler
+        profiler = Profiler(duration, capture, **kwargs)
+        for element in self.elements:
+            element.profiler = profiler
+        return profiler
+
     def close(self):
         """ Stop and close all elements""" 
         if not self._closed:
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+End-to-end benchmark of a FileSource -> VADer -> ByteToNum -> PreEmphasis -> SonopyMFCC -> KWS pipeline.
+
+Usage: python -m pyrtstools.benchmark --duration 3600 --save results.json --baseline baseline.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import resource
+
+import numpy as np
+
+# Metrics compared to the baseline, all lower is better: metric -> absolute slack added to the relative tolerance
+_GATED_METRICS = {"rtf": 0.001,
+                  "rss_steady_mb": 1.0,
+                  "rss_peak_mb": 1.0,
+                  "rss_growth_mb_per_hour": 1.0,
+                  "traced_peak_mb": 1.0,
+                  "threads_max": 0}
+
+def synthetic_audio(duration: float, sample_rate: int = 16000, chunk_size: int = 1024, speech_ratio: float = 0.3, seed: int = 0):
+    """ Generate duration seconds of int16 audio alternating background noise and speech-like voiced segments, as chunks of bytes.
+
+    The signal is generated segment by segment so hours of audio can be produced without holding them in memory.
+    The same seed always gives the same audio.
+
+    Keyword arguments:
+    ==================
+    duration (float) -- audio duration in s
+
+    sample_rate (int) -- sample rate (default 16000)
+
+    chunk_size (int) -- number of samples per chunk (default 1024)
+
+    speech_ratio (float) -- approximative ratio of speech segments (default 0.3)
+
+    seed (int) -- random generator seed (default 0)
+    """
+    rng = np.random.default_rng(seed)
+    remaining = int(duration * sample_rate)
+    pending = np.zeros(0, dtype=np.int16)
+    while remaining > 0:
+        n = min(int(rng.uniform(0.5, 3.0) * sample_rate), remaining)
+        t = np.arange(n) / sample_rate
+        segment = rng.normal(0, 30, n)
+        if rng.random() < speech_ratio:
+            f0 = rng.uniform(90, 250) * (1 + 0.05 * np.sin(2 * np.pi * rng.uniform(2, 6) * t))
+            phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+            voiced = sum(np.sin(k * phase) / k for k in range(1, 12))
+            syllables = np.clip(np.sin(2 * np.pi * rng.uniform(3, 5) * t), 0, None)
+            segment += 4000 * voiced * syllables
+        remaining -= n
+        pending = np.concatenate([pending, np.clip(segment, -32768, 32767).astype(np.int16)])
+        while len(pending) >= chunk_size or (remaining == 0 and len(pending) > 0):
+            yield pending[:chunk_size].tobytes()
+            pending = pending[chunk_size:]
+
+def tiny_model(model_path: str, n_features: int = 30, feature_length: int = 13, seed: int = 0) -> str:
+    """ Write a small random TensorflowLite keyword spotting model to model_path, requires tensorflow."""
+    import tensorflow as tf
+    tf.random.set_seed(seed)
+    model = tf.keras.Sequential([tf.keras.layers.Input(shape=(n_features, feature_length), batch_size=1),
+                                 tf.keras.layers.Flatten(),
+                                 tf.keras.layers.Dense(32, activation="relu"),
+                                 tf.keras.layers.Dense(2, activation="softmax")])
+    with open(model_path, 'wb') as f:
+        f.write(tf.lite.TFLiteConverter.from_keras_model(model).convert())
+    return model_path
+
+def build_pipeline(source, model_path: str, speed: float = None):
+    """ Return the benchmark elements, a progress function giving the number of samples consumed by KWS and the number of samples
+    at the end of the stream that are never consumed (shorter than a VAD window plus a features window).
+    """
+    from pyrtstools.listenner.filesource import FileSource
+    from pyrtstools.vad import VADer
+    from pyrtstools.transform import ByteToNum, PreEmphasis
+    from pyrtstools.features import MFCCParams, SonopyMFCC
+    from pyrtstools.kws import KWS
+
+    params = MFCCParams()
+    vader = VADer(filter=False)
+    kws = KWS(model_path, vad_activity=vader.activity, frame_shift=params.stride_l, on_detection=lambda i, v: None)
+    progress = lambda: kws.frame_count * params.stride_l
+    source = FileSource(source, speed=speed, progress=progress, max_backlog=2 * params.sample_rate)
+    remainder = params.window_l + int(vader.window_length * params.sample_rate / 1000)
+    return [source, vader, ByteToNum(normalize=True), PreEmphasis(0.97), SonopyMFCC(params), kws], progress, remainder
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10 # Peak only, in KiB on linux
+
+def run_benchmark(elements: list, progress: callable, scheduler = None, sample_interval: float = 1.0, timeout: float = 30.0, top: int = 10,
+                  trace_memory: bool = False, remainder: int = 0) -> dict:
+    """ Run a pipeline whose first element is a FileSource until its audio has been consumed and return the measures.
+
+    Python allocations are only traced with trace_memory, tracemalloc slowing the pipeline down: timings of a traced run are
+    not representative, run it separately from the timing run.
+
+    Keyword arguments:
+    ==================
+    elements (list) -- pipeline elements, the first one being a FileSource
+
+    progress (callable() -> int) -- number of samples consumed at the end of the pipeline
+
+    scheduler (Scheduler) -- if set, the pipeline runs on this scheduler (default None)
+
+    sample_interval (float) -- time in s between two RSS and thread count samples (default 1.0)
+
+    timeout (float) -- maximum time in s to wait for the pipeline to drain after the source end (default 30.0)
+
+    top (int) -- number of allocation sites reported (default 10)
+
+    trace_memory (bool) -- trace Python allocations with tracemalloc, adds traced_current_mb, traced_peak_mb and top_allocations (default False)
+
+    remainder (int) -- number of samples at the end of the stream the pipeline never consumes, see build_pipeline (default 0)
+    """
+    from pyrtstools.base import Pipeline
+    source = elements[0]
+    samples = [] # (time, rss in MiB, number of threads)
+    done = threading.Event()
+    def sample():
+        while not done.is_set():
+            samples.append((time.perf_counter(), _rss_mb(), threading.active_count()))
+            done.wait(sample_interval)
+
+    if trace_memory:
+        tracemalloc.start()
+    sampler = threading.Thread(target=sample, daemon=True)
+    pipeline = Pipeline(elements, scheduler=scheduler)
+    start = time.perf_counter()
+    sampler.start()
+    pipeline.start()
+    source.finished.wait()
+    drain_end = time.perf_counter() + timeout
+    while progress() < source.n_samples - remainder and time.perf_counter() < drain_end:
+        time.sleep(0.01)
+    wall_time = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    traced = {}
+    if trace_memory:
+        traced_current, traced_peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        traced = {"traced_current_mb": traced_current / 2**20,
+                  "traced_peak_mb": traced_peak / 2**20,
+                  "top_allocations": [[str(stat.traceback), stat.size / 2**10, stat.count] for stat in snapshot.statistics("lineno")[:top]]}
+    pipeline.close()
+
+    steady = samples[len(samples) // 2:]
+    times = np.array([s[0] for s in steady]) - start
+    rss = np.array([s[1] for s in steady])
+    growth = np.polyfit(times, rss, 1)[0] * 3600 if len(steady) > 2 and np.ptp(times) > 0 else 0.0
+    results = {"audio_duration": source.duration,
+               "wall_time": wall_time,
+               "rtf": wall_time / max(source.duration, 1e-9),
+               "drained": progress() >= source.n_samples - remainder,
+               "rss_steady_mb": float(np.median(rss)) if len(rss) else 0.0,
+               "rss_peak_mb": max(s[1] for s in samples) if samples else 0.0,
+               "rss_growth_mb_per_hour": float(growth),
+               "threads_max": max(s[2] for s in samples) if samples else threading.active_count()}
+    results.update(traced)
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.1) -> list:
+    """ Return the list of regressions, as (metric, value, baseline) tuples, of results exceeding baseline by more than tolerance (relative).
+    A run that did not drain before its timeout is a regression, its measures are not comparable.
+    """
+    regressions = []
+    if not results.get("drained", True):
+        regressions.append(("drained", False, baseline.get("drained", True)))
+    for metric, slack in _GATED_METRICS.items():
+        if metric in results and metric in baseline:
+            if results[metric] > baseline[metric] + abs(baseline[metric]) * tolerance + slack:
+                regressions.append((metric, results[metric], baseline[metric]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pyrtstools pipeline benchmark")
+    parser.add_argument("--duration", type=float, default=600, help="Synthetic audio duration in s")
+    parser.add_argument("--wav", default=None, help="Use this WAV file instead of synthetic audio")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic audio seed")
+    parser.add_argument("--model", default=None, help="KWS model, a small random TensorflowLite model is generated if not set")
+    parser.add_argument("--speed", type=float, default=None, help="Replay speed relative to real time (default as fast as possible)")
+    parser.add_argument("--trace_memory", action="store_true", help="Trace Python allocations in a second run, after the timing run")
+    parser.add_argument("--workers", type=int, default=None, help="Run the pipeline on a Scheduler with this number of workers")
+    parser.add_argument("--save", default=None, help="Write results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Compare results to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative tolerance of the baseline comparison")
+    args = parser.parse_args()
+
+    model_dir = None
+    model_path = args.model
+    if model_path is None:
+        model_dir = tempfile.TemporaryDirectory()
+        model_path = tiny_model(os.path.join(model_dir.name, "tiny.tflite"))
+    scheduler = None
+    if args.workers is not None:
+        from pyrtstools.scheduler import Scheduler
+        scheduler = Scheduler(args.workers)
+    def run(trace_memory):
+        source = args.wav if args.wav is not None else synthetic_audio(args.duration, seed=args.seed)
+        elements, progress, remainder = build_pipeline(source, model_path, args.speed)
+        return run_benchmark(elements, progress, scheduler, trace_memory=trace_memory, remainder=remainder)
+    results = run(False)
+    if args.trace_memory:
+        traced = run(True)
+        results.update({k: v for k, v in traced.items() if k.startswith("traced_") or k == "top_allocations"})
+    if scheduler is not None:
+        scheduler.close()
+    if model_dir is not None:
+        model_dir.cleanup()
+
+    print(json.dumps({k: v for k, v in results.items() if k != "top_allocations"}, indent=2))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for metric, value, reference in regressions:
+            if metric == "drained":
+                print("REGRESSION drained: the audio was not consumed within the timeout")
+            else:
+                print("REGRESSION {}: {:.4f} > {:.4f} (+{:.0%})".format(metric, value, reference, args.tolerance))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
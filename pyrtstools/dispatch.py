@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import time
+import asyncio
+import threading
+from collections import deque
+
+class _Stream:
+    def __init__(self):
+        self.events = deque() # (callback, args, enqueue time)
+        self.scheduled = False # A worker or the loop is delivering this stream events
+        self.delivered = 0
+        self.dropped = 0
+
+class Dispatcher:
+    """ Dispatcher delivers element callbacks (detections, utterances, errors) away from the processing threads.
+
+    Elements hand their callback calls over to the dispatcher, which runs them on its own worker threads or on an asyncio loop,
+    so a slow callback does not hold back inference. Events of a stream (a pipeline by default) are delivered in order, one at a time,
+    different streams are delivered concurrently. The queue is bounded, events over max_queue are dropped and counted.
+    Callbacks returning a coroutine are awaited when running on an asyncio loop.
+
+    Usage: Pipeline(elements, dispatcher=dispatcher), a dispatcher can be shared by many pipelines.
+    """
+    def __init__(self, n_workers: int = 1,
+                       loop: asyncio.AbstractEventLoop = None,
+                       max_queue: int = 1024,
+                       drop_oldest: bool = True,
+                       max_latencies: int = 1024,
+                       on_error: callable = lambda x: print(x)):
+        """ Create a dispatcher, workers are started with the first event.
+
+        Keyword arguments:
+        ==================
+        n_workers (int) -- number of worker threads delivering events, unused if loop is set (default 1)
+
+        loop (asyncio.AbstractEventLoop) -- if set, callbacks are run on this running event loop instead of worker threads (default None)
+
+        max_queue (int) -- maximum number of pending events (default 1024)
+
+        drop_oldest (bool) -- when the queue is full, drop the oldest pending event of the same stream instead of the new one (default True)
+
+        max_latencies (int) -- number of recent events kept for latency statistics (default 1024)
+
+        on_error (callable(Exception)) -- called when a callback raises (default print)
+        """
+        assert n_workers > 0, "n_workers must be positive"
+        assert max_queue > 0, "max_queue must be positive"
+        self.n_workers = n_workers
+        self.loop = loop
+        self.max_queue = max_queue
+        self.drop_oldest = drop_oldest
+        self.on_error = on_error
+        self._cond = threading.Condition()
+        self._streams = {} # stream -> _Stream
+        self._ready = deque() # streams with events waiting for a worker
+        self._workers = []
+        self._closed = False
+        self.n_pending = 0
+        self.n_delivered = 0
+        self.n_dropped = 0
+        self.n_errors = 0
+        self.latencies = deque([], maxlen=max_latencies) # (queue delay, callback duration) in s
+
+    def dispatch(self, callback: callable, args: tuple = (), stream = None) -> bool:
+        """ Queue callback(*args) for delivery after the previous events of stream. Return False if the event was dropped."""
+        with self._cond:
+            if self._closed:
+                return False
+            state = self._streams.get(stream)
+            if state is None:
+                state = self._streams[stream] = _Stream()
+            if self.n_pending >= self.max_queue:
+                self.n_dropped += 1
+                if not self.drop_oldest or len(state.events) == 0:
+                    state.dropped += 1
+                    return False
+                state.events.popleft()
+                state.dropped += 1
+                self.n_pending -= 1
+            state.events.append((callback, args, time.perf_counter()))
+            self.n_pending += 1
+            if not state.scheduled:
+                state.scheduled = True
+                if self.loop is not None:
+                    asyncio.run_coroutine_threadsafe(self._deliver_async(stream, state), self.loop)
+                else:
+                    self._ready.append((stream, state))
+                    if len(self._workers) < self.n_workers:
+                        worker = threading.Thread(target=self._work, daemon=True)
+                        self._workers.append(worker)
+                        worker.start()
+                    self._cond.notify()
+        return True
+
+    def wrap(self, callback: callable, stream = None) -> callable:
+        """ Return a function dispatching calls to callback, e.g. kws.on_detection = dispatcher.wrap(on_detection)."""
+        return lambda *args: self.dispatch(callback, args, stream)
+
+    def _next_event(self, state: _Stream):
+        """ Pop the next event of a stream, or release it if empty. Called holding _cond."""
+        if len(state.events) == 0:
+            state.scheduled = False
+            self._cond.notify_all()
+            return None
+        self.n_pending -= 1
+        return state.events.popleft()
+
+    def _record(self, state: _Stream, queued: float, start: float):
+        with self._cond:
+            self.latencies.append((start - queued, time.perf_counter() - start))
+            state.delivered += 1
+            self.n_delivered += 1
+
+    def _error(self, err: Exception):
+        self.n_errors += 1
+        self.on_error(err)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while len(self._ready) == 0 and not self._closed:
+                    self._cond.wait()
+                if len(self._ready) == 0:
+                    return
+                stream, state = self._ready.popleft()
+                event = self._next_event(state)
+            if event is None:
+                continue
+            callback, args, queued = event
+            start = time.perf_counter()
+            try:
+                callback(*args)
+            except Exception as err:
+                self._error(err)
+            self._record(state, queued, start)
+            with self._cond:
+                # Requeue behind other streams so a busy stream does not starve the others
+                if len(state.events) > 0:
+                    self._ready.append((stream, state))
+                else:
+                    state.scheduled = False
+                self._cond.notify_all()
+
+    async def _deliver_async(self, stream, state: _Stream):
+        while True:
+            with self._cond:
+                event = self._next_event(state)
+            if event is None:
+                return
+            callback, args, queued = event
+            start = time.perf_counter()
+            try:
+                result = callback(*args)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as err:
+                self._error(err)
+            self._record(state, queued, start)
+
+    def flush(self, timeout: float = None) -> bool:
+        """ Wait until all pending events have been delivered, return False on timeout. Not to be called from a callback."""
+        end = None if timeout is None else time.perf_counter() + timeout
+        with self._cond:
+            while self.n_pending > 0 or any(s.scheduled for s in self._streams.values()):
+                remaining = None if end is None else end - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self) -> dict:
+        """ Return the number of pending, delivered, dropped and failed events, queue delay and callback duration statistics in s
+        (mean, p50, p95 and max over the recent events) and per stream delivered and dropped counts.
+        """
+        with self._cond:
+            latencies = list(self.latencies)
+            streams = {stream: {"delivered": s.delivered, "dropped": s.dropped, "pending": len(s.events)} for stream, s in self._streams.items()}
+        def summary(values):
+            if len(values) == 0:
+                return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+            values = sorted(values)
+            return {"mean": sum(values) / len(values),
+                    "p50": values[len(values) // 2],
+                    "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                    "max": values[-1]}
+        return {"pending": self.n_pending,
+                "delivered": self.n_delivered,
+                "dropped": self.n_dropped,
+                "errors": self.n_errors,
+                "queue_delay": summary([l[0] for l in latencies]),
+                "callback_time": summary([l[1] for l in latencies]),
+                "streams": streams}
+
+    def forget(self, stream):
+        """ Discard the statistics of a stream without pending events, e.g. once its pipeline is closed."""
+        with self._cond:
+            state = self._streams.get(stream)
+            if state is not None and not state.scheduled:
+                del self._streams[stream]
+
+    def close(self, flush: bool = True, timeout: float = None):
+        """ Stop the dispatcher, pending events are delivered first if flush is set, dropped otherwise.
+        With an asyncio loop, do not call it from the loop thread when flush is set.
+        """
+        if flush:
+            self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            for state in self._streams.values():
+                self.n_pending -= len(state.events)
+                state.events.clear()
+            self._cond.notify_all()
+        for worker in self._workers:
+            if worker is not threading.current_thread():
+                worker.join()
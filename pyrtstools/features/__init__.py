@@ -1 +1,4 @@
-from .mfcc import MFCCParams, SonopyMFCC
+from .mfcc import MFCCParams, SonopyMFCC, compute_mfcc
+from .cache import FeatureCache
+from .delta import DeltaParams, DeltaCMVN, compute_delta_cmvn
+from .stft import STFTParams, STFT, MFCC, LogMel, Spectrogram
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import json
+import time
+import hashlib
+from threading import Lock
+
+import numpy as np
+
+class FeatureCache:
+    """ FeatureCache stores features matrices on disk as .npy shards, indexed by audio content and extraction parameters.
+
+    Entries are meant for whole signals (files, utterances), see compute_mfcc. Shards are returned memory-mapped.
+    When the cache exceeds its maximum size, the least recently used shards are removed.
+    The index is kept in index.json within the cache directory, it is written at most every few seconds and by flush().
+    """
+    _index_name = "index.json"
+    _index_sync_interval = 10.0 # s between index writes
+
+    def __init__(self, directory: str, max_size: int = 1 << 30):
+        """ Open or create a feature cache.
+
+        Keyword arguments:
+        ==================
+        directory (str) -- cache directory, created if missing
+
+        max_size (int) -- maximum cache size in bytes (default 1GiB)
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._last_sync = time.time()
+        self._dirty = False
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(os.path.join(directory, self._index_name), 'r') as f:
+                self._index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._index = {}
+        # Drop entries whose shard has been removed, adopt shards stored after the last index write
+        self._index = {k: v for k, v in self._index.items() if os.path.isfile(self._path(k))}
+        for name in os.listdir(directory):
+            key = name[:-4]
+            if name.endswith(".tmp.npy"):
+                self._remove_stale(name)
+            elif name.endswith(".npy") and key not in self._index:
+                path = os.path.join(directory, name)
+                self._index[key] = {"size": os.path.getsize(path), "last_access": os.path.getmtime(path)}
+
+    def _remove_stale(self, name: str):
+        """ Remove a temporary shard left by a process that died before renaming it."""
+        try:
+            pid = int(name.split('.')[-3])
+            if pid == os.getpid():
+                return
+            os.kill(pid, 0) # Raises if the writer process no longer exists
+        except (ValueError, IndexError, ProcessLookupError):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+        except PermissionError: # Process of another user, still running
+            pass
+
+    @staticmethod
+    def key(audio, params, **extra) -> str:
+        """ Return the cache key of an audio content extracted with the given parameters.
+
+        Keyword arguments:
+        ==================
+        audio (numpy.array | bytes) -- audio content
+
+        params (MFCCParams) -- extraction parameters, must implement to_dict()
+
+        **extra -- any other setting affecting the features (e.g. emphasis_factor)
+        """
+        h = hashlib.blake2b(digest_size=20)
+        if isinstance(audio, np.ndarray):
+            h.update(audio.dtype.str.encode())
+            audio = np.ascontiguousarray(audio)
+        h.update(memoryview(audio).cast('B'))
+        h.update(json.dumps([params.to_dict(), extra], sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, key: str) -> np.array:
+        """ Return the memory-mapped features stored under key or None."""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry["last_access"] = time.time()
+            self._dirty = True
+            self.hits += 1
+            if time.time() - self._last_sync > self._index_sync_interval:
+                self._write_index()
+        try:
+            return np.load(self._path(key), mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self._index.pop(key, None)
+                self.hits -= 1
+                self.misses += 1
+            return None
+
+    def put(self, key: str, features: np.array):
+        """ Store features under key, evicting least recently used entries if needed."""
+        path = self._path(key)
+        tmp_path = "{}.{}.tmp.npy".format(path[:-4], os.getpid())
+        np.save(tmp_path, np.ascontiguousarray(features))
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._index[key] = {"size": os.path.getsize(path), "last_access": time.time()}
+            self._evict()
+            self._dirty = True
+            if time.time() - self._last_sync > self._index_sync_interval:
+                self._write_index()
+
+    def _evict(self):
+        total = self.size
+        for key in sorted(self._index, key=lambda k: self._index[k]["last_access"]):
+            if total <= self.max_size:
+                break
+            total -= self._index.pop(key)["size"]
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _write_index(self):
+        path = os.path.join(self.directory, self._index_name)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(self._index, f)
+        os.replace(path + ".tmp", path)
+        self._last_sync = time.time()
+        self._dirty = False
+
+    def flush(self):
+        """ Write pending index updates to disk."""
+        with self._lock:
+            if self._dirty:
+                self._write_index()
+
+    def clear(self):
+        """ Remove every entry from the cache."""
+        with self._lock:
+            for key in list(self._index):
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+            self._index = {}
+            self._write_index()
+
+    @property
+    def size(self) -> int:
+        """ Cache size in bytes"""
+        return sum(entry["size"] for entry in self._index.values())
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key: str):
+        return key in self._index
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+from pyrtstools.base import _Processor
+
+class DeltaParams:
+    """ Class designed to hold parameters for CMVN and delta features."""
+
+    def __init__(self, **kwargs):
+        """ Construct a parameter class.
+
+        Keyword arguments:
+        ==================
+        cmvn_decay (float) -- decay of the running mean and variance, ~ 1 / (1 - cmvn_decay) frames of memory (default 0.995)
+
+        norm_vars (bool) -- normalize the variance as well as the mean (default True)
+
+        delta_window (int) -- number of frames on each side used to compute deltas (default 2)
+
+        delta_order (int) -- 0 for CMVN only, 1 adds deltas, 2 adds deltas and delta-deltas (default 2)
+
+        eps (float) -- variance floor (default 1e-8)
+        """
+        self.cmvn_decay = 0.995
+        self.norm_vars = True
+        self.delta_window = 2
+        self.delta_order = 2
+        self.eps = 1e-8
+        for key, value in kwargs.items():
+            self.__setattr__(key, value)
+
+    @property
+    def lookahead(self) -> int:
+        """ Number of frames needed after a frame to output it"""
+        return self.delta_window * self.delta_order
+
+    def to_dict(self) -> dict:
+        """ Return the parameters as a dictionnary, DeltaParams(**params.to_dict()) gives the same parameters"""
+        return dict(sorted(vars(self).items()))
+
+def _delta(x: np.array, n: int) -> np.array:
+    """ Regression deltas of x over +/- n frames, returns len(x) - 2n frames."""
+    length = len(x) - 2 * n
+    d = np.zeros((length, x.shape[1]))
+    for i in range(1, n + 1):
+        d += i * (x[n + i:n + i + length] - x[n - i:n - i + length])
+    return d / (2 * sum(i * i for i in range(1, n + 1)))
+
+class _DeltaCMVNState:
+    """ Streaming CMVN and deltas computation shared by DeltaCMVN and compute_delta_cmvn.
+
+    The running statistics recurrence is vectorized over segments of frames aligned on the frame index: within a segment,
+    statistics are the segment start statistics plus a cumulative sum of the frames weighted by inverse decay powers.
+    The partial sum is carried between blocks, so the output does not depend, bit for bit, on how the stream is split.
+    """
+    def __init__(self, params: DeltaParams):
+        assert 0.0 < params.cmvn_decay < 1.0, "cmvn_decay must be in ]0.0,1.0["
+        assert params.delta_window > 0 and params.delta_order >= 0, "delta_window must be positive"
+        self.params = params
+        # Segment length keeping inverse decay powers below e^8
+        self._segment = int(max(1, min(4096, 8 / -np.log(params.cmvn_decay))))
+        self.feature_length = None
+        self._t = 0 # Number of frames processed
+        self._start = None # Running [sum, squares sum] statistics before the current segment
+        self._partial = None # Weighted sum of the current segment frames
+        self._context = None # Normalized frames kept for deltas computation
+
+    def _normalize(self, frames: np.array) -> np.array:
+        decay = self.params.cmvn_decay
+        n, length = frames.shape
+        if self._start is None:
+            self._start = np.zeros(2 * length)
+            self._partial = np.zeros(2 * length)
+        values = np.concatenate([frames, frames * frames], axis=1)
+        stats = np.empty(values.shape)
+        t = self._t
+        pos = 0
+        while pos < n:
+            offset = t % self._segment
+            count = min(n - pos, self._segment - offset)
+            k = (offset + np.arange(count))[:, None] # Position in the segment
+            sums = np.cumsum(np.concatenate([self._partial[None], values[pos:pos + count] * decay ** -k]), axis=0)[1:]
+            stats[pos:pos + count] = decay ** (k + 1) * self._start + (1 - decay) * decay ** k * sums
+            self._partial = sums[-1]
+            pos += count
+            t += count
+            if t % self._segment == 0:
+                self._start = stats[pos - 1]
+                self._partial = np.zeros(2 * length)
+        weights = 1 - decay ** (np.arange(self._t, t) + 1.0)[:, None] # Bias correction of the running statistics
+        self._t = t
+        means = stats[:, :length] / weights
+        if self.params.norm_vars:
+            variances = stats[:, length:] / weights - means * means
+            return (frames - means) / np.sqrt(np.maximum(variances, self.params.eps))
+        return frames - means
+
+    def _output(self, context: np.array) -> np.array:
+        """ Return the output frames that can be computed from context and keep the context needed for the next ones."""
+        n, p = self.params.delta_window, self.params.lookahead
+        if len(context) <= 2 * p:
+            self._context = context
+            return self._empty()
+        levels = [context]
+        for _ in range(self.params.delta_order):
+            levels.append(_delta(levels[-1], n))
+        end = len(context) - p
+        out = np.concatenate([level[p - k * n:end - k * n] for k, level in enumerate(levels)], axis=1)
+        self._context = context[end - p:]
+        return out
+
+    def _empty(self, feature_length: int = None) -> np.array:
+        feature_length = self.feature_length if feature_length is None else feature_length
+        return np.zeros((0, (feature_length or 0) * (self.params.delta_order + 1)))
+
+    def process(self, frames: np.array) -> np.array:
+        """ Return the output frames made available by a block of input frames."""
+        frames = np.asarray(frames, dtype=np.float64)
+        if len(frames) == 0:
+            return self._empty(frames.shape[1] if frames.ndim == 2 else None)
+        self.feature_length = frames.shape[1]
+        normalized = self._normalize(frames)
+        if self._context is None: # Stream start is padded with the first frame
+            self._context = np.repeat(normalized[:1], self.params.lookahead, axis=0)
+        return self._output(np.concatenate([self._context, normalized]))
+
+    def flush(self) -> np.array:
+        """ Return the last frames of the stream, padded with the last frame."""
+        if self._context is None or self.params.lookahead == 0:
+            return self._empty()
+        padding = np.repeat(self._context[-1:], self.params.lookahead, axis=0)
+        return self._output(np.concatenate([self._context, padding]))
+
+def compute_delta_cmvn(features: np.array, params: DeltaParams, flush: bool = True) -> np.array:
+    """ Offline CMVN and deltas of a features matrix, identical to the output of a DeltaCMVN element fed with the same frames.
+
+    Keyword arguments:
+    ==================
+    features (numpy.array) -- (T, feature_length) features, e.g. from compute_mfcc
+
+    params (DeltaParams) -- CMVN and deltas parameters
+
+    flush (bool) -- pad the end of the matrix to output all the T frames, else the last params.lookahead frames are not output as in streaming (default True)
+    """
+    state = _DeltaCMVNState(params)
+    out = state.process(features)
+    if flush and params.lookahead > 0:
+        out = np.concatenate([out, state.flush()])
+    return out
+
+class DeltaCMVN(_Processor):
+    """ DeltaCMVN normalizes features with running mean and variance statistics and appends their deltas.
+
+    Statistics are updated with exponential decay at each frame. A frame is output once the delta_window * delta_order following frames
+    have been received. Output frame i corresponds to input frame i, use compute_delta_cmvn to get the same features offline.
+
+    Capacities
+    ===========
+    Input
+    -----
+    numpy.array -- (n, feature_length) features, e.g. from SonopyMFCC
+
+    Ouput
+    -----
+    numpy.array -- (n, feature_length * (delta_order + 1)) normalized features followed by their deltas
+    """
+    __name__ = "deltacmvn"
+    _input_cap = [np.array]
+    _output_cap = [np.array]
+
+    def __init__(self, deltaParams: DeltaParams = None):
+        """ Instanciate a DeltaCMVN element.
+
+        Keyword arguments:
+        ==================
+        deltaParams (DeltaParams) -- CMVN and deltas parameters (default DeltaParams())
+        """
+        _Processor.__init__(self)
+        self.deltaParams = deltaParams if deltaParams is not None else DeltaParams()
+        self._state = _DeltaCMVNState(self.deltaParams)
+        self._queue = []
+        self._frame_offset = 0
+
+    def input(self, data: np.array):
+        if len(data) == 0:
+            return
+        with self._condition:
+            self._queue.append(data)
+        self._trace_input()
+        self._notify()
+
+    def _ready(self) -> bool:
+        return len(self._queue) > 0
+
+    def _step(self):
+        self.process()
+
+    def reset(self):
+        """ Reset the running statistics and the delta context, the next frame starts a new stream."""
+        with self._condition:
+            self._state = _DeltaCMVNState(self.deltaParams)
+
+    def process(self):
+        self._processing = True
+        trace = self._trace_start()
+        with self._condition:
+            queue, self._queue = self._queue, []
+        features = self._state.process(np.concatenate(queue))
+        self._trace_end(trace, frame=self._frame_offset, n_frames=len(features))
+        self._frame_offset += len(features)
+        if self._consumer is not None and len(features) > 0:
+            self._consumer.input(features)
+        self._processing = False
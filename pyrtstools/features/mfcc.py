@@ -66,6 +66,49 @@ class MFCCParams:
         """ stride duration converted to number of frames"""
         return int(self.sample_rate * self.stride_d)
 
+    def to_dict(self) -> dict:
+        """ Return the parameters as a dictionnary, MFCCParams(**params.to_dict()) gives the same parameters"""
+        return dict(sorted(vars(self).items()))
+
+def _sonopy_mfcc(signal: np.array, mfccParams: MFCCParams) -> np.array:
+    features = mfcc_spec(signal,
+                         sample_rate=mfccParams.sample_rate,
+                         window_stride=(mfccParams.window_l, mfccParams.stride_l),
+                         num_coeffs=mfccParams.n_coef + (not mfccParams.energy),
+                         num_filt=mfccParams.n_filt,
+                         fft_size=mfccParams.n_fft)
+    if not mfccParams.energy:
+        features = features[:, 1:]
+    return features
+
+def compute_mfcc(signal: np.array,
+                 mfccParams: MFCCParams,
+                 emphasis_factor: float = None,
+                 cache = None) -> np.array:
+    """ Offline MFCC extraction of a whole signal, matching a ByteToNum -> {PreEmphasis} -> SonopyMFCC chain.
+
+    Keyword arguments:
+    ==================
+    signal (numpy.array) -- normalized signal
+
+    mfccParams (MFCCParams) -- features parameters
+
+    emphasis_factor (float) -- if set, pre-emphasis is applied before extraction (default None)
+
+    cache (FeatureCache) -- if set, features of the whole signal are fetched from or stored into the cache (default None)
+    """
+    if cache is not None:
+        key = cache.key(signal, mfccParams, emphasis_factor=emphasis_factor)
+        features = cache.get(key)
+        if features is not None:
+            return features
+    if emphasis_factor is not None:
+        signal = signal - np.concatenate([[0.0], signal[:-1]]) * emphasis_factor
+    features = _sonopy_mfcc(signal, mfccParams)
+    if cache is not None:
+        cache.put(key, features)
+    return features
+
 from sonopy import mfcc_spec
 class SonopyMFCC(_Processor):
     """ SonopyMFCC extract MFCC features using the sonopy library
@@ -85,28 +128,49 @@ class SonopyMFCC(_Processor):
     _output_cap = [np.array]
 
     def __init__(self, mfccParams: MFCCParams):
+        """ Instanciate a SonopyMFCC element.
+
+        Keyword arguments:
+        ==================
+        mfccParams (MFCCParams) -- features parameters
+        """
         _Processor.__init__(self)
         self._buffer = np.array([])
         
         self.mfccParams = mfccParams
+        self._frame_offset = 0
+        self._pending_params = None # (mfccParams, on_ready) set by swap_params
     
     def input(self, data: np.array):
-        self._buffer = np.concatenate([self._buffer, data])
         with self._condition:
-            self._condition.notify()
+            self._buffer = np.concatenate([self._buffer, data])
+        self._trace_input()
+        self._notify()
     
-    def run(self):
-        self._running = True
-        while self._running:
-            if self._paused or self._processing:
-                with self._condition:
-                    self._condition.wait()
-                    continue
-            if len(self._buffer) >= self.mfccParams.window_l:
-                self._process()
-            else:
-                with self._condition:
-                    self._condition.wait()
+    def _ready(self) -> bool:
+        return self._pending_params is not None or len(self._buffer) >= self.mfccParams.window_l
+
+    def _step(self):
+        if self._pending_params is not None:
+            with self._condition:
+                (self.mfccParams, on_ready), self._pending_params = self._pending_params, None
+            if on_ready is not None:
+                on_ready(self.mfccParams)
+        if len(self._buffer) >= self.mfccParams.window_l:
+            self._process()
+
+    def swap_params(self, mfccParams: MFCCParams, on_ready: callable = None):
+        """ Replace the features parameters between two processing steps, buffered audio is kept.
+
+        Keyword arguments:
+        ==================
+        mfccParams (MFCCParams) -- new features parameters
+
+        on_ready (callable(MFCCParams)) -- called once the parameters are in use (default None)
+        """
+        with self._condition:
+            self._pending_params = (mfccParams, on_ready)
+        self._notify()
 
     def stop(self):
         self._buffer = np.array([])
@@ -114,18 +178,17 @@ class SonopyMFCC(_Processor):
 
     def _process(self):
         self._processing = True
-        features = mfcc_spec(self._buffer,
-                                sample_rate=self.mfccParams.sample_rate,
-                                window_stride=(self.mfccParams.window_l, self.mfccParams.stride_l),
-                                num_coeffs=self.mfccParams.n_coef + (not self.mfccParams.energy),
-                                num_filt=self.mfccParams.n_filt,
-                                fft_size=self.mfccParams.n_fft)
-        if not self.mfccParams.energy:
-            features = features[:, 1:]
-        self._buffer = self._buffer[len(features) * self.mfccParams.stride_l:]
+        trace = self._trace_start()
+        with self._condition:
+            buffer = self._buffer
+        features = _sonopy_mfcc(buffer, self.mfccParams)
+        with self._condition:
+            self._buffer = self._buffer[len(features) * self.mfccParams.stride_l:]
+        if trace is not None:
+            self.tracer.set_frame_geometry(self.mfccParams.stride_l, self.mfccParams.window_l)
+            self._trace_end(trace, frame=self._frame_offset, n_frames=len(features))
+        self._frame_offset += len(features)
 
         if self._consumer is not None:
             self._consumer.input(features)
         self._processing = False
-        with self._condition:
-            self._condition.notify()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from pyrtstools.base import _Processor
+from pyrtstools.features.mfcc import MFCCParams
+
+_LOG_FLOOR = np.float32(np.finfo(float).eps)
+
+class STFTParams(MFCCParams):
+    """ Class designed to hold parameters for STFT based features, extends MFCCParams."""
+
+    def __init__(self, **kwargs):
+        """ Construct a parameter class.
+
+        Keyword arguments:
+        ==================
+        MFCCParams arguments
+
+        window_type (str) -- analysis window: "rect", "hann" or "hamming" (default "rect")
+
+        filterbank (str) -- "sonopy" mel filters, the same as SonopyMFCC (low_freq and high_freq are ignored),
+        or "htk" mel filters between low_freq and high_freq (default "sonopy")
+        """
+        self.window_type = "rect"
+        self.filterbank = "sonopy"
+        MFCCParams.__init__(self, **kwargs)
+
+@lru_cache(maxsize=None)
+def _window(window_type: str, length: int) -> np.array:
+    if window_type == "rect":
+        window = np.ones(length, dtype=np.float32)
+    elif window_type == "hann":
+        window = np.hanning(length + 1)[:-1].astype(np.float32) # periodic
+    elif window_type == "hamming":
+        window = np.hamming(length + 1)[:-1].astype(np.float32)
+    else:
+        raise ValueError("Unknown window type {}".format(window_type))
+    window.flags.writeable = False
+    return window
+
+def _hertz_to_mels(f):
+    return 1127. * np.log(1. + f / 700.)
+
+def _mels_to_hertz(mel):
+    return 700. * (np.exp(mel / 1127.) - 1.)
+
+@lru_cache(maxsize=None)
+def _filterbank(kind: str, sample_rate: int, n_filt: int, n_bins: int, low_freq: float, high_freq: float) -> np.array:
+    """ Return the (n_bins, n_filt) mel filters matrix."""
+    if kind == "sonopy":
+        grid = _mels_to_hertz(np.linspace(_hertz_to_mels(0), _hertz_to_mels(sample_rate), n_filt + 2, True))
+        indices = (grid * n_bins / sample_rate).astype(int).tolist() # sonopy duplicate points correction has no effect as grid starts at 0
+    elif kind == "htk":
+        high_freq = sample_rate / 2 if high_freq is None else high_freq
+        grid = _mels_to_hertz(np.linspace(_hertz_to_mels(low_freq), _hertz_to_mels(high_freq), n_filt + 2, True))
+        indices = np.floor(grid * 2 * (n_bins - 1) / sample_rate).astype(int).tolist()
+    else:
+        raise ValueError("Unknown filterbank {}".format(kind))
+    banks = np.zeros((n_filt, n_bins))
+    for i in range(n_filt):
+        left, middle, right = indices[i:i + 3]
+        banks[i, left:middle] = np.linspace(0., 1., middle - left, False)
+        banks[i, middle:right] = np.linspace(1., 0., right - middle, False)
+    banks = np.ascontiguousarray(banks.T, dtype=np.float32)
+    banks.flags.writeable = False
+    return banks
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n_filt: int, n_coef: int) -> np.array:
+    """ Return the (n_filt, n_coef) orthonormal DCT-II matrix."""
+    n = np.arange(n_filt)
+    k = np.arange(n_coef)[:, np.newaxis]
+    dct = np.cos(np.pi * k * (2 * n + 1) / (2 * n_filt)) * np.sqrt(2 / n_filt)
+    dct[0] /= np.sqrt(2)
+    dct = np.ascontiguousarray(dct.T, dtype=np.float32)
+    dct.flags.writeable = False
+    return dct
+
+class STFT:
+    """ STFT frames a signal and computes batched power spectra, log-mel energies and MFCC from them.
+
+    Windows, mel filters and DCT matrices are computed once per parameter set and shared. Computation is done in float32.
+    """
+    def __init__(self, params: STFTParams):
+        self.params = params
+
+    def n_frames(self, n_samples: int) -> int:
+        """ Number of complete frames in n_samples samples"""
+        if n_samples < self.params.window_l:
+            return 0
+        return 1 + (n_samples - self.params.window_l) // self.params.stride_l
+
+    def frames(self, signal: np.array) -> np.array:
+        """ Return the (n_frames, window_l) frames of signal as a read only view."""
+        signal = np.ascontiguousarray(signal, dtype=np.float32)
+        return np.lib.stride_tricks.as_strided(signal,
+                                               shape=(self.n_frames(len(signal)), self.params.window_l),
+                                               strides=(signal.strides[0] * self.params.stride_l, signal.strides[0]),
+                                               writeable=False)
+
+    def power(self, signal: np.array) -> np.array:
+        """ Return the (n_frames, n_fft // 2 + 1) power spectra of signal frames."""
+        frames = self.frames(signal)
+        window = _window(self.params.window_type, self.params.window_l)
+        spectrum = np.fft.rfft(frames * window, n=self.params.n_fft)
+        return ((spectrum.real ** 2 + spectrum.imag ** 2) / self.params.n_fft).astype(np.float32)
+
+    def magnitude(self, power: np.array) -> np.array:
+        """ Return magnitude spectra from power spectra"""
+        return np.sqrt(power * self.params.n_fft)
+
+    def log_mel(self, power: np.array) -> np.array:
+        """ Return (n_frames, n_filt) log mel energies from power spectra"""
+        p = self.params
+        banks = _filterbank(p.filterbank, p.sample_rate, p.n_filt, power.shape[1], p.low_freq, p.high_freq)
+        return np.log(np.maximum(power @ banks, _LOG_FLOOR))
+
+    def mfcc(self, power: np.array) -> np.array:
+        """ Return (n_frames, n_coef) MFCC from power spectra, the first coefficient is the log energy if params.energy is set"""
+        p = self.params
+        coefs = self.log_mel(power) @ _dct_matrix(p.n_filt, p.n_coef + (not p.energy))
+        coefs[:, 0] = np.log(np.maximum(power.sum(axis=1), _LOG_FLOOR))
+        return coefs if p.energy else coefs[:, 1:]
+
+class _STFTFeatures(_Processor):
+    """ ABSTRACT _STFTFeatures is the base class of STFT based features elements.
+
+    Power spectra of each processed block are given to subscribers as callable(power, first_frame) before being transformed,
+    so other components (e.g. a spectral VAD) can use them without computing the STFT again.
+    """
+    _input_cap = [np.array]
+    _output_cap = [np.array]
+
+    def __init__(self, params: STFTParams = None):
+        """ Keyword arguments:
+        ==================
+        params (STFTParams) -- features parameters (default STFTParams())
+        """
+        _Processor.__init__(self)
+        self.params = params if params is not None else STFTParams()
+        self.stft = STFT(self.params)
+        self.subscribers = []
+        self._buffer = np.array([], dtype=np.float32)
+        self._frame_offset = 0
+
+    def subscribe(self, callback: callable):
+        """ Call callback(power, first_frame) with the power spectra of each processed block."""
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: callable):
+        self.subscribers.remove(callback)
+
+    def input(self, data: np.array):
+        with self._condition:
+            self._buffer = np.concatenate([self._buffer, np.asarray(data, dtype=np.float32)])
+        self._trace_input()
+        self._notify()
+
+    def _ready(self) -> bool:
+        return len(self._buffer) >= self.params.window_l
+
+    def _step(self):
+        self.process()
+
+    def stop(self):
+        self._buffer = np.array([], dtype=np.float32)
+        super(_STFTFeatures, self).stop()
+
+    def _transform(self, power: np.array) -> np.array:
+        """ Compute the output features from the (n_frames, n_fft // 2 + 1) power spectrum."""
+        pass
+
+    def compute(self, signal: np.array) -> np.array:
+        """ Offline features of a whole signal, same as the element output"""
+        return self._transform(self.stft.power(signal))
+
+    def process(self):
+        self._processing = True
+        trace = self._trace_start()
+        with self._condition:
+            buffer = self._buffer
+        power = self.stft.power(buffer)
+        with self._condition:
+            self._buffer = self._buffer[len(power) * self.params.stride_l:]
+        for callback in self.subscribers:
+            callback(power, self._frame_offset)
+        features = self._transform(power)
+        if trace is not None:
+            self.tracer.set_frame_geometry(self.params.stride_l, self.params.window_l)
+            self._trace_end(trace, frame=self._frame_offset, n_frames=len(features))
+        self._frame_offset += len(features)
+        if self._consumer is not None:
+            self._consumer.input(features)
+        self._processing = False
+
+class MFCC(_STFTFeatures):
+    """ MFCC extracts MFCC features with the STFT engine. With default STFTParams the features match SonopyMFCC.
+
+    Capacities
+    ===========
+    Input
+    -----
+    numpy.array -- signal normalized as a numpy.array of values.
+
+    Ouput
+    -----
+    numpy.array -- (n_frames, n_coef) MFCC features
+    """
+    __name__ = "mfcc"
+
+    def _transform(self, power: np.array) -> np.array:
+        return self.stft.mfcc(power)
+
+class LogMel(_STFTFeatures):
+    """ LogMel extracts log mel filterbank energies with the STFT engine.
+
+    Capacities
+    ===========
+    Input
+    -----
+    numpy.array -- signal normalized as a numpy.array of values.
+
+    Ouput
+    -----
+    numpy.array -- (n_frames, n_filt) log mel energies
+    """
+    __name__ = "logmel"
+
+    def _transform(self, power: np.array) -> np.array:
+        return self.stft.log_mel(power)
+
+class Spectrogram(_STFTFeatures):
+    """ Spectrogram outputs magnitude spectra computed with the STFT engine.
+
+    Capacities
+    ===========
+    Input
+    -----
+    numpy.array -- signal normalized as a numpy.array of values.
+
+    Ouput
+    -----
+    numpy.array -- (n_frames, n_fft // 2 + 1) magnitude spectra
+    """
+    __name__ = "spectrogram"
+
+    def _transform(self, power: np.array) -> np.array:
+        return self.stft.magnitude(power)
@@ -1,2 +1,8 @@
 from .kws import KWS
-from .kwsclient import KWSClient
\ No newline at end of file
+from .kwsclient import KWSClient
+from .multikws import KWSModel, MultiKWS
+from .scheduler import AdaptiveStride
+from .posteriors import PosteriorWriter, read_posteriors, sweep, det_curve
+from .modelregistry import ModelRegistry, ModelHandle, registry
+from .predcache import PredictionCache
+from .featring import FeatureRing, quantization_error
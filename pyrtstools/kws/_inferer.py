@@ -1,10 +1,15 @@
 import os
+from threading import Lock, local
 
 from tensorflow import lite
 from tensorflow.keras import models
 from tensorflow import saved_model, constant
 class Inferer(object):
-    """ Given a model path, generates a predict function based on model format"""
+    """ Given a model path, generates a predict function based on model format.
+    
+    predict is thread safe: Keras models are called under a lock and TensorflowLite models use one interpreter per thread
+    built from the same model buffer.
+    """
     def __init__(self, model_path: str):
         assert model_path.split('.')[-1] in ['pb', 'net','hdf5', 'tflite'], "Supported mode files are .pb, .net and .tflite"
         if model_path.endswith('.net') or model_path.endswith('.hdf5'):
@@ -20,7 +25,8 @@ class Inferer(object):
         self.model = models.load_model(model_path)
         self.model._make_predict_function()
         self.input_shape = self.model.get_input_shape_at(0)
-        return self.model.predict
+        self._lock = Lock()
+        return lambda x: self._kerasPredict(x)
     
     def _load_tensorflow_model(self, model_path : str):
         """ Load a Tensorflow flatbuffer model file and return predict function
@@ -34,21 +40,37 @@ class Inferer(object):
     def _load_tensorflowLite_model(self, model_path:str):
         """ Load a TensorflowLite compressed flatbuffer model file and return predict function
         """
-        self.model = lite.Interpreter(model_path=model_path)
-        self.model.allocate_tensors()
+        with open(model_path, 'rb') as f:
+            self._model_content = f.read() # Interpreters keep a reference to the buffer instead of copying it
+        self._local = local()
+        self.model = self._interpreter()
         self.input_details = self.model.get_input_details()
         self.output_details = self.model.get_output_details()
         self.input_shape = self.input_details[0]['shape']
         return lambda x : self._tflitePredict(x)
 
+    def _interpreter(self):
+        """ Return the TensorflowLite interpreter of the calling thread."""
+        interpreter = getattr(self._local, "interpreter", None)
+        if interpreter is None:
+            interpreter = lite.Interpreter(model_content=self._model_content)
+            interpreter.allocate_tensors()
+            self._local.interpreter = interpreter
+        return interpreter
+
+    def _kerasPredict(self, inputs):
+        with self._lock:
+            return self.model.predict(inputs)
+
     def _tfPredict(self, inputs):
         res = self.infer(constant(inputs.astype('float32')))
         return res[list(res)[0]].numpy()
 
     def _tflitePredict(self, inputs):
-        self.model.set_tensor(self.input_details[0]['index'], inputs.astype('float32'))
-        self.model.invoke()
-        return self.model.get_tensor(self.output_details[0]['index'])
+        interpreter = self._interpreter()
+        interpreter.set_tensor(self.input_details[0]['index'], inputs.astype('float32'))
+        interpreter.invoke()
+        return interpreter.get_tensor(self.output_details[0]['index'])
 
     def predict(self, inputs):
         return self._predict_fun(inputs)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+_INT8_HEADROOM = 1.5 # Range margin taken when an int8 scale is set or widened
+
+class FeatureRing:
+    """ FeatureRing stores the last features frames of a stream in a fixed circular array, optionally quantized.
+
+    Frames are stored as float32, float16 or int8. int8 frames use a symmetric scale per feature coefficient, estimated from the
+    first frames and widened (the stored frames being requantized) when a value falls out of range.
+    Frames are stored once, windows are dequantized straight into a float32 inference input buffer, in two parts when they
+    wrap around the end of the array. The capacity doubles if more frames than capacity are pending.
+    Not thread safe, the owner element holds its lock.
+    """
+    def __init__(self, feature_length: int, capacity: int = 256, dtype: str = "float16", scale: np.array = None):
+        """ Create an empty ring.
+
+        Keyword arguments:
+        ==================
+        feature_length (int) -- number of coefficients per frame
+
+        capacity (int) -- initial number of frames stored (default 256)
+
+        dtype (str) -- storage type: "float32", "float16" or "int8" (default "float16")
+
+        scale (np.array) -- int8 quantization step, scalar or per coefficient, estimated from the data if not set (default None)
+        """
+        assert dtype in _DTYPES, "dtype must be one of {}".format(list(_DTYPES))
+        assert capacity > 0, "capacity must be positive"
+        self.feature_length = feature_length
+        self.dtype = dtype
+        self._data = np.zeros((capacity, feature_length), dtype=_DTYPES[dtype])
+        self._start = 0 # Position of the oldest frame
+        self._len = 0
+        self.scale = None
+        if scale is not None:
+            self.scale = np.broadcast_to(np.asarray(scale, dtype=np.float32), (feature_length,)).copy()
+        self.n_rescale = 0 # Number of int8 scale widenings
+        self.n_grow = 0 # Number of capacity doublings
+
+    @property
+    def capacity(self) -> int:
+        return len(self._data)
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def nbytes(self) -> int:
+        """ Memory used by the stored frames"""
+        return self._data.nbytes
+
+    def _quantize(self, frames: np.array) -> np.array:
+        if self.dtype != "int8":
+            return frames.astype(self._data.dtype)
+        peak = np.abs(frames).max(axis=0)
+        if self.scale is None:
+            if not peak.any(): # Wait for actual features to estimate the scale
+                return np.zeros(frames.shape, dtype=np.int8)
+            self.scale = np.maximum(peak * _INT8_HEADROOM / 127, np.finfo(np.float32).tiny)
+        elif (peak > self.scale * 127).any():
+            new_scale = np.maximum(self.scale, peak * _INT8_HEADROOM / 127)
+            self._data[:] = np.round(self._data * (self.scale / new_scale)).astype(np.int8)
+            self.scale = new_scale
+            self.n_rescale += 1
+        return np.clip(np.round(frames / self.scale), -127, 127).astype(np.int8)
+
+    def append(self, frames: np.array):
+        """ Add frames, array of shape (n_frames, feature_length)."""
+        n = len(frames)
+        if n == 0:
+            return
+        while self._len + n > self.capacity:
+            self._grow()
+        quantized = self._quantize(frames)
+        capacity = self.capacity
+        pos = (self._start + self._len) % capacity
+        first = min(n, capacity - pos)
+        self._data[pos:pos + first] = quantized[:first]
+        self._data[:n - first] = quantized[first:]
+        self._len += n
+
+    def _grow(self):
+        capacity = self.capacity
+        data = np.zeros((2 * capacity, self.feature_length), dtype=self._data.dtype)
+        first = min(self._len, capacity - self._start)
+        data[:first] = self._data[self._start:self._start + first]
+        data[first:self._len] = self._data[:self._len - first]
+        self._data = data
+        self._start = 0
+        self.n_grow += 1
+
+    def drop(self, n: int):
+        """ Discard the n oldest frames."""
+        n = min(n, self._len)
+        self._start = (self._start + n) % self.capacity
+        self._len -= n
+
+    def clear(self, n_zeros: int = 0):
+        """ Discard every frame, then add n_zeros zero frames."""
+        self._start = 0
+        self._len = 0
+        if n_zeros > 0:
+            self.append(np.zeros((n_zeros, self.feature_length), dtype=np.float32))
+
+    def frames(self, start: int = 0, stop: int = None, out: np.array = None) -> np.array:
+        """ Return the frames [start, stop[ (indexes from the oldest frame) as float32, into out if given."""
+        stop = self._len if stop is None else stop
+        assert 0 <= start <= stop <= self._len, "frames out of range"
+        if out is None:
+            out = np.empty((stop - start, self.feature_length), dtype=np.float32)
+        pos = (self._start + start) % self.capacity
+        first = min(stop - start, self.capacity - pos)
+        self._dequantize(self._data[pos:pos + first], out[:first])
+        if first < stop - start: # The frames wrap around the end of the array
+            self._dequantize(self._data[:stop - start - first], out[first:])
+        return out
+
+    def _dequantize(self, data: np.array, out: np.array):
+        if self.dtype != "int8":
+            out[...] = data
+        elif self.scale is None: # Only zero frames were stored
+            out[...] = 0
+        else:
+            np.multiply(data, self.scale, out=out, casting="unsafe")
+
+    def windows(self, indexes: np.array, n_features: int, out: np.array = None) -> np.array:
+        """ Return the windows of n_features frames starting at indexes (from the oldest frame) as a float32 array
+        of shape (len(indexes), n_features, feature_length), into out if given.
+        """
+        if out is None:
+            out = np.empty((len(indexes), n_features, self.feature_length), dtype=np.float32)
+        for k, i in enumerate(indexes):
+            self.frames(i, i + n_features, out[k])
+        return out
+
+def quantization_error(features: np.array, n_features: int, dtype: str = "float16", predict: callable = None, threshold: float = 0.5) -> dict:
+    """ Compare the windows of a features stream stored with dtype to the full precision windows.
+
+    Returns the maximum and mean absolute feature error. If predict is given, also the maximum absolute posterior
+    difference and the ratio of windows whose thresholded decision (best class over threshold) differs.
+
+    Keyword arguments:
+    ==================
+    features (np.array) -- features frames (n_frames, feature_length), e.g. from compute_mfcc
+
+    n_features (int) -- number of frames per window
+
+    dtype (str) -- storage type, see FeatureRing (default "float16")
+
+    predict (callable(np.array) -> np.array) -- batch predict function, e.g. Inferer.predict (default None)
+
+    threshold (float) -- detection threshold used to compare decisions (default 0.5)
+    """
+    features = np.asarray(features, dtype=np.float64)
+    ring = FeatureRing(features.shape[1], capacity=max(len(features), 1), dtype=dtype)
+    ring.append(features)
+    quantized = ring.frames()
+    errors = np.abs(quantized - features)
+    result = {"dtype": dtype,
+              "max_error": float(errors.max()) if errors.size else 0.0,
+              "mean_error": float(errors.mean()) if errors.size else 0.0,
+              "bytes_per_frame": ring._data.itemsize * features.shape[1]}
+    if predict is not None and len(features) >= n_features:
+        indexes = np.arange(len(features) - n_features + 1)
+        reference = np.asarray(predict(np.array([features[i:i + n_features] for i in indexes], dtype=np.float32)))
+        preds = np.asarray(predict(ring.windows(indexes, n_features)))
+        decide = lambda p: np.where(p.max(axis=1) > threshold, p.argmax(axis=1), -1)
+        result["max_posterior_error"] = float(np.abs(preds - reference).max())
+        result["decision_mismatch"] = float((decide(preds) != decide(reference)).mean())
+    return result
@@ -17,10 +17,18 @@ You should have received a copy of the GNU Affero General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 """
+import time
+from threading import Thread
+
 import numpy as np
 
 from pyrtstools.base import _Consumer, InputError
 from pyrtstools.kws._inferer import Inferer
+from pyrtstools.kws.modelregistry import registry
+from pyrtstools.kws.posteriors import PosteriorWriter
+from pyrtstools.kws.featring import FeatureRing
+
+_RING_BACKLOG = 32 # Frames a FeatureRing holds beyond a window before growing
 
 class KWS(_Consumer):
     """ KWS element use tensorflow or keras model to spot hotword from input features.
@@ -39,7 +47,18 @@ class KWS(_Consumer):
                        on_detection : callable = lambda x, y: print("threshold reached for {} ({})".format(x, y), flush=True),
                        threshold: float = 0.5,
                        n_act_recquire: int = 1,
-                       debug: bool = False):
+                       debug: bool = False,
+                       vad_activity = None,
+                       vad_hangover: float = 0.5,
+                       vad_lookback: int = 10,
+                       vad_stride: int = 0,
+                       stride: int = 1,
+                       adaptive_stride = None,
+                       posterior_log: str = None,
+                       shared_model: bool = True,
+                       prediction_cache = None,
+                       feature_dtype: str = None,
+                       frame_shift: int = 512):
         """KWS is an interface allowing hotword spotting from audio features.
 
         Keyword arguments:
@@ -56,6 +75,30 @@ class KWS(_Consumer):
 
         debug (bool) -- Prompt every prediction (default false)
 
+        vad_activity (SpeechActivity) -- speech activity signal of a VADer (VADer.activity). If set, inference is skipped while there is no speech (default None)
+
+        vad_hangover (float) -- audio duration in s after the last speech window during which inference keeps running (default 0.5)
+
+        vad_lookback (int) -- number of windows before speech that are scored as speech (default 10)
+
+        vad_stride (int) -- if > 0, one window out of vad_stride is still scored while there is no speech (default 0)
+
+        stride (int) -- number of frames between two scored windows, n_act_recquire is divided by the stride (default 1)
+
+        adaptive_stride (AdaptiveStride) -- if set, the stride is adapted to the processing load and stride is ignored (default None)
+
+        posterior_log (str) -- if set, every prediction is recorded with its frame index and timestamp in this file (see kws.posteriors) (default None)
+
+        shared_model (bool) -- load the model through the process wide model registry, sharing it with the other elements using the same file (default True)
+
+        prediction_cache (PredictionCache) -- if set, predictions of already seen windows (e.g. silence) are taken from the cache (default None)
+
+        feature_dtype (str) -- if set, features are stored in a FeatureRing as "float32", "float16" or "int8" and windows are dequantized
+        into a reused float32 input buffer, see featring.quantization_error to check accuracy (default None: float64 buffer)
+
+        frame_shift (int) -- number of audio samples between two feature frames (MFCCParams.stride_l), to locate windows in the
+        vad_activity. Windows are gated on the audio they cover, whatever the lag between the VADer and KWS (default 512)
+
         Raises:
         =======
         AssertionError -- some parameter are wrongly formated or out of bounds
@@ -69,13 +112,16 @@ class KWS(_Consumer):
         if input_shape is not None:
             print("[KWS] WARNING: Input shape is depreciated, parameter ignored.")
 
-        self._inferer = Inferer(model_path)
+        self._inferer = registry.acquire(model_path) if shared_model else Inferer(model_path)
         model_input_shape = self._inferer.input_shape # Discard first value which is batch size 
         self._n_features = model_input_shape[1]
         self._max_batch = model_input_shape[0]
         self._feature_length = model_input_shape[2]
-        
-        self._feat_buffer = np.zeros((self._n_features, self._feature_length))
+
+        self._feature_dtype = feature_dtype
+        self._feat_ring = None # FeatureRing used instead of _feat_buffer if feature_dtype is set
+        self._input_buffer = None # Reused inference input with feature_dtype
+        self.clear_buffer()
         
         self.on_detection = on_detection
         self._threshold = threshold
@@ -83,49 +129,190 @@ class KWS(_Consumer):
         self.n_act_req = n_act_recquire
         self.n_act = 0
         self.last_kw_i = 0
+
+        self._frame_count = 0 # Number of feature frames received
+        self._new_frames = 0 # Number of feature frames received since last process
+        self._detection_window = None
+
+        assert vad_lookback >= 0 and vad_stride >= 0, "vad_lookback and vad_stride must be positive"
+        self._vad_activity = vad_activity
+        self._vad_hangover = vad_hangover
+        self._vad_lookback = vad_lookback
+        self._vad_stride = vad_stride
+        self._frame_shift = frame_shift
+        self._previous_speech = True # Last gated window was speech
+        self._retained = 0 # Number of windows kept in buffer until their lookback is known
+        self._n_skipped = 0
+
+        assert stride > 0, "stride must be positive"
+        self._adaptive_stride = adaptive_stride
+        self._stride = stride if adaptive_stride is None else adaptive_stride.stride
+
+        self._posterior_log = posterior_log
+        self._posterior_writer = None
+
+        self._pending_model = None # (model_path, inferer, on_ready) loaded by swap_model
+        self.prediction_cache = prediction_cache
    
     def clear_buffer(self):
-        """Fill the features buffer with zeros."""
-        self._feat_buffer = np.zeros((self._n_features, self._feature_length))
+        """Fill the features buffer with zeros and restart the activation count."""
+        with self._condition:
+            self.n_act = 0
+            if self._feature_dtype is None:
+                self._feat_buffer = np.zeros((self._n_features, self._feature_length))
+            elif self._feat_ring is None or self._feat_ring.feature_length != self._feature_length:
+                self._feat_ring = FeatureRing(self._feature_length, capacity=self._n_features + _RING_BACKLOG, dtype=self._feature_dtype)
+                self._feat_ring.clear(self._n_features)
+            else:
+                self._feat_ring.clear(self._n_features)
+            self._retained = 0
+
+    def _n_buffered(self) -> int:
+        return len(self._feat_buffer) if self._feat_ring is None else len(self._feat_ring)
+
+    def _inputs(self, n_windows: int) -> np.array:
+        """ Return the reused float32 input buffer for n_windows windows."""
+        shape = (self._n_features, self._feature_length)
+        if self._input_buffer is None or len(self._input_buffer) < n_windows or self._input_buffer.shape[1:] != shape:
+            self._input_buffer = np.empty((n_windows,) + shape, dtype=np.float32)
+        return self._input_buffer[:n_windows]
 
     def input(self, data: np.array):
         if not data.shape[1] == self._feature_length:
             raise InputError("Wrong feature shape {}".format(data.shape))
 
-        self._feat_buffer = np.concatenate((self._feat_buffer, data))
         with self._condition:
-            self._condition.notify()
-
-    def run(self):
-        self._running = True
-        while self._running:
-            if self._paused or self._processing:
-                with self._condition:
-                    self._condition.wait()
-                continue
-            if len(self._feat_buffer) >= self._n_features:
-                self.process()
+            if self._feat_ring is None:
+                self._feat_buffer = np.concatenate((self._feat_buffer, data))
             else:
-                with self._condition:
-                    self._condition.wait()
+                self._feat_ring.append(data)
+            self._frame_count += len(data)
+            self._new_frames += len(data)
+            self._trace_input()
+        self._notify()
+
+    def _ready(self) -> bool:
+        return self._pending_model is not None or (self._new_frames > 0 and self._n_buffered() >= self._n_features)
+
+    def _step(self):
+        if self._pending_model is not None:
+            self._apply_model()
+        if self._new_frames > 0 and self._n_buffered() >= self._n_features:
+            self.process()
+
+    def _finalize(self):
+        if self._posterior_writer is not None:
+            self._posterior_writer.close()
+        _release(self._inferer)
+        if self._pending_model is not None:
+            _release(self._pending_model[1])
+
+    def swap_model(self, model_path: str, on_ready: callable = None, shared_model: bool = True) -> Thread:
+        """ Replace the model without interrupting the stream.
+
+        The model is loaded and warmed up with a dummy inference on a background thread, then swapped in between two processing steps.
+        The features buffer is cleared only if the model input shape differs, activation counts are reset.
+        If the model fails to load, the error is given to on_error and the current model is kept.
+
+        Keyword arguments:
+        ==================
+        model_path (str) -- path to the new model, same formats as KWS
+
+        on_ready (callable(str)) -- called with model_path once the model is in use (default None)
+
+        shared_model (bool) -- load the model through the process wide model registry, a file updated in place since
+        it was loaded is loaded again (default True)
+
+        Returns the loading thread.
+        """
+        def load():
+            try:
+                inferer = registry.acquire(model_path) if shared_model else Inferer(model_path)
+            except Exception as err:
+                self._emit(self.on_error, err)
+                return
+            try:
+                shape = inferer.input_shape
+                inferer.predict(np.zeros((shape[0] or 1, shape[1], shape[2]), dtype=np.float32))
+            except Exception as err:
+                _release(inferer)
+                self._emit(self.on_error, err)
+                return
+            with self._condition:
+                replaced, self._pending_model = self._pending_model, (model_path, inferer, on_ready)
+            if replaced is not None:
+                _release(replaced[1])
+            self._notify()
+        loader = Thread(target=load, daemon=True)
+        loader.start()
+        return loader
+
+    def _apply_model(self):
+        with self._condition:
+            (model_path, inferer, on_ready), self._pending_model = self._pending_model, None
+            previous, self._inferer = self._inferer, inferer
+            shape = inferer.input_shape
+            self._max_batch = shape[0]
+            if shape[1] != self._n_features or shape[2] != self._feature_length:
+                self._n_features = shape[1]
+                self._feature_length = shape[2]
+                self.clear_buffer()
+                self._new_frames = 0
+            self.n_act = 0
+            self.last_kw_i = 0
+        if self.prediction_cache is not None:
+            self.prediction_cache.clear()
+        _release(previous)
+        if on_ready is not None:
+            on_ready(model_path)
 
     def process(self):
         self._processing = True
-        inputs = np.array([np.array(self._feat_buffer[i:i+self._n_features]) for i in range(len(self._feat_buffer) - self._n_features + 1)])
-        self._feat_buffer = self._feat_buffer[len(inputs):]
-        if self._max_batch is not None:
-            preds = np.concatenate([self._inferer.predict(inp[np.newaxis]) for inp in inputs])
+        trace = self._trace_start()
+        with self._condition:
+            buffer = self._feat_buffer if self._feat_ring is None else None
+            n_buffered = self._n_buffered()
+            first_frame = self._frame_count - n_buffered # Frame index of buffer[0]
+            self._new_frames = 0
+        n_windows = n_buffered - self._n_features + 1
+        n_new = n_windows - self._retained
+        start_t = time.perf_counter()
+        indexes, resets = self._gate(first_frame, n_windows)
+        with self._condition:
+            if self._feat_ring is None:
+                self._feat_buffer = self._feat_buffer[n_windows - self._retained:]
+            else: # Frames appended meanwhile do not move the windows, dequantize them before dropping
+                inputs = self._feat_ring.windows(indexes, self._n_features, self._inputs(len(indexes)))
+                self._feat_ring.drop(n_windows - self._retained)
+        if len(indexes) == 0:
+            self._update_stride(start_t, n_new)
+            self._processing = False
+            return
+        if buffer is not None:
+            inputs = np.array([buffer[i:i+self._n_features] for i in indexes])
+        if self.prediction_cache is not None:
+            preds = self.prediction_cache.predict(inputs, self._predict)
         else:
-            preds = self._inferer.predict(inputs)
+            preds = self._predict(inputs)
         if self._debug:
             print(preds, flush=True)
-        for pred in preds:
+        if self._posterior_log is not None:
+            self._log_posteriors(first_frame + indexes, preds)
+        n_act_req = -(-self.n_act_req // self._stride) # Activations are counted on scored windows only
+        for i, pred, reset in zip(indexes.tolist(), preds, resets.tolist()):
+            if reset:
+                self.n_act = 0
             if any(pred > self._threshold):
                 kws_i = np.argmax(pred)
                 if kws_i == self.last_kw_i:
                     self.n_act += 1
-                    if self.n_act >= self.n_act_req:
-                        self.on_detection(kws_i, max(pred))
+                    if self.n_act >= n_act_req:
+                        self._detection_window = (first_frame + i, first_frame + i + self._n_features)
+                        if self.tracer is not None:
+                            self._trace_end(trace, frame=first_frame, n_windows=len(indexes), last_frame=first_frame + i + self._n_features - 1)
+                            trace = None
+                            self.tracer.detection(self.__name__, frame=first_frame + i + self._n_features - 1)
+                        self._emit(self.on_detection, kws_i, max(pred))
                         self.clear_buffer()
                         break
                 else:
@@ -133,11 +320,81 @@ class KWS(_Consumer):
                     self.last_kw_i = kws_i
             else:
                 self.n_act = 0       
-            
+        self._update_stride(start_t, n_new)
+        self._trace_end(trace, frame=first_frame, n_windows=len(indexes), last_frame=first_frame + int(indexes[-1]) + self._n_features - 1)
         self._processing = False
-        
-        with self._condition:
-            self._condition.notify()
+
+    def _predict(self, inputs: np.array) -> np.array:
+        if self._max_batch is not None:
+            return np.concatenate([self._inferer.predict(inp[np.newaxis]) for inp in inputs])
+        return self._inferer.predict(inputs)
+
+    def _gate(self, first_frame: int, n_windows: int) -> tuple:
+        """ Return the indexes of the windows to score and, for each, whether the activation count restarts before it.
+
+        A window is speech if the VAD reports activity at its last sample, or at one of the vad_lookback next windows.
+        Speech windows are scored with the stride, other windows with the vad_stride. Windows after the last active one are
+        retained until their vad_lookback next windows are received, decisions do not depend on processing steps.
+        """
+        indexes = np.arange(n_windows)
+        ends = first_frame + indexes + self._n_features # Frame following each window
+        if self._vad_activity is None:
+            self._retained = 0
+            if self._stride > 1:
+                indexes = indexes[ends % self._stride == 0]
+            return indexes, np.zeros(len(indexes), dtype=bool)
+        active = self._vad_activity.active(self._vad_hangover, ends * self._frame_shift)
+        next_active = np.minimum.accumulate(np.where(active, indexes, n_windows)[::-1])[::-1]
+        last_active = int(indexes[active][-1]) if active.any() else -1
+        self._retained = min(self._vad_lookback, n_windows - 1 - last_active)
+        n_decided = n_windows - self._retained
+        speech = (next_active - indexes <= self._vad_lookback)[:n_decided]
+        ends = ends[:n_decided]
+        scored = ends % self._stride == 0 if self._stride > 1 else np.ones(n_decided, dtype=bool)
+        no_speech_scored = ends % self._vad_stride == 0 if self._vad_stride > 0 else np.zeros(n_decided, dtype=bool)
+        scored = np.where(speech, scored, no_speech_scored)
+        self._n_skipped += int(np.count_nonzero(~speech & ~scored))
+        # The activation count restarts on windows without speech and after them
+        previous = np.concatenate([[self._previous_speech], speech[:-1]])
+        if n_decided > 0:
+            self._previous_speech = bool(speech[-1])
+        return indexes[:n_decided][scored], (~speech | ~previous)[scored]
+
+    def _log_posteriors(self, frames: np.array, preds: np.array):
+        if self._posterior_writer is None:
+            self._posterior_writer = PosteriorWriter(self._posterior_log, preds.shape[1])
+        elif self._posterior_writer.n_outputs != preds.shape[1]:
+            print("[KWS] WARNING: Model outputs changed, posterior logging stopped.")
+            self._posterior_writer.close()
+            self._posterior_writer = None
+            self._posterior_log = None
+            return
+        self._posterior_writer.write(frames, time.time(), preds)
+
+    def _update_stride(self, start_t: float, n_frames: int):
+        if self._adaptive_stride is not None:
+            self._stride = self._adaptive_stride.update(time.perf_counter() - start_t, n_frames, self._new_frames)
+
+    @property
+    def stride(self) -> int:
+        """ Current number of frames between two scored windows"""
+        return self._stride
+
+    @property
+    def n_skipped(self) -> int:
+        """ Number of windows not scored when received because no speech was detected"""
+        return self._n_skipped
+
+    @property
+    def frame_count(self) -> int:
+        """ Number of feature frames received since the element creation"""
+        return self._frame_count
+
+    @property
+    def detection_window(self) -> tuple:
+        """ (first_frame, end_frame) indexes of the features window that triggered the last detection, None before any detection.
+        Use AudioHistory.frames_snapshot to retrieve the corresponding audio from on_detection."""
+        return self._detection_window
 
     @property
     def threshold(self):
@@ -145,6 +402,11 @@ class KWS(_Consumer):
     
     @threshold.setter
     def threshold(self, value: float):
-        if value >= 0.0 and value <= 1.0:
-            raise ValueError("Threshold must be between ]0.0,1.0]")
-        self._threshold = value
\ No newline at end of file
+        if not (value >= 0.0 and value <= 1.0):
+            raise ValueError("Threshold must be between [0.0,1.0]")
+        self._threshold = value
+
+def _release(inferer):
+    """ Release a model acquired from the model registry, models loaded privately are left to the garbage collector."""
+    if hasattr(inferer, "release"):
+        inferer.release()
\ No newline at end of file
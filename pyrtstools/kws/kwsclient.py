@@ -18,11 +18,14 @@ You should have received a copy of the GNU Affero General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 import json
+import time
 import requests
+from threading import Thread
 
 import numpy as np
 
 from pyrtstools.base import _Consumer, InputError
+from pyrtstools.kws.featring import FeatureRing
 
 class KWSClient(_Consumer):
     """KeyWord Spotting client meant to connect to a tensorflow serving API """
@@ -35,7 +38,14 @@ class KWSClient(_Consumer):
                  on_detection: callable = lambda x, y: print("threshold reached for {} ({})".format(x, y)),
                  threshold: float = 0.5,
                  inference_step: int = 1, 
-                 on_error: callable = lambda x : print(x)):
+                 on_error: callable = lambda x : print(x),
+                 vad_activity = None,
+                 vad_hangover: float = 0.5,
+                 vad_stride: int = 0,
+                 adaptive_stride = None,
+                 prediction_cache = None,
+                 feature_dtype: str = None,
+                 frame_shift: int = 512):
         """ Create a KWS client
 
         Keyword arguments:
@@ -52,6 +62,20 @@ class KWSClient(_Consumer):
 
         on_error (callable(str)) -- called when an error occurs.
 
+        vad_activity (SpeechActivity) -- speech activity signal of a VADer (VADer.activity). If set, requests are skipped while there is no speech (default None)
+
+        vad_hangover (float) -- audio duration in s after the last speech window during which requests keep being sent (default 0.5)
+
+        vad_stride (int) -- if > 0, one request out of vad_stride is still sent while there is no speech (default 0)
+
+        adaptive_stride (AdaptiveStride) -- if set, inference_step is adapted to the request time within the scheduler bounds (default None)
+
+        prediction_cache (PredictionCache) -- if set, requests for already seen windows (e.g. silence) are answered from the cache (default None)
+
+        feature_dtype (str) -- if set, features are stored in a FeatureRing as "float32", "float16" or "int8" and dequantized into a reused float32 buffer (default None: float64 buffer)
+
+        frame_shift (int) -- number of audio samples between two feature frames (MFCCParams.stride_l), to locate windows in the vad_activity (default 512)
+
         Raises:
         =======
         AssertionError(str) -- Wrong input shape
@@ -59,10 +83,9 @@ class KWSClient(_Consumer):
         ValueError(str) -- Wrong parameter value
         """
         _Consumer.__init__(self)
-        self._step = 0
+        self._new_frames = 0
         self._inference_step = 1
         self._threshold = 0.5
-        self._feat_buffer = np.array([[0.0] * input_shape[1]] * input_shape[0])
 
         assert len(input_shape) == 2, "input shape must be (n_features, feature_length)"
         assert threshold >= 0 and threshold <= 1, "threshold must be between [0.0,1.0]"
@@ -71,69 +94,181 @@ class KWSClient(_Consumer):
         self.uri = request_uri
         self._n_features = input_shape[0]
         self._feature_length = input_shape[1]
+        self._feature_dtype = feature_dtype
+        self._feat_ring = None # FeatureRing used instead of _feat_buffer if feature_dtype is set
+        self._input_buffer = None
+        self.clear_buffer()
         self.on_detection = on_detection
         self.threshold = threshold
         self._inf_step = inference_step
         self.on_error = on_error
 
+        assert vad_stride >= 0, "vad_stride must be positive"
+        self._vad_activity = vad_activity
+        self._vad_hangover = vad_hangover
+        self._vad_stride = vad_stride
+        self._frame_shift = frame_shift
+        self._gated = False
+        self._gated_c = 0
+        self._n_skipped = 0
+        self._frame_count = 0
+        self._adaptive_stride = adaptive_stride
+        if adaptive_stride is not None:
+            self._inf_step = adaptive_stride.stride
+        self._pending_endpoint = None # (request_uri, input_shape, on_ready) set by swap_endpoint
+        self.prediction_cache = prediction_cache
+
     
-    def _submit(self) -> np.array:
-        data = json.dumps({"signature_name": "serving_default", "instances": [self._feat_buffer.tolist()]})
+    def _submit(self, uri: str = None, features: np.array = None) -> np.array:
+        features = self._feat_buffer if features is None else features
+        data = json.dumps({"signature_name": "serving_default", "instances": [features.tolist()]})
         try:
-            json_response = requests.post(self.uri, data=data, headers=self._header)
+            json_response = requests.post(self.uri if uri is None else uri, data=data, headers=self._header)
         except Exception as err:
-            self.on_error(err)
+            self._emit(self.on_error, err)
         else:
             if json_response.status_code == 200:
                 try:
                     pred = np.array(json.loads(json_response.text)['predictions'])
                     return pred
                 except json.JSONDecodeError:
-                    self.on_error("Could not parse response json")
+                    self._emit(self.on_error, "Could not parse response json")
             else:
-                self.on_error("Could not process request {}: {}".format(json_response.status_code, json_response.text))
+                self._emit(self.on_error, "Could not process request {}: {}".format(json_response.status_code, json_response.text))
 
     def input(self, data: np.array):
         if not data.shape[1] == self._feature_length:
             raise InputError("Wrong feature shape {}".format(data.shape))
-        if len(data) > self._n_features:
+        if self._feat_ring is not None:
+            n = min(len(data), self._n_features)
+            with self._condition:
+                self._feat_ring.drop(len(self._feat_ring) + n - self._n_features)
+                self._feat_ring.append(data[-n:])
+        elif len(data) > self._n_features:
             self._feat_buffer = data[-self._n_features:]
         else:
             self._feat_buffer = np.concatenate((self._feat_buffer[len(data):], data))
-        self._step += len(data)
+        self._new_frames += len(data)
+        self._frame_count += len(data)
+        self._trace_input()
+        self._notify()
+
+    def _ready(self) -> bool:
+        return self._pending_endpoint is not None or self._inference_due()
+
+    def _inference_due(self) -> bool:
+        return self._new_frames >= self._inf_step or (self._gated and self._new_frames > 0 and self._speech())
+
+    def _step(self):
+        if self._pending_endpoint is not None:
+            self._apply_endpoint()
+        if self._inference_due():
+            self.process()
+
+    def swap_endpoint(self, request_uri: str, input_shape: tuple = None, on_ready: callable = None) -> Thread:
+        """ Replace the serving endpoint without interrupting the stream.
+
+        A dummy request is sent to the new endpoint on a background thread, on success the endpoint is swapped in between two requests.
+        The features buffer is cleared only if the input shape changes. On failure the error is given to on_error and the current endpoint is kept.
+
+        Keyword arguments:
+        ==================
+        request_uri (str) -- tensorflow serving API uri
+
+        input_shape (tuple(int, int)) -- input expected by the new endpoint (default current input shape)
+
+        on_ready (callable(str)) -- called with request_uri once the endpoint is in use (default None)
+
+        Returns the warm up thread.
+        """
+        input_shape = (self._n_features, self._feature_length) if input_shape is None else tuple(input_shape)
+        assert len(input_shape) == 2, "input shape must be (n_features, feature_length)"
+        def warm_up():
+            if self._submit(request_uri, np.zeros(input_shape)) is None:
+                return # Error already reported by _submit
+            with self._condition:
+                self._pending_endpoint = (request_uri, input_shape, on_ready)
+            self._notify()
+        thread = Thread(target=warm_up, daemon=True)
+        thread.start()
+        return thread
 
+    def _apply_endpoint(self):
         with self._condition:
-            self._condition.notify()
-
-    def run(self):
-        self._running = True
-        while self._running:
-            if self._paused or self._processing:
-                with self._condition:
-                    self._condition.wait()
-                    continue
-            if self._step >= self._inf_step:
-                self.process()
-            else:
-                with self._condition:
-                    self._condition.wait()
+            (request_uri, input_shape, on_ready), self._pending_endpoint = self._pending_endpoint, None
+            self.uri = request_uri
+            if input_shape != (self._n_features, self._feature_length):
+                self._n_features, self._feature_length = input_shape
+                self.clear_buffer()
+        if self.prediction_cache is not None:
+            self.prediction_cache.clear()
+        if on_ready is not None:
+            on_ready(request_uri)
 
     def process(self):
         self._processing = True
-        self._step = 0
-        pred = self._submit()
-        if any(pred > self._threshold):
-            self.on_detection(np.argmax(pred), max(pred))
+        n_frames = self._new_frames
+        self._new_frames = 0
+        start_t = time.perf_counter()
+        if self._skip():
+            self._n_skipped += 1
+            self._processing = False
+            return
+        trace = self._trace_start()
+        if self._feat_ring is None:
+            features = self._feat_buffer
+        else:
+            with self._condition:
+                features = self._feat_ring.frames(out=self._input_buffer)
+        pred = None if self.prediction_cache is None else self.prediction_cache.get(features)
+        if pred is None:
+            pred = self._submit(features=features)
+            if pred is not None and self.prediction_cache is not None:
+                self.prediction_cache.put(features, pred)
+        self._trace_end(trace, frame=self._frame_count - 1)
+        if pred is not None and any(pred > self._threshold):
+            if self.tracer is not None:
+                self.tracer.detection(self.__name__, frame=self._frame_count - 1)
+            self._emit(self.on_detection, np.argmax(pred), max(pred))
             self.clear_buffer() #Prevent successive multiple activations
-        
+        if self._adaptive_stride is not None:
+            self._inf_step = self._adaptive_stride.update(time.perf_counter() - start_t, n_frames, self._new_frames)
         self._processing = False
-        with self._condition:
-            self._condition.notify()
+
+    def _speech(self) -> bool:
+        """ Return True if the VAD reports activity at the last sample of the current window."""
+        return self._vad_activity.active(self._vad_hangover, self._frame_count * self._frame_shift)
+
+    def _skip(self) -> bool:
+        """ Return True if the request must be skipped according to speech activity."""
+        if self._vad_activity is None or self._speech():
+            self._gated = False
+            return False
+        self._gated = True
+        self._gated_c += 1
+        return self._vad_stride == 0 or self._gated_c % self._vad_stride != 0
+
+    @property
+    def inference_step(self) -> int:
+        """ Current number of frames between two requests"""
+        return self._inf_step
+
+    @property
+    def n_skipped(self) -> int:
+        """ Number of requests skipped because no speech was detected"""
+        return self._n_skipped
 
     def clear_buffer(self):
         """Fill the features buffer with zeros."""
-        self._feat_buffer = np.array([[0.0] * self._feature_length] * self._n_features)
-        self._step = 0
+        if self._feature_dtype is None:
+            self._feat_buffer = np.zeros((self._n_features, self._feature_length))
+        else:
+            with self._condition:
+                if self._feat_ring is None or self._feat_ring.feature_length != self._feature_length:
+                    self._feat_ring = FeatureRing(self._feature_length, capacity=self._n_features, dtype=self._feature_dtype)
+                self._feat_ring.clear(self._n_features)
+                self._input_buffer = np.empty((self._n_features, self._feature_length), dtype=np.float32)
+        self._new_frames = 0
 
     @property
     def threshold(self) -> float:
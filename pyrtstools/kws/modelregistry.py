@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+from threading import Lock, Event
+
+class ModelHandle:
+    """ ModelHandle gives access to a model loaded by a ModelRegistry. predict is thread safe."""
+    def __init__(self, registry, key: tuple, inferer):
+        self._registry = registry
+        self._key = key
+        self._inferer = inferer
+        self.model_path = key[0]
+        self.input_shape = inferer.input_shape
+
+    def predict(self, inputs):
+        return self._inferer.predict(inputs)
+
+    def release(self):
+        """ Release the handle, the model is freed when its last handle is released. Successive calls have no effect."""
+        if self._inferer is not None:
+            self._inferer = None
+            self._registry._release(self._key)
+
+    @property
+    def released(self) -> bool:
+        return self._inferer is None
+
+class _Entry:
+    def __init__(self):
+        self.inferer = None
+        self.count = 0 # Number of handles, including the acquires waiting for the model
+        self.loaded = Event() # Set once the model is loaded or has failed to load
+        self.error = None
+
+class ModelRegistry:
+    """ ModelRegistry loads each model file once and shares it between the elements using it.
+
+    Models are reference counted: acquire returns a new handle on the model, loading it if needed,
+    and the model is dropped when all its handles have been released. A model is loaded outside the registry lock,
+    concurrent acquires of the same model wait for it while other models stay available.
+    Models are identified by file path, modification time and size: a model file updated in place is loaded again
+    by the next acquire, handles on the previous version keep using it until released.
+    KWS and MultiKWS use the process wide registry pyrtstools.kws.registry by default.
+    """
+    def __init__(self, loader: callable = None):
+        """ Create an empty registry.
+
+        Keyword arguments:
+        ==================
+        loader (callable(str)) -- function loading a model file into an object with input_shape and a thread safe predict method (default Inferer)
+        """
+        self._loader = loader
+        self._lock = Lock()
+        self._models = {} # (key, modification time, size) -> _Entry
+
+    @staticmethod
+    def key(model_path: str) -> str:
+        return os.path.realpath(model_path)
+
+    def acquire(self, model_path: str) -> ModelHandle:
+        """ Return a handle on the model, loading it if it is not already loaded.
+
+        Raises:
+        =======
+        FileNotFoundError -- model file not found
+        """
+        path = self.key(model_path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise FileNotFoundError("Model file {} not found".format(model_path))
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._models.get(key)
+            loading = entry is None
+            if loading:
+                entry = self._models[key] = _Entry()
+            entry.count += 1
+        if loading:
+            try:
+                entry.inferer = self._load(path)
+            except BaseException as err:
+                entry.error = err
+                with self._lock:
+                    if self._models.get(key) is entry:
+                        del self._models[key]
+                raise
+            finally:
+                entry.loaded.set()
+        else:
+            entry.loaded.wait()
+            if entry.error is not None:
+                raise entry.error
+        return ModelHandle(self, key, entry.inferer)
+
+    def _load(self, model_path: str):
+        if self._loader is None:
+            from pyrtstools.kws._inferer import Inferer
+            self._loader = Inferer
+        return self._loader(model_path)
+
+    def _release(self, key: tuple):
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is None:
+                return
+            entry.count -= 1
+            if entry.count <= 0:
+                del self._models[key]
+
+    def n_references(self, model_path: str) -> int:
+        """ Number of handles on a model, all versions of the file included, 0 if the model is not loaded."""
+        path = self.key(model_path)
+        with self._lock:
+            return sum(entry.count for key, entry in self._models.items() if key[0] == path)
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, model_path: str):
+        return self.n_references(model_path) > 0
+
+registry = ModelRegistry()
@@ -0,0 +1,194 @@
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import os
+
+import numpy as np
+
+from pyrtstools.base import _Consumer, InputError
+from pyrtstools.kws._inferer import Inferer
+from pyrtstools.kws.modelregistry import registry
+
+class KWSModel:
+    """ KWSModel holds a model and its detection parameters for MultiKWS."""
+    def __init__(self, model_path: str,
+                       threshold: float = 0.5,
+                       n_act_recquire: int = 1,
+                       name: str = None,
+                       shared_model: bool = True):
+        """ Load a model.
+
+        Keyword arguments:
+        ==================
+        model_path (str) -- absolute path to a tensorflow (.pb), keras model (.net/ .hdf5 /.h5) or tensorflowLite (.tflite)
+
+        threshold (float) -- output activation threshold, must be between [0.0, 1.0] (default 0.5)
+
+        n_act_recquire: (int) -- Number of successive activation recquired to detect (default 1)
+
+        name (str) -- model name given to on_detection (default model file name)
+
+        shared_model (bool) -- load the model through the process wide model registry (default True)
+        """
+        assert threshold >= 0 and threshold <= 1, "threshold must be between [0.0,1.0]"
+        assert n_act_recquire > 0, "n_act_recquire must be positive"
+        self.name = name if name is not None else os.path.basename(model_path)
+        self.threshold = threshold
+        self.n_act_req = n_act_recquire
+        self.n_act = 0
+        self.last_kw_i = 0
+
+        self._inferer = registry.acquire(model_path) if shared_model else Inferer(model_path)
+        self.n_features = self._inferer.input_shape[1]
+        self.max_batch = self._inferer.input_shape[0]
+        self.feature_length = self._inferer.input_shape[2]
+
+    def predict(self, inputs: np.array) -> np.array:
+        if self.max_batch is not None:
+            return np.concatenate([self._inferer.predict(inp[np.newaxis]) for inp in inputs])
+        return self._inferer.predict(inputs)
+
+    def update(self, pred: np.array) -> bool:
+        """ Update activation count with a prediction, returns True if the model detects. Same logic as KWS."""
+        if any(pred > self.threshold):
+            kws_i = np.argmax(pred)
+            if kws_i == self.last_kw_i:
+                self.n_act += 1
+                return self.n_act >= self.n_act_req
+            self.n_act = 1
+            self.last_kw_i = kws_i
+            return False
+        self.n_act = 0
+        return False
+
+    def reset(self):
+        self.n_act = 0
+
+    def release(self):
+        """ Release the model if it is shared, called when MultiKWS is closed."""
+        if hasattr(self._inferer, "release"):
+            self._inferer.release()
+
+class MultiKWS(_Consumer):
+    """ MultiKWS element runs several keyword spotting models on a single features buffer.
+
+    Sliding windows are built once for all models, a model expecting less frames than the longest one
+    receives the last frames of each window.
+
+    Capacities
+    ===========
+    Input
+    -----
+    numpy.array -- input features. Input data shape must be (?, feature_length) with feature_length shared by all models
+    """
+    __name__ = "multikws"
+    _input_cap = [np.array]
+
+    def __init__(self, models: list,
+                       on_detection: callable = lambda n, x, y: print("threshold reached for {}: {} ({})".format(n, x, y), flush=True),
+                       debug: bool = False):
+        """ MultiKWS is an interface allowing hotword spotting with several models from audio features.
+
+        Keyword arguments:
+        ==================
+        models (list) -- list of KWSModel or of model paths (loaded with default KWSModel parameters)
+
+        on_detection (callable(str, int, float)) -- called when a model detects. Arguments are callable(model name, index, value)
+
+        debug (bool) -- Prompt every prediction (default false)
+
+        Raises:
+        =======
+        AssertionError -- models are missing or have incompatible feature length
+
+        FileNotFoundError -- model file not found
+        """
+        _Consumer.__init__(self)
+        assert len(models) > 0, "At least one model is recquired"
+        self.models = [m if isinstance(m, KWSModel) else KWSModel(m) for m in models]
+        assert len(set([m.feature_length for m in self.models])) == 1, "All models must share the same feature length"
+        self._debug = debug
+        self._n_features = max([m.n_features for m in self.models])
+        self._feature_length = self.models[0].feature_length
+        self._feat_buffer = np.zeros((self._n_features, self._feature_length))
+        self.on_detection = on_detection
+
+        self._frame_count = 0 # Number of feature frames received
+        self._detection_window = None
+
+    def clear_buffer(self):
+        """Fill the features buffer with zeros and reset activations."""
+        self._feat_buffer = np.zeros((self._n_features, self._feature_length))
+        for model in self.models:
+            model.reset()
+
+    def input(self, data: np.array):
+        if not data.shape[1] == self._feature_length:
+            raise InputError("Wrong feature shape {}".format(data.shape))
+
+        with self._condition:
+            self._feat_buffer = np.concatenate((self._feat_buffer, data))
+            self._frame_count += len(data)
+        self._notify()
+
+    def _ready(self) -> bool:
+        return len(self._feat_buffer) >= self._n_features
+
+    def _step(self):
+        self.process()
+
+    def _finalize(self):
+        for model in self.models:
+            model.release()
+
+    def process(self):
+        self._processing = True
+        with self._condition:
+            buffer = np.ascontiguousarray(self._feat_buffer, dtype=np.float32)
+            n_windows = len(buffer) - self._n_features + 1
+            self._feat_buffer = self._feat_buffer[n_windows:]
+            first_frame = self._frame_count - len(buffer)
+        windows = np.lib.stride_tricks.as_strided(buffer,
+                                                  shape=(n_windows, self._n_features, self._feature_length),
+                                                  strides=(buffer.strides[0],) + buffer.strides,
+                                                  writeable=False)
+        preds = [m.predict(windows[:, self._n_features - m.n_features:]) for m in self.models]
+        if self._debug:
+            for model, pred in zip(self.models, preds):
+                print(model.name, pred, flush=True)
+        for i in range(n_windows):
+            detections = [(m, preds[j][i]) for j, m in enumerate(self.models) if m.update(preds[j][i])]
+            if len(detections) > 0:
+                self._detection_window = (first_frame + i, first_frame + i + self._n_features)
+                for model, pred in detections:
+                    self._emit(self.on_detection, model.name, np.argmax(pred), max(pred))
+                self.clear_buffer()
+                break
+
+        self._processing = False
+
+    @property
+    def frame_count(self) -> int:
+        """ Number of feature frames received since the element creation"""
+        return self._frame_count
+
+    @property
+    def detection_window(self) -> tuple:
+        """ (first_frame, end_frame) indexes of the features window that triggered the last detection, None before any detection."""
+        return self._detection_window
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import struct
+import argparse
+
+import numpy as np
+
+_MAGIC = b'RTSP'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHH') # magic, version, number of outputs
+
+def _record_dtype(n_outputs: int) -> np.dtype:
+    return np.dtype([('frame', '<i8'), ('time', '<f8'), ('posteriors', '<f4', (n_outputs,))])
+
+class PosteriorWriter:
+    """ PosteriorWriter appends model posteriors to a compact binary file.
+
+    Each record holds the first frame index of the scored window, the inference timestamp and the model outputs as float32.
+    Files are read back with read_posteriors.
+    """
+    def __init__(self, file_path: str, n_outputs: int):
+        """ Create a posterior file.
+
+        Keyword arguments:
+        ==================
+        file_path (str) -- file to be written
+
+        n_outputs (int) -- number of model outputs
+        """
+        self.file_path = file_path
+        self.n_outputs = n_outputs
+        self._dtype = _record_dtype(n_outputs)
+        self._f = open(file_path, 'wb')
+        self._f.write(_HEADER.pack(_MAGIC, _VERSION, n_outputs))
+
+    def write(self, frames, timestamp: float, posteriors: np.array):
+        """ Append posteriors of windows starting at frames, computed at timestamp."""
+        records = np.empty(len(frames), dtype=self._dtype)
+        records['frame'] = frames
+        records['time'] = timestamp
+        records['posteriors'] = posteriors
+        self._f.write(records.tobytes())
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+def read_posteriors(file_path: str) -> np.array:
+    """ Return a posterior file records as a memory-mapped structured array with fields frame, time and posteriors.
+
+    Raises:
+    =======
+    ValueError -- not a posterior file
+    """
+    with open(file_path, 'rb') as f:
+        magic, version, n_outputs = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError("{} is not a posterior file".format(file_path))
+    return np.memmap(file_path, dtype=_record_dtype(n_outputs), mode='r', offset=_HEADER.size)
+
+class SweepResult:
+    """ Detections obtained by replaying the KWS detection logic over a grid of operating points."""
+    def __init__(self, thresholds: np.array, n_act_reqs: np.array, frames: np.array, detections: list):
+        self.thresholds = thresholds # (K,) threshold of each operating point
+        self.n_act_reqs = n_act_reqs # (K,) n_act_req of each operating point
+        self.frames = frames # (T,) first frame index of each window
+        self.detections = detections # K arrays of (window index, keyword index)
+
+    @property
+    def counts(self) -> np.array:
+        """ Number of detections of each operating point"""
+        return np.array([len(d) for d in self.detections])
+
+    def evaluate(self, events: np.array, frame_duration: float = 0.032, tolerance: int = 0, keyword: int = None) -> dict:
+        """ Compute miss rate and false alarms per hour of each operating point.
+
+        Keyword arguments:
+        ==================
+        events (numpy.array) -- (N, 2) array of [start_frame, end_frame] of the true keyword occurences
+
+        frame_duration (float) -- duration in s between two feature frames, MFCCParams.stride_d (default 0.032)
+
+        tolerance (int) -- number of frames after an event end during which a detection is still a hit (default 0)
+
+        keyword (int) -- if set, only detections of this keyword index are considered (default None)
+
+        Returns a dictionnary of (K,) arrays: threshold, n_act_req, miss_rate, fa_per_hour, hits, false_alarms.
+        """
+        events = np.asarray(events, dtype=np.int64).reshape(-1, 2)
+        events = events[np.argsort(events[:, 0])]
+        hours = len(self.frames) * frame_duration / 3600
+        hits = np.zeros(len(self.detections), dtype=np.int64)
+        false_alarms = np.zeros(len(self.detections), dtype=np.int64)
+        for k, detections in enumerate(self.detections):
+            if keyword is not None:
+                detections = detections[detections[:, 1] == keyword]
+            # A detection is reported on the window end frame
+            det_frames = self.frames[detections[:, 0]] if len(detections) else np.zeros(0, dtype=np.int64)
+            ev = np.searchsorted(events[:, 0], det_frames, side='right') - 1
+            hit = (ev >= 0) & (det_frames <= events[np.maximum(ev, 0), 1] + tolerance)
+            hits[k] = len(np.unique(ev[hit]))
+            false_alarms[k] = np.count_nonzero(~hit)
+        return {"threshold": self.thresholds,
+                "n_act_req": self.n_act_reqs,
+                "hits": hits,
+                "false_alarms": false_alarms,
+                "miss_rate": 1 - hits / max(len(events), 1),
+                "fa_per_hour": false_alarms / hours if hours > 0 else np.full(len(hits), np.nan)}
+
+def _runs(active: np.array, keys: np.array):
+    """ Return for each window the start index of its run of consecutive active windows with the same keyword, and the run end.
+    active is a (K, T) array, one row per threshold.
+    """
+    n = active.shape[-1]
+    idx = np.arange(n)
+    breaks = np.ones(active.shape, dtype=bool)
+    breaks[:, 1:] = ~active[:, :-1] | ~active[:, 1:] | (keys[1:] != keys[:-1])
+    starts = np.maximum.accumulate(np.where(breaks, idx, 0), axis=1)
+    ends_mark = np.ones(active.shape, dtype=bool)
+    ends_mark[:, :-1] = breaks[:, 1:]
+    ends = np.minimum.accumulate(np.where(ends_mark, idx, n)[:, ::-1], axis=1)[:, ::-1]
+    return starts, ends
+
+def _suffix_min(values: np.array, fill: int) -> np.array:
+    """ Return the minimum of values[:, i:] for each i, with a trailing column of fill."""
+    values = np.minimum.accumulate(values[:, ::-1], axis=1)[:, ::-1]
+    return np.concatenate([values, np.full((len(values), 1), fill, dtype=values.dtype)], axis=1)
+
+def sweep(posteriors: np.array, thresholds, n_act_reqs, n_features: int, frames: np.array = None, block_size: int = 1 << 22) -> SweepResult:
+    """ Replay the KWS detection logic for every threshold / n_act_req combination.
+
+    The logic is the one of KWS.process: a window is active if a posterior exceeds the threshold,
+    successive active windows of the same keyword are counted and a detection occurs when the count reaches n_act_req.
+    The features buffer clear following a detection resets the count, the next n_features - 1 windows, that KWS scores with
+    zero padded features, are assumed inactive and ignored.
+    Posteriors should be logged with stride 1, without vad gating and without detections (threshold=1.0) to be replayed exactly.
+    Runs of active windows are computed for blocks of thresholds at once, detections are then chained for all the thresholds
+    of a block together.
+
+    Keyword arguments:
+    ==================
+    posteriors (numpy.array) -- (T, n_outputs) posteriors of successive windows, or records from read_posteriors
+
+    thresholds (iterable(float)) -- thresholds to evaluate
+
+    n_act_reqs (iterable(int)) -- n_act_req values to evaluate
+
+    n_features (int) -- number of frames in a window
+
+    frames (numpy.array) -- (T,) first frame index of each window, taken from the records if not given (default None)
+
+    block_size (int) -- maximum number of threshold x window values computed at once, bounds memory use (default 4M)
+    """
+    if posteriors.dtype.names is not None:
+        frames = np.asarray(posteriors['frame']) if frames is None else frames
+        posteriors = posteriors['posteriors']
+    posteriors = np.asarray(posteriors, dtype=np.float32)
+    frames = np.arange(len(posteriors)) if frames is None else np.asarray(frames)
+    frames = frames + n_features - 1 # detections are reported on the window end frame
+    maxima = posteriors.max(axis=1)
+    keys = posteriors.argmax(axis=1)
+    thresholds = np.asarray(sorted(set(thresholds)), dtype=np.float32)
+    n_act_reqs = np.asarray(sorted(set(n_act_reqs)), dtype=np.int64)
+    grid_th, grid_req = [g.ravel() for g in np.meshgrid(thresholds, n_act_reqs, indexing='ij')]
+    if len(maxima) == 0:
+        return SweepResult(grid_th, grid_req, frames, [np.zeros((0, 2), dtype=np.int64)] * len(grid_th))
+    n_block = max(1, block_size // len(maxima))
+    detections = []
+    for start in range(0, len(thresholds), n_block):
+        detections += _replay(maxima, keys, thresholds[start:start + n_block], n_act_reqs, n_features)
+    return SweepResult(grid_th, grid_req, frames, detections)
+
+def _replay(maxima: np.array, keys: np.array, thresholds: np.array, n_act_reqs: np.array, n_features: int) -> list:
+    """ Return the (n_detections, 2) window index and keyword detections of each threshold / n_act_req, thresholds major."""
+    n_th, n_win = len(thresholds), len(maxima)
+    detections = [None] * (n_th * len(n_act_reqs))
+
+    # Runs of active windows for every threshold (rows) and window (columns)
+    idx = np.arange(n_win)
+    active = maxima > thresholds[:, None]
+    starts, ends = _runs(active, keys)
+    is_start = active & (starts == idx)
+    last_active = np.maximum.accumulate(np.where(active, idx, -1), axis=1)
+    previous = np.full(active.shape, -1, dtype=np.int64)
+    previous[:, 1:] = last_active[:, :-1]
+    previous_key = np.where(previous >= 0, keys[np.maximum(previous, 0)], 0) # KWS starts with last_kw_i = 0
+    next_start = _suffix_min(np.where(is_start, idx, n_win), n_win)[:, :n_win]
+    first = np.minimum(next_start, n_win - 1)
+    first_key = keys[first]
+    first_end = np.take_along_axis(ends, first, axis=1)
+    # Keyword of the last detection when scanning again from a window after the features buffer clear
+    last_key = np.zeros(n_win, dtype=np.int64)
+    last_key[n_features:] = keys[:max(n_win - n_features, 0)]
+    rows = np.arange(n_th)
+
+    for j, n_act_req in enumerate(n_act_reqs):
+        # KWS quirk: with n_act_req == 1 an active window whose keyword differs from the previous active one does not detect
+        quirk = int(n_act_req == 1)
+        # Detection of each run when reached from a previous run
+        needed = idx + n_act_req - 1 + quirk * (keys != previous_key)
+        next_detection = _suffix_min(np.where(is_start & (needed <= ends), needed, n_win), n_win)
+        # Detection when scanning from each window: within its run if active, else from the next run
+        from_active = idx + n_act_req - 1 + quirk * (keys != last_key)
+        from_active = np.where(from_active <= ends, from_active, np.take_along_axis(next_detection, ends + 1, axis=1))
+        from_next = next_start + n_act_req - 1 + quirk * (first_key != last_key)
+        from_next = np.where(from_next <= first_end, from_next, np.take_along_axis(next_detection, first_end + 1, axis=1))
+        from_next[next_start == n_win] = n_win
+        scan = np.concatenate([np.where(active, from_active, from_next), np.full((n_th, 1), n_win)], axis=1)
+
+        # Chain detections, scanning again n_features windows after each one
+        found_rows, found_windows = [], []
+        position = scan[:, 0]
+        while True:
+            valid = position < n_win
+            if not valid.any():
+                break
+            found_rows.append(rows[valid])
+            found_windows.append(position[valid])
+            position = np.where(valid, scan[rows, np.minimum(position + n_features, n_win)], n_win)
+        found_rows = np.concatenate(found_rows) if found_rows else np.zeros(0, dtype=np.int64)
+        found_windows = np.concatenate(found_windows) if found_windows else np.zeros(0, dtype=np.int64)
+        order = np.argsort(found_rows, kind='stable')
+        found_rows, found_windows = found_rows[order], found_windows[order]
+        splits = np.searchsorted(found_rows, rows[1:])
+        for k, windows in enumerate(np.split(found_windows, splits)):
+            detections[k * len(n_act_reqs) + j] = np.stack([windows, keys[windows]], axis=1).astype(np.int64)
+    return detections
+
+def det_curve(metrics: dict) -> tuple:
+    """ Return (fa_per_hour, miss_rate, threshold, n_act_req) of the operating points on the DET lower envelope, sorted by false alarm rate."""
+    order = np.lexsort((metrics["miss_rate"], metrics["fa_per_hour"]))
+    miss = metrics["miss_rate"][order]
+    keep = miss < np.minimum.accumulate(np.concatenate([[np.inf], miss[:-1]]))
+    order = order[keep]
+    return metrics["fa_per_hour"][order], metrics["miss_rate"][order], metrics["threshold"][order], metrics["n_act_req"][order]
+
+def _range(value: str) -> np.array:
+    if ':' in value:
+        start, stop, step = [float(v) for v in value.split(':')]
+        return np.arange(start, stop + step / 2, step)
+    return np.array([float(v) for v in value.split(',')])
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay KWS detections over logged posteriors for a grid of operating points")
+    parser.add_argument("posteriors", help="Posterior file written by KWS(posterior_log=...)")
+    parser.add_argument("--events", help="CSV file of start_frame,end_frame keyword occurences")
+    parser.add_argument("--n_features", type=int, required=True, help="Model window length in frames")
+    parser.add_argument("--thresholds", default="0.05:0.95:0.05", help="start:stop:step or comma separated values")
+    parser.add_argument("--n_act", default="1,2,3,4,5", help="Comma separated n_act_req values")
+    parser.add_argument("--frame_duration", type=float, default=0.032, help="Duration between two frames in s")
+    parser.add_argument("--tolerance", type=int, default=0, help="Frames after an event end still counted as hit")
+    parser.add_argument("--keyword", type=int, default=None, help="Only evaluate this keyword index")
+    parser.add_argument("--output", default=None, help="CSV output file (default stdout)")
+    args = parser.parse_args()
+
+    result = sweep(read_posteriors(args.posteriors), _range(args.thresholds), [int(v) for v in args.n_act.split(',')], args.n_features)
+    events = np.loadtxt(args.events, delimiter=',', ndmin=2) if args.events else np.zeros((0, 2))
+    metrics = result.evaluate(events, args.frame_duration, args.tolerance, args.keyword)
+    lines = ["threshold,n_act_req,detections,hits,false_alarms,miss_rate,fa_per_hour"]
+    for k in range(len(result.detections)):
+        lines.append("{:.4f},{},{},{},{},{:.4f},{:.4f}".format(metrics["threshold"][k], metrics["n_act_req"][k], len(result.detections[k]),
+                                                             metrics["hits"][k], metrics["false_alarms"][k], metrics["miss_rate"][k], metrics["fa_per_hour"][k]))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+    else:
+        print("\n".join(lines))
+
+if __name__ == '__main__':
+    main()
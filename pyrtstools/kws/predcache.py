@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+class PredictionCache:
+    """ PredictionCache memoizes model predictions of features windows.
+
+    Windows are quantized with the given tolerance and hashed, windows falling in the same quantization cell share their prediction.
+    All-zero windows (e.g. following KWS.clear_buffer) are answered without hashing.
+    The least recently used entries are evicted when the cache is full.
+    A cache is bound to a model: share it only between elements using the same model, it is cleared when the model is swapped.
+    """
+    def __init__(self, max_size: int = 1024, tolerance: float = 1e-3):
+        """ Create an empty cache.
+
+        Keyword arguments:
+        ==================
+        max_size (int) -- maximum number of cached predictions (default 1024)
+
+        tolerance (float) -- quantization step applied to features before hashing, 0 requires identical windows (default 1e-3)
+        """
+        assert max_size > 0, "max_size must be positive"
+        assert tolerance >= 0, "tolerance must be positive"
+        self.max_size = max_size
+        self.tolerance = tolerance
+        self._entries = OrderedDict()
+        self._zeros = {} # window shape -> prediction of the all-zero window
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, window: np.array) -> bytes:
+        """ Return the cache key of a features window."""
+        window = np.asarray(window, dtype=np.float32)
+        if self.tolerance > 0:
+            window = np.round(window / self.tolerance).astype(np.int32)
+        h = hashlib.blake2b(np.ascontiguousarray(window).tobytes(), digest_size=16)
+        h.update(str(window.shape).encode())
+        return h.digest()
+
+    def get(self, window: np.array) -> np.array:
+        """ Return the cached prediction of a window or None."""
+        if not window.any():
+            with self._lock:
+                pred = self._zeros.get(window.shape)
+                self._count(pred)
+            return pred
+        key = self.key(window)
+        with self._lock:
+            pred = self._entries.get(key)
+            if pred is not None:
+                self._entries.move_to_end(key)
+            self._count(pred)
+        return pred
+
+    def put(self, window: np.array, pred: np.array):
+        """ Store the prediction of a window."""
+        if not window.any():
+            with self._lock:
+                self._zeros[window.shape] = pred
+            return
+        key = self.key(window)
+        with self._lock:
+            self._entries[key] = pred
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def predict(self, windows: np.array, predict: callable) -> np.array:
+        """ Return the predictions of a batch of windows, only windows missing from the cache are given to predict in a single batch."""
+        preds = [self.get(w) for w in windows]
+        missing = [i for i, p in enumerate(preds) if p is None]
+        if len(missing) > 0:
+            for i, pred in zip(missing, predict(windows[missing])):
+                self.put(windows[i], pred)
+                preds[i] = pred
+        return np.stack(preds)
+
+    def _count(self, pred):
+        if pred is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def clear(self):
+        """ Remove every prediction, counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._zeros.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        """ Ratio of lookups answered from the cache"""
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def __len__(self):
+        return len(self._entries) + len(self._zeros)
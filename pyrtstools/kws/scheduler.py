@@ -0,0 +1,103 @@
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import time
+from collections import deque
+
+class AdaptiveStride:
+    """ AdaptiveStride adapts the number of frames between two inferences to the processing load.
+
+    The load is the inference time divided by the audio duration it covers. The stride is doubled when
+    the smoothed load exceeds high_load or when frames are piling up, and decreased by one when the load
+    falls under low_load with no backlog.
+    """
+    def __init__(self, frame_duration: float = 0.032,
+                       min_stride: int = 1,
+                       max_stride: int = 8,
+                       high_load: float = 0.8,
+                       low_load: float = 0.3,
+                       max_backlog: int = 32,
+                       smoothing: float = 0.2,
+                       on_change: callable = None,
+                       history: int = 100):
+        """ Create an adaptive stride scheduler, to be given to KWS or KWSClient.
+
+        Keyword arguments:
+        ==================
+        frame_duration (float) -- duration in s between two feature frames, usually MFCCParams.stride_d (default 0.032)
+
+        min_stride (int) -- minimum stride (default 1)
+
+        max_stride (int) -- maximum stride (default 8)
+
+        high_load (float) -- load above which the stride is widened (default 0.8)
+
+        low_load (float) -- load under which the stride is narrowed (default 0.3)
+
+        max_backlog (int) -- number of pending frames above which the stride is widened (default 32)
+
+        smoothing (float) -- load exponential smoothing factor ]0.0, 1.0] (default 0.2)
+
+        on_change (callable(int, int, float, int)) -- called on stride change with (old stride, new stride, load, backlog) (default None)
+
+        history (int) -- number of stride changes kept in changes (default 100)
+        """
+        assert 0 < min_stride <= max_stride, "stride bounds must verify 0 < min_stride <= max_stride"
+        assert 0 <= low_load < high_load, "loads must verify 0 <= low_load < high_load"
+        assert 0 < smoothing <= 1, "smoothing must be between ]0.0, 1.0]"
+        self.frame_duration = frame_duration
+        self.min_stride = min_stride
+        self.max_stride = max_stride
+        self.high_load = high_load
+        self.low_load = low_load
+        self.max_backlog = max_backlog
+        self.smoothing = smoothing
+        self.on_change = on_change
+
+        self.stride = min_stride
+        self.load = 0.0
+        self.changes = deque([], maxlen=history) # (time, old stride, new stride, load, backlog)
+        self.n_changes = 0
+
+    def update(self, processing_time: float, n_frames: int, backlog: int = 0) -> int:
+        """ Update the load with the last processing and return the stride to use.
+
+        Keyword arguments:
+        ==================
+        processing_time (float) -- processing duration in s
+
+        n_frames (int) -- number of new frames covered by the processing
+
+        backlog (int) -- number of frames waiting to be processed (default 0)
+        """
+        if n_frames > 0:
+            load = processing_time / (n_frames * self.frame_duration)
+            self.load += self.smoothing * (load - self.load)
+        stride = self.stride
+        if self.load > self.high_load or backlog > self.max_backlog:
+            stride = min(stride * 2, self.max_stride)
+        elif self.load < self.low_load and backlog == 0:
+            stride = max(stride - 1, self.min_stride)
+        if stride != self.stride:
+            self.changes.append((time.time(), self.stride, stride, self.load, backlog))
+            self.n_changes += 1
+            if self.on_change is not None:
+                self.on_change(self.stride, stride, self.load, backlog)
+            self.stride = stride
+        return stride
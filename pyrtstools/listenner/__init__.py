@@ -1 +1,2 @@
 from .listenner import AudioParams, Listenner
+from .filesource import FileSource
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import time
+from threading import Event
+
+from pyrtstools.base import _Producer
+
+class FileSource(_Producer):
+    """ FileSource is a producer element replaying audio from a WAV file or any iterable of audio chunks, in place of a Listenner.
+
+    Audio is sent in real time, at a multiple of real time or as fast as the pipeline consumes it.
+
+    Capacities
+    ===========
+    Ouput
+    -----
+    bytes - audio signal as bytes
+    """
+    __name__ = "filesource"
+    _output_cap = [bytes]
+
+    def __init__(self, source,
+                       chunk_size: int = 1024,
+                       sample_rate: int = 16000,
+                       sample_depth: int = 2,
+                       speed: float = 1.0,
+                       progress: callable = None,
+                       max_backlog: int = 16000,
+                       on_end: callable = None):
+        """ Instanciate a FileSource element.
+
+        Keyword arguments:
+        ==================
+        source (str | iterable(bytes)) -- WAV file path or iterable of audio chunks. A WAV file sets sample_rate and sample_depth
+
+        chunk_size (int) -- number of samples per chunk read from a WAV file (default 1024)
+
+        sample_rate (int) -- sample rate of an iterable source (default 16000)
+
+        sample_depth (int) -- sample size in byte of an iterable source (default 2)
+
+        speed (float) -- replay speed relative to real time, None sends audio as fast as possible (default 1.0)
+
+        progress (callable() -> int) -- number of samples consumed at the end of the pipeline. If set, sending pauses while more than
+        max_backlog samples are waiting, which bounds buffering when speed is None (default None)
+
+        max_backlog (int) -- maximum number of samples sent ahead of progress() (default 16000)
+
+        on_end (callable()) -- called once the whole source has been sent (default None)
+        """
+        _Producer.__init__(self)
+        if isinstance(source, str):
+            from pyrtstools.utils.wav import WavReader
+            self._reader = WavReader(source)
+            sample_rate, sample_depth = self._reader.sample_rate, self._reader.sample_depth * self._reader.channels
+            self._chunks = self._reader.chunks(chunk_size, as_bytes=True)
+        else:
+            self._reader = None
+            self._chunks = iter(source)
+        assert speed is None or speed > 0, "speed must be positive"
+        self.sample_rate = sample_rate
+        self.sample_depth = sample_depth
+        self.speed = speed
+        self.progress = progress
+        self.max_backlog = max_backlog
+        self.on_end = on_end
+        self.finished = Event()
+        self.n_samples = 0 # Number of samples sent
+
+    def run(self):
+        self._running = True
+        start = time.perf_counter()
+        for data in self._chunks:
+            if not self._running:
+                break
+            while self._paused and self._running:
+                with self._condition:
+                    self._condition.wait()
+            n_samples = len(data) // self.sample_depth
+            if self.speed is not None:
+                delay = start + (self.n_samples + n_samples) / self.sample_rate / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if self.progress is not None:
+                while self._running and self.n_samples - self.progress() > self.max_backlog:
+                    time.sleep(0.001)
+            if self.tracer is not None:
+                self.tracer.capture(self.n_samples, n_samples)
+            self.n_samples += n_samples
+            if self.history is not None:
+                self.history.write(data)
+            if self._consumer is not None:
+                self._consumer.input(data)
+        if self._reader is not None:
+            self._reader.close()
+        self.finished.set()
+        if self.on_end is not None and self._running:
+            self.on_end()
+
+    @property
+    def duration(self) -> float:
+        """ Duration in s of the audio sent"""
+        return self.n_samples / self.sample_rate
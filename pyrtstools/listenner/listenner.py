@@ -81,6 +81,7 @@ class Listenner(_Producer):
         self.params = params
         self.on_error = on_error
         self._audio = pyaudio.PyAudio()      
+        self._n_samples = 0 # Number of samples captured
 
     def run(self):
         self._running = True
@@ -96,6 +97,12 @@ class Listenner(_Producer):
                     self._condition.wait()
                     self._stream.start_stream()
             data = self._stream.read(self._chunk_size, exception_on_overflow=False)
+            if self.tracer is not None:
+                n_samples = len(data) // (self.params.nbytes * self.params.channels)
+                self.tracer.capture(self._n_samples, n_samples)
+                self._n_samples += n_samples
+            if self.history is not None:
+                self.history.write(data)
             if self._consumer is not None:
                 self._consumer.input(data)
 
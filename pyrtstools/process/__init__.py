@@ -0,0 +1,2 @@
+from .shmring import ShmRing
+from .processelement import ProcessElement
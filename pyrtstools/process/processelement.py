@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import multiprocessing
+from threading import Thread, Lock
+
+from pyrtstools.base import _Processor, _Consumer
+from pyrtstools.process.shmring import ShmRing
+
+class _RingOutput(_Consumer):
+    """ Child side consumer writing the isolated element output into the output ring"""
+    __name__ = "ringoutput"
+
+    def __init__(self, ring: ShmRing, input_cap: list):
+        _Consumer.__init__(self)
+        self._input_cap = input_cap
+        self._ring = ring
+
+    def input(self, data):
+        self._ring.put(data)
+
+class _Forward:
+    """ Child side callback sending its arguments to the parent process"""
+    def __init__(self, events, name: str):
+        self._events = events
+        self._name = name
+
+    def __call__(self, *args):
+        self._events.put((self._name, args))
+
+def _pump(ring: ShmRing, element):
+    while True:
+        data = ring.get()
+        if data is None:
+            break
+        element.input(data)
+
+def _worker(element_class, args, kwargs, callbacks, output_type, in_ring, out_ring, control, events):
+    try:
+        element = element_class(*args, **kwargs)
+    except Exception as err:
+        events.put(("on_error", ("Could not create {}: {}".format(element_class.__name__, err),)))
+        events.put(None)
+        return
+    for name in callbacks:
+        setattr(element, name, _Forward(events, name))
+    if out_ring is not None:
+        element.connect_to(_RingOutput(out_ring, element._output_cap), output_type)
+    element.start()
+    pump = None
+    if in_ring is not None:
+        pump = Thread(target=_pump, args=(in_ring, element), daemon=True)
+        pump.start()
+    while True:
+        command = control.get()
+        if command == "stop":
+            element.stop()
+        elif command == "resume":
+            element.resume()
+        else:
+            break
+    if in_ring is not None:
+        in_ring.close_ring()
+        pump.join()
+    element.close()
+    element.join(timeout=5)
+    if out_ring is not None:
+        out_ring.close_ring()
+        out_ring.release()
+    if in_ring is not None:
+        in_ring.release()
+    events.put(None)
+
+class ProcessElement(_Processor):
+    """ ProcessElement runs a pipeline element in a separate worker process.
+
+    The element is instanciated in the worker process from its class and arguments, which must be picklable.
+    Input and output data move through shared memory rings, callbacks listed in callbacks are forwarded to the parent process
+    and called on the ProcessElement attribute of the same name.
+    The ProcessElement has the element class capacities and behave as the element within a Pipeline.
+
+    Capacities
+    ===========
+    Same as the isolated element class.
+    """
+    __name__ = "processelement"
+
+    def __init__(self, element_class: type,
+                       args: tuple = (),
+                       kwargs: dict = {},
+                       callbacks: list = [],
+                       ring_size: int = 1 << 22,
+                       start_method: str = "spawn"):
+        """ Prepare an isolated element, the worker process is started with the element.
+
+        Keyword arguments:
+        ==================
+        element_class (type) -- class of the element to isolate (e.g. pyrtstools.kws.KWS)
+
+        args (tuple) -- element positional arguments
+
+        kwargs (dict) -- element keyword arguments
+
+        callbacks (list) -- names of the element callbacks to forward to the parent process, on_error is always forwarded (e.g. ["on_detection"])
+
+        ring_size (int) -- size in bytes of the input and output shared memory rings (default 4MiB)
+
+        start_method (str) -- multiprocessing start method, "spawn" is the safe choice with tensorflow (default "spawn")
+        """
+        _Processor.__init__(self)
+        self.__name__ = "process:{}".format(element_class.__name__.lower())
+        self._input_cap = list(getattr(element_class, "_input_cap", []))
+        self._output_cap = list(getattr(element_class, "_output_cap", []))
+        self._element_class = element_class
+        self._args = args
+        self._kwargs = kwargs
+        self._callbacks = list(set(callbacks) | {"on_error"})
+        for name in self._callbacks:
+            if name != "on_error":
+                setattr(self, name, lambda *args, name=name: print("[{}] {}{}".format(self.__name__, name, args), flush=True))
+
+        self._context = multiprocessing.get_context(start_method)
+        self._in_ring = ShmRing(ring_size, self._context) if len(self._input_cap) > 0 else None
+        self._out_ring = ShmRing(ring_size, self._context) if len(self._output_cap) > 0 else None
+        self._control = self._context.Queue()
+        self._events = self._context.Queue()
+        self._process = None
+        self._event_thread = None
+        self._ring_lock = Lock() # Held by input() while writing, rings are released under it
+        self._released = False
+
+    def input(self, data):
+        """ Send data to the worker process, data received after the worker has exited is dropped."""
+        with self._ring_lock:
+            if not self._released:
+                self._in_ring.put(data)
+
+    def run(self):
+        self._running = True
+        self._process = self._context.Process(target=_worker,
+                                              args=(self._element_class, self._args, self._kwargs, self._callbacks, self._output_type,
+                                                    self._in_ring, self._out_ring, self._control, self._events),
+                                              daemon=True)
+        self._process.start()
+        self._event_thread = Thread(target=self._dispatch_events, daemon=True)
+        self._event_thread.start()
+        if self._out_ring is not None:
+            while True:
+                data = self._out_ring.get(timeout=0.5)
+                if data is None:
+                    if self._out_ring.closed or not self._process.is_alive():
+                        break
+                    continue
+                if self._consumer is not None:
+                    self._consumer.input(data)
+        self._process.join()
+        self._event_thread.join()
+        if self._in_ring is not None:
+            self._in_ring.close_ring() # Unblock an input() waiting for space
+        with self._ring_lock:
+            self._released = True
+            for ring in (self._in_ring, self._out_ring):
+                if ring is not None:
+                    ring.release()
+
+    def _dispatch_events(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                break
+            name, args = event
+            try:
+                getattr(self, name)(*args)
+            except Exception as err:
+                self.on_error(err)
+
+    def stop(self):
+        if not self._paused:
+            self._paused = True
+            self._control.put("stop")
+
+    def resume(self):
+        if self._paused:
+            self._paused = False
+            self._control.put("resume")
+
+    def close(self):
+        if self._running:
+            self._running = False
+            if self._in_ring is not None:
+                self._in_ring.close_ring()
+            self._control.put("close")
+
+    @property
+    def pid(self) -> int:
+        """ Worker process id, None before start"""
+        return None if self._process is None else self._process.pid
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+""" 
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import struct
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+_HEADER_SIZE = 32 # write counter, read counter, closed flag, padding
+_MSG_HEADER = struct.Struct('<IBB2x') # payload size, ndim, dtype string length (0 for bytes)
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+class ShmRing:
+    """ Single producer / single consumer ring buffer in shared memory used to move bytes and numpy arrays between processes.
+
+    Messages are copied into the ring and out of it, they are never pickled.
+    A ShmRing can be passed as a multiprocessing.Process argument, the child process attaches to the same memory.
+    """
+    def __init__(self, capacity: int = 1 << 22, context = None):
+        """ Allocate a ring buffer.
+
+        Keyword arguments:
+        ==================
+        capacity (int) -- ring size in bytes, a single message must fit in it (default 4MiB)
+
+        context (multiprocessing context) -- context used to create the synchronization primitive (default multiprocessing default context)
+        """
+        self.capacity = _align(capacity)
+        self._shm = shared_memory.SharedMemory(create=True, size=_HEADER_SIZE + self.capacity)
+        self._owner_pid = os.getpid()
+        self._cond = (context or multiprocessing).Condition()
+        self._map()
+        self._counters[:] = 0
+
+    def _map(self):
+        self._counters = np.ndarray((3,), dtype=np.uint64, buffer=self._shm.buf)
+        self._ring = np.ndarray((self.capacity,), dtype=np.uint8, buffer=self._shm.buf, offset=_HEADER_SIZE)
+
+    def __getstate__(self):
+        return {"name": self._shm.name, "capacity": self.capacity, "cond": self._cond}
+
+    def __setstate__(self, state):
+        self.capacity = state["capacity"]
+        self._cond = state["cond"]
+        try:
+            self._shm = shared_memory.SharedMemory(name=state["name"], track=False)
+        except TypeError: # python < 3.13 registers attached segments and unlinks them on exit
+            self._shm = shared_memory.SharedMemory(name=state["name"])
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        self._owner_pid = None
+        self._map()
+
+    def _copy_in(self, position: int, data: np.ndarray):
+        i = position % self.capacity
+        first = min(len(data), self.capacity - i)
+        self._ring[i:i + first] = data[:first]
+        self._ring[:len(data) - first] = data[first:]
+
+    def _copy_out(self, position: int, out: np.ndarray):
+        i = position % self.capacity
+        first = min(len(out), self.capacity - i)
+        out[:first] = self._ring[i:i + first]
+        out[first:] = self._ring[:len(out) - first]
+
+    def put(self, data, timeout: float = None) -> bool:
+        """ Copy bytes or a numpy array into the ring. Block while there is not enough free space.
+        Returns False if the ring has been closed or on timeout.
+
+        Raises:
+        =======
+        ValueError -- message is larger than the ring capacity
+        """
+        if isinstance(data, np.ndarray):
+            data = np.ascontiguousarray(data)
+            dtype = data.dtype.str.encode() # Keeps byte order and itemsize, e.g. '<U8'
+            header = _MSG_HEADER.pack(data.nbytes, data.ndim, len(dtype)) + dtype + struct.pack('<{}I'.format(data.ndim), *data.shape)
+            payload = data.reshape(-1).view(np.uint8)
+        else:
+            payload = np.frombuffer(data, dtype=np.uint8)
+            header = _MSG_HEADER.pack(len(payload), 0, 0)
+        header_l = _align(len(header))
+        total = header_l + _align(len(payload))
+        if total > self.capacity:
+            raise ValueError("Message of {} bytes does not fit in a {} bytes ring".format(total, self.capacity))
+        if self._counters is None:
+            return False
+        with self._cond:
+            while self.capacity - int(self._counters[0] - self._counters[1]) < total:
+                if self._counters[2] or not self._cond.wait(timeout):
+                    return False
+            if self._counters[2]:
+                return False
+            position = int(self._counters[0])
+        # Only this producer moves the write counter, data is copied outside the lock.
+        self._copy_in(position, np.frombuffer(header, dtype=np.uint8))
+        self._copy_in(position + header_l, payload)
+        with self._cond:
+            self._counters[0] = position + total
+            self._cond.notify_all()
+        return True
+
+    def get(self, timeout: float = None):
+        """ Return the next message as bytes or numpy array, block until one is available.
+        Returns None if the ring is closed and empty, or on timeout.
+        """
+        with self._cond:
+            while self._counters[0] == self._counters[1]:
+                if self._counters[2] or not self._cond.wait(timeout):
+                    return None
+            position = int(self._counters[1])
+        raw = np.empty(_MSG_HEADER.size, dtype=np.uint8)
+        self._copy_out(position, raw)
+        size, ndim, dtype_l = _MSG_HEADER.unpack(raw.tobytes())
+        header_l = _MSG_HEADER.size + dtype_l + 4 * ndim
+        if dtype_l > 0:
+            raw = np.empty(header_l, dtype=np.uint8)
+            self._copy_out(position, raw)
+            dtype = raw[_MSG_HEADER.size:_MSG_HEADER.size + dtype_l].tobytes().decode()
+            shape = struct.unpack('<{}I'.format(ndim), raw[_MSG_HEADER.size + dtype_l:].tobytes())
+        if dtype_l == 0:
+            out = np.empty(size, dtype=np.uint8)
+            self._copy_out(position + _align(header_l), out)
+            data = out.tobytes()
+        else:
+            data = np.empty(shape, dtype=np.dtype(dtype))
+            self._copy_out(position + _align(header_l), data.reshape(-1).view(np.uint8))
+        with self._cond:
+            self._counters[1] = position + _align(header_l) + _align(size)
+            self._cond.notify_all()
+        return data
+
+    def close_ring(self):
+        """ Mark the ring as closed, wakes up blocked readers and writers. Pending messages can still be read."""
+        with self._cond:
+            self._counters[2] = 1
+            self._cond.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        return bool(self._counters[2])
+
+    @property
+    def used(self) -> int:
+        """ Number of bytes waiting to be read"""
+        return int(self._counters[0] - self._counters[1])
+
+    def release(self):
+        """ Detach from the shared memory, the creating process also frees it. put() returns False afterwards."""
+        self._counters = None
+        self._ring = None
+        self._shm.close()
+        if self._owner_pid == os.getpid(): # Forked children inherit the object but do not own the memory
+            self._shm.unlink()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter
+
+class _ElementStats:
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.profiles = {} # thread ident -> (cProfile.Profile, lock held while the profile is enabled)
+        self.samples = Counter() # function -> number of samples on top of the stack
+
+class Profiler:
+    """ Profiler measures the processing steps of pipeline elements for a bounded duration.
+
+    Each step is timed and, depending on capture, run under cProfile or sampled from a background thread to find the functions taking the time.
+    Start it on a running pipeline with Pipeline.profile(), elements stop measuring once the duration has elapsed or stop() is called.
+    Elements with the same name (e.g. the KWS of several pipelines) are reported together, with capture="cprofile" each thread
+    has its own profile and the profiles are merged in the report.
+    Sources running their own loop (e.g. Listenner) and ProcessElement workers are not measured.
+    """
+    def __init__(self, duration: float = 10.0, capture: str = None, sampling_interval: float = 0.005):
+        """ Create a profiler, the duration starts now.
+
+        Keyword arguments:
+        ==================
+        duration (float) -- profiling duration in s, None profiles until stop() is called (default 10.0)
+
+        capture (str) -- None for timing only, "cprofile" to run steps under cProfile, "sampling" to sample element threads stacks (default None)
+
+        sampling_interval (float) -- time in s between two stack samples with capture="sampling" (default 0.005)
+        """
+        assert capture in [None, "cprofile", "sampling"], "capture must be None, 'cprofile' or 'sampling'"
+        self.duration = duration
+        self.capture = capture
+        self.sampling_interval = sampling_interval
+        self._stats = {} # element name -> _ElementStats
+        self._lock = threading.Lock()
+        self._in_step = {} # thread ident -> element name, for sampling
+        self._start = time.perf_counter()
+        self._stopped = False
+        self._sampler = None
+        if capture == "sampling":
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+
+    @property
+    def active(self) -> bool:
+        """ False once the duration has elapsed or stop() has been called"""
+        if self._stopped:
+            return False
+        if self.duration is not None and time.perf_counter() - self._start > self.duration:
+            self._stopped = True
+        return not self._stopped
+
+    def stop(self):
+        self._stopped = True
+
+    def _element_stats(self, name: str) -> _ElementStats:
+        with self._lock:
+            return self._stats.setdefault(name, _ElementStats())
+
+    def run(self, element, step: callable):
+        """ Run a processing step of element and record it."""
+        stats = self._element_stats(element.__name__)
+        profile = None
+        if self.capture == "cprofile":
+            ident = threading.get_ident()
+            with self._lock:
+                if ident not in stats.profiles:
+                    stats.profiles[ident] = (cProfile.Profile(), threading.Lock())
+                profile, profile_lock = stats.profiles[ident]
+            profile_lock.acquire() # Only contended by report()
+            try:
+                profile.enable()
+            except ValueError: # Another profiler is active in this thread
+                profile_lock.release()
+                profile = None
+        elif self.capture == "sampling":
+            self._in_step[threading.get_ident()] = element.__name__
+        start = time.perf_counter()
+        try:
+            step()
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                profile_lock.release()
+            if self.capture == "sampling":
+                self._in_step.pop(threading.get_ident(), None)
+            with self._lock:
+                stats.calls += 1
+                stats.total += elapsed
+                stats.max = max(stats.max, elapsed)
+
+    def _sample(self):
+        while self.active:
+            frames = sys._current_frames()
+            for ident, name in list(self._in_step.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    code = frame.f_code
+                    key = "{}:{}({})".format(code.co_filename, code.co_firstlineno, code.co_name)
+                    with self._lock:
+                        self._stats[name].samples[key] += 1
+            time.sleep(self.sampling_interval)
+
+    def _top(self, stats: _ElementStats, n: int) -> list:
+        with self._lock:
+            profiles = list(stats.profiles.values())
+        if len(profiles) > 0:
+            merged = None
+            for profile, profile_lock in profiles:
+                with profile_lock:
+                    if merged is None:
+                        merged = pstats.Stats(profile)
+                    else:
+                        merged.add(profile)
+            st = merged.stats # func -> (cc, nc, tottime, cumtime, callers)
+            top = sorted(st.items(), key=lambda item: item[1][2], reverse=True)[:n]
+            return [("{}:{}({})".format(*func), nc, tottime) for func, (cc, nc, tottime, cumtime, callers) in top]
+        return [(func, count, count * self.sampling_interval) for func, count in stats.samples.most_common(n)]
+
+    def report(self, top: int = 10) -> dict:
+        """ Return, for each element name, a dictionnary with calls, total, mean and max step time in s,
+        and top: the top functions as (function, calls or samples, time in s) sorted by self time.
+        """
+        with self._lock:
+            items = list(self._stats.items())
+        return {name: {"calls": stats.calls,
+                       "total": stats.total,
+                       "mean": stats.total / stats.calls if stats.calls > 0 else 0.0,
+                       "max": stats.max,
+                       "top": self._top(stats, top)} for name, stats in items}
+
+    def format_report(self, top: int = 5) -> str:
+        """ Return the report as text, elements sorted by total time."""
+        lines = ["{:<16}{:>10}{:>12}{:>12}{:>12}".format("element", "calls", "total(s)", "mean(ms)", "max(ms)")]
+        report = sorted(self.report(top).items(), key=lambda item: item[1]["total"], reverse=True)
+        for name, r in report:
+            lines.append("{:<16}{:>10}{:>12.3f}{:>12.3f}{:>12.3f}".format(name, r["calls"], r["total"], r["mean"] * 1000, r["max"] * 1000))
+            for func, n, t in r["top"]:
+                lines.append("    {:>8.3f}s {:>8} {}".format(t, n, func))
+        return "\n".join(lines)
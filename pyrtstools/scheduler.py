@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import time
+from collections import deque, OrderedDict
+from threading import Thread, Condition, local
+
+class Scheduler:
+    """ Scheduler runs pipeline elements as passive tasks on a fixed pool of worker threads.
+
+    An element is queued when it receives data and is run by a worker when enough data is buffered.
+    Pipelines are served in round robin, one processing step at a time, and an element is never run by two workers at once
+    so that its steps keep their order. Sources (e.g. Listenner) keep their own thread.
+
+    Usage: Pipeline(elements, scheduler=scheduler), a scheduler can be shared by many pipelines.
+    """
+    def __init__(self, n_workers: int = None):
+        """ Create a scheduler, workers are started with the first attached element.
+
+        Keyword arguments:
+        ==================
+        n_workers (int) -- number of worker threads (default number of CPUs)
+        """
+        self.n_workers = n_workers if n_workers is not None else (os.cpu_count() or 1)
+        assert self.n_workers > 0, "n_workers must be positive"
+        self._cond = Condition()
+        self._groups = OrderedDict() # group -> deque of queued elements
+        self._group_of = {} # element -> group
+        self._queued = set()
+        self._active = set() # elements being run by a worker
+        self._resubmit = set() # elements submitted while being run
+        self._finalize = set() # elements closed from their own step
+        self._workers = []
+        self._closed = False
+        self._local = local()
+        self.n_steps = 0
+        self.busy_time = 0.0 # Total time in s spent by workers running steps
+
+    def attach(self, element, group = None):
+        """ Run element with the worker pool. group identifies the pipeline used for fair scheduling."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Scheduler is closed")
+            self._group_of[element] = group
+            self._groups.setdefault(group, deque())
+            element._scheduler = self
+            element._running = True
+            if len(self._workers) == 0:
+                for i in range(self.n_workers):
+                    worker = Thread(target=self._work, name="pyrtstools-worker-{}".format(i), daemon=True)
+                    worker.start()
+                    self._workers.append(worker)
+        self.submit(element)
+
+    def detach(self, element):
+        """ Stop scheduling element and finalize it once its current step is over."""
+        with self._cond:
+            if element not in self._group_of:
+                return
+            group = self._group_of.pop(element)
+            if element in self._queued:
+                self._queued.discard(element)
+                self._groups[group].remove(element)
+            if not any(g is group for g in self._group_of.values()):
+                self._groups.pop(group, None)
+            self._resubmit.discard(element)
+            if getattr(self._local, "element", None) is element:
+                self._finalize.add(element) # Closed from its own step, finalized by the worker
+                return
+            while element in self._active:
+                self._cond.wait()
+        element._finalize()
+
+    def submit(self, element):
+        """ Queue element for a processing step, called by the element on input."""
+        with self._cond:
+            group = self._group_of.get(element, self)
+            if group is self or element in self._queued:
+                return
+            if element in self._active:
+                self._resubmit.add(element)
+                return
+            self._queued.add(element)
+            self._groups[group].append(element)
+            self._cond.notify()
+
+    def _next(self):
+        """ Pop the next element, rotating groups for fairness. Called with the lock held."""
+        for group in list(self._groups):
+            queue = self._groups[group]
+            self._groups.move_to_end(group)
+            if len(queue) > 0:
+                element = queue.popleft()
+                self._queued.discard(element)
+                return element
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                element = self._next()
+                while element is None and not self._closed:
+                    self._cond.wait()
+                    element = self._next()
+                if self._closed:
+                    return
+                self._active.add(element)
+            self._local.element = element
+            start = time.perf_counter()
+            try:
+                if element._running and not element._paused and element._ready():
+                    element._run_step()
+                    self.n_steps += 1
+            except Exception as err:
+                element._emit(element.on_error, err)
+            finally:
+                self._local.element = None
+            elapsed = time.perf_counter() - start
+            again = element._running and not element._paused and element._ready()
+            with self._cond:
+                self.busy_time += elapsed
+                self._active.discard(element)
+                attached = element in self._group_of
+                finalize = element in self._finalize
+                self._finalize.discard(element)
+                if attached and (again or element in self._resubmit):
+                    self._resubmit.discard(element)
+                    self._queued.add(element)
+                    self._groups[self._group_of[element]].append(element)
+                    self._cond.notify()
+                self._cond.notify_all()
+            if finalize:
+                element._finalize()
+
+    def close(self):
+        """ Stop the workers. Attached elements are not finalized, close their pipelines first."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    @property
+    def n_elements(self) -> int:
+        """ Number of attached elements"""
+        return len(self._group_of)
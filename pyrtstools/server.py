@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+Audio ingestion server: clients stream raw PCM over TCP or Unix sockets, each connection runs its own pipeline.
+
+Protocol
+========
+The client sends a JSON header line (e.g. {"stream": "kitchen", "sample_rate": 16000}, {} for defaults) followed by raw PCM audio.
+The server answers with JSON event lines: {"event": "accepted"}, {"event": "rejected", "reason": ...} and the events sent by the pipeline
+(with kws_template: detection, utterance and error events). A client not sending its header within header_timeout is disconnected.
+
+Usage: python -m pyrtstools.server --tcp 0.0.0.0:9000 --model /path/to/model.tflite
+"""
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+
+from pyrtstools.base import _Producer, Pipeline
+
+class Stream:
+    """ Stream describes a client connection, it is given to the pipeline template to build the pipeline and send events back."""
+    def __init__(self, connection: socket.socket, stream_id: str, header: dict):
+        self.stream_id = stream_id
+        self.header = header # Client header
+        self.sample_rate = int(header.get("sample_rate", 16000))
+        self.sample_depth = int(header.get("sample_depth", 2))
+        self._connection = connection
+        self._lock = threading.Lock()
+        self.n_events = 0
+        self.start_time = time.time()
+
+    def send(self, event: dict):
+        """ Send an event to the client as a JSON line, thread safe. Errors are ignored as the connection end is handled by the reader."""
+        event = dict(event, stream=self.stream_id)
+        data = (json.dumps(event, default=float) + "\n").encode()
+        with self._lock:
+            try:
+                self._connection.sendall(data)
+                self.n_events += 1
+            except OSError:
+                pass
+
+class SocketSource(_Producer):
+    """ SocketSource is a producer element reading raw PCM audio from a client connection.
+
+    Capacities
+    ===========
+    Ouput
+    -----
+    bytes - audio signal as bytes, chunks hold whole samples
+    """
+    __name__ = "socketsource"
+    _output_cap = [bytes]
+
+    def __init__(self, connection: socket.socket, stream: Stream, chunk_size: int = 4096, on_end: callable = None, initial: bytes = b''):
+        _Producer.__init__(self)
+        self._connection = connection
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.on_end = on_end
+        self._pending = initial
+        self.n_samples = 0
+
+    def run(self):
+        self._running = True
+        depth = self.stream.sample_depth
+        data = self._pending
+        while self._running:
+            if len(data) >= depth:
+                n_bytes = len(data) - len(data) % depth
+                chunk, data = data[:n_bytes], data[n_bytes:]
+                n_samples = n_bytes // depth
+                if self.tracer is not None:
+                    self.tracer.capture(self.n_samples, n_samples)
+                self.n_samples += n_samples
+                if self.history is not None:
+                    self.history.write(chunk)
+                if self._consumer is not None and not self._paused:
+                    self._consumer.input(chunk)
+            try:
+                received = self._connection.recv(self.chunk_size)
+            except OSError:
+                break
+            if not received:
+                break
+            data += received
+        if self.on_end is not None:
+            self.on_end()
+
+    def close(self):
+        _Producer.close(self)
+        try:
+            self._connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class AudioServer:
+    """ AudioServer accepts concurrent audio streams and runs a pipeline per connection.
+
+    Pipelines are built from a template, a callable(Stream) returning the pipeline elements that follow the SocketSource.
+    The template wires element callbacks to Stream.send to send events back to the client. All pipelines share the server
+    scheduler worker pool and KWS models are shared through the model registry.
+    A connection is rejected when max_streams is reached or when the estimated real-time headroom after admission would be
+    below min_headroom.
+    """
+    def __init__(self, template: callable,
+                       address = ("127.0.0.1", 9000),
+                       max_streams: int = 64,
+                       min_headroom: float = 0.2,
+                       scheduler = None,
+                       n_workers: int = None,
+                       dispatcher = None,
+                       chunk_size: int = 4096,
+                       header_timeout: float = 10.0,
+                       load_interval: float = 1.0,
+                       on_error: callable = lambda x: print(x)):
+        """ Create the server, call start() to listen.
+
+        Keyword arguments:
+        ==================
+        template (callable(Stream) -> list) -- builds the pipeline elements of a connection, the first one receives bytes
+
+        address (tuple(str, int) | str) -- TCP (host, port), port 0 picks a free port, or Unix socket path (default ("127.0.0.1", 9000))
+
+        max_streams (int) -- maximum number of concurrent streams (default 64)
+
+        min_headroom (float) -- minimum ratio of free worker capacity required to accept a stream, 0 disables the check (default 0.2)
+
+        scheduler (Scheduler) -- scheduler running the pipelines, created with n_workers workers if not set (default None)
+
+        n_workers (int) -- number of workers of the created scheduler (default number of CPUs)
+
+        dispatcher (Dispatcher) -- if set, pipelines callbacks, and so the events sent to clients, are delivered by the dispatcher (default None)
+
+        chunk_size (int) -- socket read size in bytes (default 4096)
+
+        header_timeout (float) -- time in s a client has to send its header before the connection is dropped (default 10.0)
+
+        load_interval (float) -- time in s over which the worker load is measured (default 1.0)
+
+        on_error (callable(Exception)) -- called on connection errors (default print)
+        """
+        from pyrtstools.scheduler import Scheduler
+        self.template = template
+        self.address = address
+        self.max_streams = max_streams
+        self.min_headroom = min_headroom
+        self._own_scheduler = scheduler is None
+        self.scheduler = scheduler if scheduler is not None else Scheduler(n_workers)
+        self.dispatcher = dispatcher
+        self.chunk_size = chunk_size
+        self.header_timeout = header_timeout
+        self.load_interval = load_interval
+        self.on_error = on_error
+        self.streams = {} # stream_id -> (Stream, Pipeline)
+        self._reserved = set() # stream_id of the admitted streams whose pipeline is being built
+        self.n_rejected = 0
+        self._lock = threading.Lock()
+        self._socket = None
+        self._thread = None
+        self._running = False
+        self._n_connections = 0
+        self._load = 0.0
+        self._load_sample = (time.perf_counter(), self.scheduler.busy_time)
+
+    def start(self):
+        """ Bind the socket and accept connections on a background thread."""
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(self.address)
+        self._socket.listen()
+        self.address = self._socket.getsockname() if not isinstance(self.address, str) else self.address
+        self._running = True
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while self._running:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._open_stream, args=(connection,), daemon=True).start()
+
+    @property
+    def load(self) -> float:
+        """ Ratio of the worker pool capacity used over the last load_interval"""
+        now, busy = time.perf_counter(), self.scheduler.busy_time
+        with self._lock:
+            last_t, last_busy = self._load_sample
+            if now - last_t >= self.load_interval:
+                self._load = (busy - last_busy) / ((now - last_t) * self.scheduler.n_workers)
+                self._load_sample = (now, busy)
+            return self._load
+
+    def _headroom(self, load: float) -> float:
+        n_streams = len(self.streams)
+        per_stream = load / n_streams if n_streams > 0 else 0.0
+        return 1.0 - load - per_stream * (len(self._reserved) + 1)
+
+    @property
+    def headroom(self) -> float:
+        """ Estimated ratio of the worker pool capacity left after accepting one more stream"""
+        load = self.load
+        with self._lock:
+            return self._headroom(load)
+
+    def _admit(self, stream_id: str, load: float) -> str:
+        """ Reserve a slot for stream_id, or return the reason to reject it. Called holding _lock."""
+        if len(self.streams) + len(self._reserved) >= self.max_streams:
+            return "max_streams reached"
+        if self.min_headroom > 0 and self._headroom(load) < self.min_headroom:
+            return "not enough real-time headroom"
+        self._reserved.add(stream_id)
+        return None
+
+    def _read_header(self, connection: socket.socket):
+        """ Return the client header and the audio bytes received after it."""
+        connection.settimeout(self.header_timeout)
+        data = b''
+        while b'\n' not in data:
+            received = connection.recv(self.chunk_size)
+            if not received:
+                raise ConnectionError("Connection closed before header")
+            data += received
+            if len(data) > 65536:
+                raise ValueError("Header too long")
+        connection.settimeout(None)
+        line, rest = data.split(b'\n', 1)
+        header = json.loads(line.decode()) if line.strip() else {}
+        if not isinstance(header, dict):
+            raise ValueError("Header must be a JSON object")
+        return header, rest
+
+    def _open_stream(self, connection: socket.socket):
+        try:
+            header, rest = self._read_header(connection)
+        except (OSError, ValueError, ConnectionError) as err:
+            self.on_error(err)
+            connection.close()
+            return
+        load = self.load
+        with self._lock:
+            self._n_connections += 1
+            stream_id = str(header.get("stream", "stream-{}".format(self._n_connections)))
+            if stream_id in self.streams or stream_id in self._reserved:
+                stream_id = "{}-{}".format(stream_id, self._n_connections)
+            reason = self._admit(stream_id, load)
+            if reason is not None:
+                self.n_rejected += 1
+        stream = Stream(connection, stream_id, header)
+        if reason is not None:
+            stream.send({"event": "rejected", "reason": reason})
+            connection.close()
+            return
+        try:
+            elements = self.template(stream)
+            source = SocketSource(connection, stream, self.chunk_size, on_end=lambda: self._close_stream(stream_id), initial=rest)
+            pipeline = Pipeline([source] + list(elements), scheduler=self.scheduler, dispatcher=self.dispatcher)
+        except Exception as err:
+            with self._lock:
+                self._reserved.discard(stream_id)
+            self.on_error(err)
+            stream.send({"event": "rejected", "reason": "pipeline error: {}".format(err)})
+            connection.close()
+            return
+        with self._lock:
+            self._reserved.discard(stream_id)
+            self.streams[stream_id] = (stream, pipeline)
+        stream.send({"event": "accepted"})
+        try:
+            pipeline.start()
+        except Exception as err:
+            self.on_error(err)
+            stream.send({"event": "error", "error": str(err)})
+            self._close_stream(stream_id)
+
+    def _close_stream(self, stream_id: str):
+        with self._lock:
+            entry = self.streams.pop(stream_id, None)
+        if entry is None:
+            return
+        stream, pipeline = entry
+        pipeline.close()
+        if self.dispatcher is not None:
+            self.dispatcher.forget(pipeline)
+        try:
+            stream._connection.close()
+        except OSError:
+            pass
+
+    @property
+    def n_streams(self) -> int:
+        return len(self.streams)
+
+    def close(self):
+        """ Stop accepting connections and close every stream."""
+        self._running = False
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+        if self._thread is not None:
+            self._thread.join()
+        for stream_id in list(self.streams):
+            self._close_stream(stream_id)
+        if self._own_scheduler:
+            self.scheduler.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+def kws_template(model_path: str, threshold: float = 0.5, vad: bool = False) -> callable:
+    """ Return a template building a ByteToNum -> PreEmphasis -> SonopyMFCC -> KWS pipeline sending detection events,
+    preceded by a VADer gating KWS if vad is set. The VADer detects utterances continuously and sends utterance events
+    with their status ("threached", "timeout" or "canceled") and audio size in bytes.
+    """
+    def template(stream: Stream) -> list:
+        from pyrtstools.transform import ByteToNum, PreEmphasis
+        from pyrtstools.features import MFCCParams, SonopyMFCC
+        from pyrtstools.kws import KWS
+        params = MFCCParams(sample_rate=stream.sample_rate)
+        elements = []
+        vad_activity = None
+        if vad:
+            from pyrtstools.vad import VADer
+            from pyrtstools.vad.vad import Utt_Status
+            vader = VADer(sample_rate=stream.sample_rate, filter=False)
+            def on_utterance(status, audio):
+                stream.send({"event": "utterance", "status": status.name.lower(), "n_bytes": len(audio) if audio is not None else 0, "time": time.time()})
+                if status != Utt_Status.CANCELED:
+                    vader.detect_utterance(on_utterance)
+            vader.detect_utterance(on_utterance)
+            vad_activity = vader.activity
+            elements.append(vader)
+        kws = KWS(model_path, threshold=threshold, vad_activity=vad_activity, frame_shift=params.stride_l,
+                  on_detection=lambda i, v: stream.send({"event": "detection", "keyword": int(i), "confidence": float(v), "time": time.time()}))
+        kws.on_error = lambda err: stream.send({"event": "error", "error": str(err)})
+        return elements + [ByteToNum(normalize=True), PreEmphasis(0.97), SonopyMFCC(params), kws]
+    return template
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio ingestion server running a keyword spotting pipeline per connection")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--tcp", default="127.0.0.1:9000", help="host:port to listen on")
+    group.add_argument("--unix", default=None, help="Unix socket path to listen on")
+    parser.add_argument("--model", required=True, help="KWS model path")
+    parser.add_argument("--threshold", type=float, default=0.5, help="KWS threshold")
+    parser.add_argument("--vad", action="store_true", help="Gate KWS with a VADer")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker threads")
+    parser.add_argument("--max_streams", type=int, default=64, help="Maximum number of concurrent streams")
+    parser.add_argument("--min_headroom", type=float, default=0.2, help="Minimum free capacity to accept a stream")
+    args = parser.parse_args()
+
+    if args.unix is not None:
+        address = args.unix
+    else:
+        host, port = args.tcp.rsplit(':', 1)
+        address = (host, int(port))
+    server = AudioServer(kws_template(args.model, args.threshold, args.vad), address,
+                         max_streams=args.max_streams, min_headroom=args.min_headroom, n_workers=args.workers)
+    server.start()
+    print("Listening on {}".format(server.address), flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import time
+from collections import deque
+
+class Tracer:
+    """ Tracer records capture timestamps, per element queueing and processing spans and detection latencies of a pipeline.
+
+    The pipeline source records the capture time of each chunk with its sample offset. Downstream elements keep
+    track of the sample (or feature frame) offsets of the data they process, which allows to compute the latency between
+    the capture of the last sample used by a detection and the detection itself.
+    Sample offsets are only meaningful if no element drops samples before the traced element (e.g. VADer with filter=True).
+
+    Attach it to a pipeline using Pipeline(elements, tracer=tracer). Timestamps use time.perf_counter().
+    """
+    def __init__(self, sample_rate: int = 16000, max_events: int = 100000, max_captures: int = 10000):
+        """ Create a tracer.
+
+        Keyword arguments:
+        ==================
+        sample_rate (int) -- audio sample rate (default 16000)
+
+        max_events (int) -- maximum number of spans kept, oldest are dropped (default 100000)
+
+        max_captures (int) -- maximum number of captured chunks kept for latency computation (default 10000)
+        """
+        self.sample_rate = sample_rate
+        self.events = deque([], maxlen=max_events) # (name, track, start, end, args)
+        self.latencies = deque([], maxlen=max_events) # (stage, detection time, latency)
+        self._captures = deque([], maxlen=max_captures) # (first sample, n_samples, end of capture time)
+        self._frame_geometry = None # (stride_l, window_l)
+        self.origin = time.perf_counter()
+
+    def capture(self, sample_offset: int, n_samples: int, timestamp: float = None):
+        """ Record the capture of n_samples samples starting at sample_offset, timestamp is the end of capture (default now)."""
+        self._captures.append((sample_offset, n_samples, time.perf_counter() if timestamp is None else timestamp))
+
+    def capture_time(self, sample: int) -> float:
+        """ Return the estimated capture time of a sample, None if the sample is unknown."""
+        for offset, n_samples, timestamp in reversed(self._captures):
+            if offset <= sample < offset + n_samples:
+                return timestamp - (offset + n_samples - 1 - sample) / self.sample_rate
+            if offset + n_samples <= sample:
+                return None
+        return None
+
+    def set_frame_geometry(self, stride_l: int, window_l: int):
+        """ Set features frames geometry in samples, used to map frame indexes to samples. Called by features elements."""
+        self._frame_geometry = (stride_l, window_l)
+
+    def frame_last_sample(self, frame: int) -> int:
+        """ Return the index of the last sample of a features frame, None if frames geometry is unknown."""
+        if self._frame_geometry is None:
+            return None
+        stride_l, window_l = self._frame_geometry
+        return frame * stride_l + window_l - 1
+
+    def span(self, name: str, start: float, end: float, track: str = None, **args):
+        """ Record a span of name between start and end on the given track (default name)."""
+        self.events.append((name, track or name, start, end, args))
+
+    def detection(self, stage: str, sample: int = None, frame: int = None, timestamp: float = None) -> float:
+        """ Record a detection based on data up to the given sample (or features frame) and return its latency in s.
+        Returns None if the capture time cannot be determined.
+        """
+        timestamp = time.perf_counter() if timestamp is None else timestamp
+        if sample is None and frame is not None:
+            sample = self.frame_last_sample(frame)
+        capture = None if sample is None else self.capture_time(sample)
+        latency = None if capture is None else timestamp - capture
+        self.latencies.append((stage, timestamp, latency))
+        self.events.append(("detection", stage, timestamp, timestamp, {"sample": sample, "latency": latency}))
+        return latency
+
+    def to_chrome_trace(self) -> dict:
+        """ Return the recorded events in the Chrome trace event format (chrome://tracing, Perfetto)."""
+        tracks = {}
+        events = []
+        for name, track, start, end, args in list(self.events):
+            tid = tracks.setdefault(track, len(tracks) + 1)
+            event = {"name": name, "pid": 1, "tid": tid,
+                     "ts": (start - self.origin) * 1e6,
+                     "args": args}
+            if end > start:
+                event.update({"ph": "X", "dur": (end - start) * 1e6})
+            else:
+                event.update({"ph": "i", "s": "t"})
+            events.append(event)
+        for track, tid in tracks.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": track}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, file_path: str):
+        """ Write the Chrome trace JSON to file_path"""
+        with open(file_path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f, default=float)
+
+    def clear(self):
+        self.events.clear()
+        self.latencies.clear()
+        self._captures.clear()
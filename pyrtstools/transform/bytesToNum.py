@@ -34,32 +34,29 @@ class ByteToNum(_Processor):
         assert "nbytes" in dir(dtype), "Input data type must have nbytes method" 
         self._dtype = dtype
         self.normalize = normalize
+        self._sample_offset = 0
     
     def input(self, data):
-        self._buffer += data
         with self._condition:
-            self._condition.notify()
+            self._buffer += data
+        self._trace_input()
+        self._notify()
+
+    def _ready(self) -> bool:
+        return len(self._buffer) >= self._dtype(0).nbytes
+
+    def _step(self):
+        self.process()
 
-    def run(self):
-        self._running = True
-        while self._running:
-            if self._paused or self._processing:
-                with self._condition:
-                    self._condition.wait()
-                    continue
-            if len(self._buffer) >= self._dtype(0).nbytes:
-                self.process()
-            else:
-                with self._condition:
-                    self._condition.wait()
-    
     def process(self):
         self._processing = True
-        data = np.frombuffer(self._buffer, dtype=self._dtype) / (1 if not self.normalize else np.iinfo(self._dtype).max)
-        self._buffer = b''
+        trace = self._trace_start()
+        with self._condition:
+            buffer, self._buffer = self._buffer, b''
+        data = np.frombuffer(buffer, dtype=self._dtype) / (1 if not self.normalize else np.iinfo(self._dtype).max)
+        self._trace_end(trace, sample=self._sample_offset, n_samples=len(data))
+        self._sample_offset += len(data)
         if self._consumer is not None:
             self._consumer.input(data)
         
-        self._processing = False
-        with self._condition:
-            self._condition.notify()
\ No newline at end of file
+        self._processing = False
\ No newline at end of file
@@ -35,39 +35,36 @@ class PreEmphasis(_Processor):
         assert  0.0 < emphasis_factor < 1.0, "emphasis factor must be [0.0,1.0]: given {}".format(emphasis_factor)
         self.emphasis_factor = emphasis_factor
         self.last_value = 0.0
+        self._sample_offset = 0
         
     
     def input(self, data):
-        self._buffer = np.concatenate([self._buffer, data])
         with self._condition:
-            self._condition.notify()
+            self._buffer = np.concatenate([self._buffer, data])
+        self._trace_input()
+        self._notify()
+
+    def _ready(self) -> bool:
+        return len(self._buffer) > 0
+
+    def _step(self):
+        self.process()
 
-    def run(self):
-        self._running = True
-        while self._running:
-            if self._paused or self._processing:
-                with self._condition:
-                    self._condition.wait()
-                    continue
-            if len(self._buffer) > 0:
-                self.process()
-            else:
-                with self._condition:
-                    self._condition.wait()
-    
     def process(self):
         self._processing = True
+        trace = self._trace_start()
+        with self._condition:
+            buffer, self._buffer = self._buffer, np.array([])
         if self.keep_last_value:
-            data = self._buffer - np.concatenate([[self.last_value], self._buffer[:-1]]) * self.emphasis_factor
-            self.last_value = self._buffer[-1]
+            data = buffer - np.concatenate([[self.last_value], buffer[:-1]]) * self.emphasis_factor
+            self.last_value = buffer[-1]
         else:
-            data = np.concatenate([[self._buffer[0]], self._buffer[1:] - self._buffer[:-1] * self.emphasis_factor])
-        self._buffer = np.array([])
+            data = np.concatenate([[buffer[0]], buffer[1:] - buffer[:-1] * self.emphasis_factor])
+        self._trace_end(trace, sample=self._sample_offset, n_samples=len(data))
+        self._sample_offset += len(data)
         if self._consumer is not None:
             self._consumer.input(data)
         
         self._processing = False
-        with self._condition:
-            self._condition.notify()
 
             
\ No newline at end of file
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+Chunk and stride sizes tuner: replays recorded audio through a FileSource -> VADer -> ByteToNum -> PreEmphasis -> SonopyMFCC -> KWS
+pipeline for each configuration of a parameter grid, measures CPU time per second of audio and inference latency, and outputs
+the Pareto front and a recommended configuration.
+
+Usage: python -m pyrtstools.tuning --wav recording.wav --model model.tflite --chunk_size 512 1024 2048 --kws_stride 1 2 4 --save tuning.json
+"""
+import json
+import time
+import random
+import argparse
+import itertools
+
+import numpy as np
+
+# Tuned parameters: name -> (constructor section, argument name, default grid)
+PARAMETERS = {"chunk_size": ("audio", "frame_per_buffer", [512, 1024, 2048]),
+              "vad_window": ("vad", "window_length", [10, 20, 30]),
+              "stride_d": ("mfcc", "stride_d", [0.032]),
+              "kws_stride": ("kws", "stride", [1, 2, 4])}
+
+def grid(space: dict = None, n_trials: int = None, seed: int = 0) -> list:
+    """ Return the configurations, as dictionnaries parameter -> value, of the product of the space values.
+
+    Keyword arguments:
+    ==================
+    space (dict) -- parameter name -> list of values, missing parameters use the PARAMETERS default grid (default None)
+
+    n_trials (int) -- if set, a random sample of n_trials configurations is returned instead of the whole grid (default None)
+
+    seed (int) -- random sampling seed (default 0)
+    """
+    space = dict({name: values for name, (_, _, values) in PARAMETERS.items()}, **(space or {}))
+    unknown = set(space) - set(PARAMETERS)
+    assert len(unknown) == 0, "Unknown parameters {}".format(sorted(unknown))
+    names = sorted(space)
+    configs = [dict(zip(names, values)) for values in itertools.product(*[space[n] for n in names])]
+    if n_trials is not None and n_trials < len(configs):
+        configs = random.Random(seed).sample(configs, n_trials)
+    return configs
+
+def constructor_kwargs(config: dict) -> dict:
+    """ Return the configuration as constructors arguments: {"audio": AudioParams, "vad": VADer, "mfcc": MFCCParams, "kws": KWS}.
+
+    e.g. kwargs = constructor_kwargs(config); AudioParams(**kwargs["audio"]); KWS(model_path, **kwargs["kws"])
+    """
+    kwargs = {section: {} for section, _, _ in PARAMETERS.values()}
+    for name, value in config.items():
+        section, argument, _ = PARAMETERS[name]
+        kwargs[section][argument] = value
+    return kwargs
+
+def load_recommendation(file_path: str) -> dict:
+    """ Return the constructors arguments of the configuration recommended in a tuning result file (see constructor_kwargs)."""
+    with open(file_path, 'r') as f:
+        return json.load(f)["recommended"]["kwargs"]
+
+def _inference_latencies(tracer, stage: str) -> list:
+    """ Return, for each inference span of stage, the time between the capture of the last sample scored and the end of the inference."""
+    latencies = []
+    for name, _, _, end, args in list(tracer.events):
+        if name == stage and args.get("last_frame") is not None:
+            capture = tracer.capture_time(tracer.frame_last_sample(args["last_frame"]))
+            if capture is not None:
+                latencies.append(end - capture)
+    return latencies
+
+def evaluate(config: dict, wav_path: str, model_path: str, speed: float = 1.0, timeout: float = 30.0) -> dict:
+    """ Run the pipeline configuration over the audio file and return its measures.
+
+    Latencies are measured from the capture of the last sample of a scored window to the end of its inference, capture times
+    being estimated from the time the source emits each chunk, as a live source would. They are only meaningful in real time (speed=1.0),
+    faster replays measure backlog instead. CPU time covers the whole process.
+
+    Keyword arguments:
+    ==================
+    config (dict) -- parameter name -> value, see PARAMETERS
+
+    wav_path (str) -- recorded audio, 16 bits mono
+
+    model_path (str) -- KWS model
+
+    speed (float) -- replay speed relative to real time (default 1.0)
+
+    timeout (float) -- maximum time in s to wait for the pipeline to drain after the source end (default 30.0)
+    """
+    from pyrtstools.base import Pipeline
+    from pyrtstools.tracing import Tracer
+    from pyrtstools.listenner.filesource import FileSource
+    from pyrtstools.vad import VADer
+    from pyrtstools.transform import ByteToNum, PreEmphasis
+    from pyrtstools.features import MFCCParams, SonopyMFCC
+    from pyrtstools.kws import KWS
+
+    kwargs = constructor_kwargs(config)
+    chunk_size = kwargs["audio"].get("frame_per_buffer", 1024)
+    source = FileSource(wav_path, chunk_size=chunk_size, speed=speed)
+    params = MFCCParams(sample_rate=source.sample_rate, **kwargs["mfcc"])
+    vader = VADer(sample_rate=source.sample_rate, filter=False, **kwargs["vad"])
+    kws = KWS(model_path, vad_activity=vader.activity, frame_shift=params.stride_l, on_detection=lambda i, v: None, **kwargs["kws"])
+    progress = lambda: kws.frame_count * params.stride_l
+    source.progress = progress
+    source.max_backlog = 2 * source.sample_rate
+    tracer = Tracer(sample_rate=source.sample_rate)
+    pipeline = Pipeline([source, vader, ByteToNum(normalize=True), PreEmphasis(0.97), SonopyMFCC(params), kws], tracer=tracer)
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    pipeline.start()
+    source.finished.wait()
+    drain_end = time.perf_counter() + timeout
+    # The end of the stream shorter than a VAD window or a features window is never consumed
+    remainder = params.window_l + int(vader.window_length * source.sample_rate / 1000)
+    while progress() < source.n_samples - remainder and time.perf_counter() < drain_end:
+        time.sleep(0.01)
+    cpu_time, wall_time = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    pipeline.close()
+
+    latencies = np.array(_inference_latencies(tracer, kws.__name__))
+    return {"config": config,
+            "kwargs": kwargs,
+            "audio_duration": source.duration,
+            "cpu_per_audio_s": cpu_time / max(source.duration, 1e-9),
+            "rtf": wall_time / max(source.duration, 1e-9),
+            "latency_mean": float(latencies.mean()) if len(latencies) else None,
+            "latency_p95": float(np.percentile(latencies, 95)) if len(latencies) else None,
+            "n_inferences": len(latencies),
+            "n_skipped": kws.n_skipped}
+
+def pareto_front(results: list, objectives: tuple = ("cpu_per_audio_s", "latency_p95")) -> list:
+    """ Return the results not dominated on the objectives (all minimized), sorted by the first objective.
+    Results missing an objective are ignored.
+    """
+    candidates = [r for r in results if all(r.get(o) is not None for o in objectives)]
+    front = []
+    for r in candidates:
+        dominated = any(all(o[k] <= r[k] for k in objectives) and any(o[k] < r[k] for k in objectives) for o in candidates)
+        if not dominated:
+            front.append(r)
+    return sorted(front, key=lambda r: tuple(r[k] for k in objectives))
+
+def recommend(front: list, max_latency: float = None, max_cpu: float = None) -> dict:
+    """ Return the recommended configuration of a Pareto front.
+
+    The cheapest configuration meeting max_latency (or the fastest meeting max_cpu) is returned. Without constraints, or if
+    none is met, the configuration closest to the ideal point (minimum CPU and latency, each normalized over the front) is returned.
+    """
+    if len(front) == 0:
+        return None
+    if max_latency is not None:
+        valid = [r for r in front if r["latency_p95"] <= max_latency]
+        if len(valid) > 0:
+            return min(valid, key=lambda r: r["cpu_per_audio_s"])
+    if max_cpu is not None:
+        valid = [r for r in front if r["cpu_per_audio_s"] <= max_cpu]
+        if len(valid) > 0:
+            return min(valid, key=lambda r: r["latency_p95"])
+    def normalized(r, key):
+        values = [f[key] for f in front]
+        span = max(values) - min(values)
+        return (r[key] - min(values)) / span if span > 0 else 0.0
+    return min(front, key=lambda r: normalized(r, "cpu_per_audio_s") ** 2 + normalized(r, "latency_p95") ** 2)
+
+def tune(wav_path: str, model_path: str, configs: list, speed: float = 1.0, max_latency: float = None, max_cpu: float = None, on_result: callable = None) -> dict:
+    """ Evaluate each configuration and return {"results": [...], "pareto": [...], "recommended": result}.
+
+    Keyword arguments:
+    ==================
+    wav_path (str) -- recorded audio, 16 bits mono
+
+    model_path (str) -- KWS model
+
+    configs (list) -- configurations to evaluate, see grid()
+
+    speed (float) -- replay speed relative to real time, see evaluate() (default 1.0)
+
+    max_latency (float) -- latency p95 in s the recommendation must meet (default None)
+
+    max_cpu (float) -- CPU time per second of audio the recommendation must meet (default None)
+
+    on_result (callable(dict)) -- called with each configuration result (default None)
+    """
+    results = []
+    for config in configs:
+        try:
+            result = evaluate(config, wav_path, model_path, speed)
+        except (AssertionError, ValueError) as err: # Unsupported combination
+            result = {"config": config, "error": str(err)}
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+    front = pareto_front(results)
+    return {"results": results, "pareto": front, "recommended": recommend(front, max_latency, max_cpu)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune pipeline chunk and stride sizes for CPU usage and latency")
+    parser.add_argument("--wav", required=True, help="Recorded audio (16 bits mono WAV)")
+    parser.add_argument("--model", required=True, help="KWS model")
+    for name, (_, _, values) in PARAMETERS.items():
+        parser.add_argument("--" + name, nargs='+', type=type(values[0]), default=values, help="Values of {} (default {})".format(name, values))
+    parser.add_argument("--n_trials", type=int, default=None, help="Evaluate a random sample of the grid")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, latencies are only meaningful in real time")
+    parser.add_argument("--max_latency", type=float, default=None, help="Latency p95 in s the recommendation must meet")
+    parser.add_argument("--max_cpu", type=float, default=None, help="CPU time per second of audio the recommendation must meet")
+    parser.add_argument("--save", default=None, help="Write results to this JSON file, the recommendation can be loaded with load_recommendation")
+    args = parser.parse_args()
+
+    configs = grid({name: getattr(args, name) for name in PARAMETERS}, args.n_trials)
+    def report(result):
+        if "error" in result:
+            print("{} error: {}".format(result["config"], result["error"]), flush=True)
+        else:
+            print("{} cpu/s {:.4f} latency p95 {}".format(result["config"], result["cpu_per_audio_s"],
+                  "{:.3f}s".format(result["latency_p95"]) if result["latency_p95"] is not None else "n/a"), flush=True)
+    tuning = tune(args.wav, args.model, configs, args.speed, args.max_latency, args.max_cpu, on_result=report)
+    print("Pareto front:")
+    for result in tuning["pareto"]:
+        print("  {} cpu/s {:.4f} latency p95 {:.3f}s".format(result["config"], result["cpu_per_audio_s"], result["latency_p95"]))
+    if tuning["recommended"] is not None:
+        print("Recommended: {}".format(json.dumps(tuning["recommended"]["kwargs"])))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(tuning, f, indent=2)
+
+if __name__ == '__main__':
+    main()
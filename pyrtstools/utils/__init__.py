@@ -1 +1,2 @@
-from .wav import *
\ No newline at end of file
+from .wav import *
+from .history import AudioHistory
\ No newline at end of file
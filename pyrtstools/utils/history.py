@@ -0,0 +1,102 @@
+import time
+from threading import Lock
+
+import numpy as np
+
+class AudioHistory:
+    """ AudioHistory keeps the last seconds of captured audio in a fixed size ring buffer.
+
+    Samples are indexed by a global sample counter starting at the first written sample,
+    which allows to retrieve the audio matching features frames or a detection window.
+    Attach it to a pipeline using Pipeline(elements, history=history), the pipeline source element records its output into it.
+    """
+    def __init__(self, duration: float = 5.0,
+                       sample_rate: int = 16000,
+                       dtype = np.int16):
+        """ Allocate the audio history.
+
+        Keyword arguments:
+        ==================
+        duration (float) -- history duration in s (default 5.0)
+
+        sample_rate (int) -- audio sample rate (default 16000)
+
+        dtype (numpy type) -- sample type of the recorded audio (default numpy.int16)
+        """
+        assert duration > 0, "duration must be positive"
+        self.sample_rate = sample_rate
+        self.dtype = np.dtype(dtype)
+        self.capacity = int(duration * sample_rate)
+        self._ring = np.zeros(self.capacity, dtype=self.dtype)
+        self._n_written = 0
+        self._lock = Lock()
+        self.last_capture_time = None
+
+    def write(self, data):
+        """ Record audio given as bytes or numpy array. """
+        samples = np.frombuffer(data, dtype=self.dtype) if not isinstance(data, np.ndarray) else data.astype(self.dtype, copy=False)
+        n = len(samples)
+        with self._lock:
+            start = self._n_written
+            if n > self.capacity:
+                samples = samples[-self.capacity:]
+                start += n - self.capacity
+            pos = start % self.capacity
+            first = min(len(samples), self.capacity - pos)
+            self._ring[pos:pos + first] = samples[:first]
+            self._ring[:len(samples) - first] = samples[first:]
+            self._n_written += n
+            self.last_capture_time = time.time()
+
+    @property
+    def n_samples(self) -> int:
+        """ Total number of samples recorded since creation, the index of the next sample."""
+        return self._n_written
+
+    @property
+    def first_sample(self) -> int:
+        """ Index of the oldest sample still available."""
+        return max(0, self._n_written - self.capacity)
+
+    def snapshot(self, start: int = None, end: int = None) -> np.ndarray:
+        """ Return a copy of the samples from index start to index end (excluded).
+        The range is clipped to the available samples.
+
+        Keyword arguments:
+        ==================
+        start (int) -- first sample index (default oldest sample available)
+
+        end (int) -- last sample index excluded (default last sample recorded)
+        """
+        with self._lock:
+            first = self.first_sample
+            start = first if start is None else max(start, first)
+            end = self._n_written if end is None else min(end, self._n_written)
+            if end <= start:
+                return np.zeros(0, dtype=self.dtype)
+            i, j = start % self.capacity, end % self.capacity
+            if i < j:
+                return self._ring[i:j].copy()
+            return np.concatenate([self._ring[i:], self._ring[:j]])
+
+    def last(self, duration: float) -> np.ndarray:
+        """ Return a copy of the last duration seconds of audio."""
+        end = self._n_written
+        return self.snapshot(end - int(duration * self.sample_rate), end)
+
+    def frames_snapshot(self, first_frame: int, end_frame: int, mfccParams) -> np.ndarray:
+        """ Return a copy of the audio that produced the features frames from first_frame to end_frame (excluded).
+
+        Frame indexes are the ones counted by the feature consumer (e.g. KWS.detection_window).
+        The mapping assumes no element drops samples between the pipeline source and the features extraction.
+
+        Keyword arguments:
+        ==================
+        first_frame (int) -- index of the first feature frame
+
+        end_frame (int) -- index of the frame following the last frame
+
+        mfccParams (MFCCParams) -- parameters used to compute the features
+        """
+        return self.snapshot(max(first_frame, 0) * mfccParams.stride_l,
+                             (end_frame - 1) * mfccParams.stride_l + mfccParams.window_l)
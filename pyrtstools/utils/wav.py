@@ -1,4 +1,27 @@
+import os
 import struct
+from collections import deque
+
+import numpy as np
+
+from pyrtstools.base import _Consumer
+
+_MAX_DATA_SIZE = 0xFFFFFFFF - 36 # RIFF sizes are stored on 32bits
+
+def _pack_header(datasize: int,
+                 sample_rate: int,
+                 channels: int,
+                 sample_depth: int) -> bytes:
+    h = b'RIFF'
+    h += struct.pack('<L4s4sLHHLLHH4s',
+                        datasize + 36 + (datasize % 2),
+                        b'WAVE', b'fmt ',
+                        16, 1, channels, sample_rate,
+                        sample_rate * channels * sample_depth,
+                        channels * sample_depth, sample_depth * 8,
+                        b'data')
+    h += (datasize).to_bytes(4,'little')
+    return h
 
 def gen_wav_header(buffer: bytes,
                    sample_rate: int = 16000,
@@ -16,17 +39,7 @@ def gen_wav_header(buffer: bytes,
 
     sample_depth (int) -- sample size in byte (default 2)
     """
-    datasize = len(buffer)
-    h = b'RIFF'                                                                                     
-    h += struct.pack('<L4s4sLHHLLHH4s', 
-                        datasize + 36,
-                        b'WAVE', b'fmt ',
-                        16, 1, channels, sample_rate,
-                        sample_rate * channels * sample_depth,
-                        channels * sample_depth, sample_depth * 8,
-                        b'data')
-    h += (datasize).to_bytes(4,'little')
-    return h
+    return _pack_header(len(buffer), sample_rate, channels, sample_depth)
 
 def write_wav(buffer: bytes,
               file_path: str,
@@ -47,5 +60,254 @@ def write_wav(buffer: bytes,
 
     sample_depth (int) -- sample size in byte (default 2)
     """
-    with open(file_path, 'wb') as f:
-        f.write(gen_wav_header(buffer, sample_rate, channels, sample_depth) + buffer)
+    with WavWriter(file_path, sample_rate, channels, sample_depth) as writer:
+        writer.write(buffer)
+
+class WavWriter:
+    """ WavWriter writes a wave file chunk by chunk without holding the audio in memory.
+
+    The header is written with empty sizes when the file is opened, RIFF and data sizes are patched on sync() and close().
+    Can be used as a context manager.
+    """
+    def __init__(self, file_path: str,
+                       sample_rate: int = 16000,
+                       channels: int = 1,
+                       sample_depth: int = 2):
+        """ Open a wave file for writing.
+
+        Keyword Arguments:
+        ==================
+        file_path (str) -- the file to be written
+
+        sample_rate (int) -- audio sample rate (default 16000)
+
+        channels (int) -- number of channels (default 1)
+
+        sample_depth (int) -- sample size in byte (default 2)
+        """
+        self.file_path = file_path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_depth = sample_depth
+        self.datasize = 0
+        self._f = open(file_path, 'wb')
+        self._f.write(_pack_header(0, sample_rate, channels, sample_depth))
+
+    def write(self, data):
+        """ Append audio data (bytes or any object supporting the buffer protocol) to the file.
+
+        Raises:
+        =======
+        IOError -- the file would exceed the 4GB RIFF limit
+        """
+        n = memoryview(data).nbytes
+        if self.datasize + n > _MAX_DATA_SIZE:
+            raise IOError("Wave file {} would exceed RIFF maximum size".format(self.file_path))
+        self._f.write(data)
+        self.datasize += n
+
+    def sync(self):
+        """ Patch header sizes and flush, so that the file is readable while still being written """
+        position = self._f.tell()
+        self._f.seek(0)
+        self._f.write(_pack_header(self.datasize, self.sample_rate, self.channels, self.sample_depth))
+        self._f.seek(position)
+        self._f.flush()
+
+    def close(self):
+        """ Patch header sizes and close the file """
+        if self._f.closed:
+            return
+        if self.datasize % 2:
+            self._f.write(b'\x00') # RIFF chunks are word aligned
+        self.sync()
+        self._f.close()
+
+    @property
+    def duration(self) -> float:
+        """ Written audio duration in s"""
+        return self.datasize / (self.sample_rate * self.channels * self.sample_depth)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class WavReader:
+    """ WavReader gives access to a wave file samples through a memory map, without loading the file in memory.
+
+    Can be used as a context manager.
+    """
+    _dtypes = {(1, 1): np.dtype('u1'),
+               (1, 2): np.dtype('<i2'),
+               (1, 4): np.dtype('<i4'),
+               (3, 4): np.dtype('<f4'),
+               (3, 8): np.dtype('<f8')}
+
+    def __init__(self, file_path: str):
+        """ Open and parse a wave file.
+
+        Keyword Arguments:
+        ==================
+        file_path (str) -- the wave file to read
+
+        Raises:
+        =======
+        ValueError -- the file is not a supported wave file
+        """
+        self.file_path = file_path
+        fmt, data_offset, datasize = self._parse(file_path)
+        audio_format, self.channels, self.sample_rate, _, _, bits = fmt
+        self.sample_depth = bits // 8
+        if audio_format == 0xFFFE: # WAVE_FORMAT_EXTENSIBLE, assume PCM or float from depth
+            audio_format = 3 if self.sample_depth == 8 else 1
+        if (audio_format, self.sample_depth) not in self._dtypes:
+            raise ValueError("Unsupported wave format {} with {} bits samples".format(audio_format, bits))
+        self.dtype = self._dtypes[(audio_format, self.sample_depth)]
+        self.n_samples = datasize // (self.sample_depth * self.channels)
+        if self.n_samples > 0:
+            self._data = np.memmap(file_path, dtype=self.dtype, mode='r',
+                                   offset=data_offset,
+                                   shape=(self.n_samples, self.channels) if self.channels > 1 else (self.n_samples,))
+        else:
+            self._data = np.zeros((0, self.channels) if self.channels > 1 else (0,), dtype=self.dtype)
+
+    @staticmethod
+    def _parse(file_path: str):
+        file_size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            riff, _, wave = struct.unpack('<4sL4s', f.read(12))
+            if riff != b'RIFF' or wave != b'WAVE':
+                raise ValueError("{} is not a wave file".format(file_path))
+            fmt = None
+            while True:
+                chunk_header = f.read(8)
+                if len(chunk_header) < 8:
+                    raise ValueError("No data chunk found in {}".format(file_path))
+                chunk_id, chunk_size = struct.unpack('<4sL', chunk_header)
+                if chunk_id == b'fmt ':
+                    fmt = struct.unpack('<HHLLHH', f.read(16))
+                    f.seek(chunk_size - 16 + (chunk_size % 2), 1)
+                elif chunk_id == b'data':
+                    if fmt is None:
+                        raise ValueError("No fmt chunk before data in {}".format(file_path))
+                    offset = f.tell()
+                    # Unpatched streaming files have a null or oversized data size.
+                    datasize = min(chunk_size, file_size - offset) if chunk_size > 0 else file_size - offset
+                    return fmt, offset, datasize
+                else:
+                    f.seek(chunk_size + (chunk_size % 2), 1)
+
+    @property
+    def samples(self) -> np.ndarray:
+        """ Read only view on all the samples, shape is (n_samples,) for mono or (n_samples, channels)"""
+        return self._data
+
+    @property
+    def duration(self) -> float:
+        """ Audio duration in s"""
+        return self.n_samples / self.sample_rate
+
+    def read(self, start: int = 0, n_samples: int = None) -> np.ndarray:
+        """ Return a view on n_samples samples starting at sample start (all remaining samples if n_samples is None)"""
+        end = self.n_samples if n_samples is None else min(start + n_samples, self.n_samples)
+        return self._data[start:end]
+
+    def chunks(self, chunk_size: int = 1024, as_bytes: bool = False):
+        """ Iterate over the file by chunks of chunk_size samples without copying.
+
+        Keyword Arguments:
+        ==================
+        chunk_size (int) -- number of samples per chunk, the last chunk may be shorter (default 1024)
+
+        as_bytes (bool) -- yield memoryviews of the raw audio instead of numpy views, to feed bytes consuming elements (default False)
+        """
+        for start in range(0, self.n_samples, chunk_size):
+            chunk = self._data[start:start + chunk_size]
+            yield memoryview(chunk).cast('B') if as_bytes else chunk
+
+    def close(self):
+        """ Release the memory map. Views previously returned must not be used afterward."""
+        mm = getattr(self._data, '_mmap', None)
+        self._data = None
+        if mm is not None:
+            try:
+                mm.close()
+            except BufferError: # Views are still exported, the map is freed with them
+                pass
+
+    def __len__(self):
+        return self.n_samples
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class WavSink(_Consumer):
+    """ WavSink is a consumer element that writes its input audio into a wave file.
+    The file is written by the element thread and closed when the element is closed.
+
+    Capacities
+    ===========
+    Input
+    -----
+    bytes -- audio signal as bytes
+    """
+    __name__ = "wavsink"
+    _input_cap = [bytes]
+
+    def __init__(self, file_path: str,
+                       sample_rate: int = 16000,
+                       channels: int = 1,
+                       sample_depth: int = 2,
+                       sync_interval: float = 1.0):
+        """ Instanciate a WavSink element.
+
+        Keyword Arguments:
+        ==================
+        file_path (str) -- the file to be written
+
+        sample_rate (int) -- audio sample rate (default 16000)
+
+        channels (int) -- number of channels (default 1)
+
+        sample_depth (int) -- sample size in byte (default 2)
+
+        sync_interval (float) -- audio duration in s between header updates, keeps the file readable if the process dies. None disables it (default 1.0)
+        """
+        _Consumer.__init__(self)
+        self._queue = deque()
+        self._writer = WavWriter(file_path, sample_rate, channels, sample_depth)
+        self._sync_bytes = None if sync_interval is None else int(sync_interval * sample_rate) * channels * sample_depth
+        self._last_sync = 0
+
+    def input(self, data: bytes):
+        self._queue.append(data)
+        self._notify()
+
+    def _ready(self) -> bool:
+        return len(self._queue) > 0
+
+    def _step(self):
+        self._process()
+
+    def _finalize(self):
+        self._process()
+        self._writer.close()
+
+    def _process(self):
+        self._processing = True
+        while len(self._queue) > 0:
+            self._writer.write(self._queue.popleft())
+        if self._sync_bytes is not None and self._writer.datasize - self._last_sync >= self._sync_bytes:
+            self._writer.sync()
+            self._last_sync = self._writer.datasize
+        self._processing = False
+
+    @property
+    def duration(self) -> float:
+        """ Written audio duration in s"""
+        return self._writer.duration
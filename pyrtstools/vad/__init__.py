@@ -1 +1,2 @@
-from .vad import VADer
\ No newline at end of file
+from .vad import VADer, SpeechActivity
+from .uttbuffer import MemoryBudget, UtteranceBuffer, utterance_budget
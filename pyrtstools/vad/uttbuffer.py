@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2019 Linagora.
+
+This file is part of pyrtstools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import mmap
+import weakref
+import tempfile
+from threading import Lock
+
+class MemoryBudget:
+    """ MemoryBudget bounds the memory used by utterance capture across all the VADer of the process.
+
+    Utterance buffers reserve memory as they grow, a buffer whose reservation is refused spills to a temporary file.
+    Memory and disk usage are released once the utterance audio given to the callback is no longer referenced.
+    """
+    def __init__(self, max_bytes: int = None):
+        """ Create a budget.
+
+        Keyword arguments:
+        ==================
+        max_bytes (int) -- maximum number of bytes held in memory, None for no limit (default None)
+        """
+        assert max_bytes is None or max_bytes >= 0, "max_bytes must be positive"
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self.used = 0 # Bytes held in memory
+        self.peak = 0
+        self.spilled = 0 # Bytes held in spill files
+        self.n_spills = 0 # Number of buffers spilled to disk
+
+    def reserve(self, n_bytes: int) -> bool:
+        """ Reserve n_bytes of memory, return False if it would exceed the budget."""
+        with self._lock:
+            if self.max_bytes is not None and self.used + n_bytes > self.max_bytes:
+                return False
+            self.used += n_bytes
+            self.peak = max(self.peak, self.used)
+            return True
+
+    def release(self, n_bytes: int):
+        with self._lock:
+            self.used -= n_bytes
+
+    def _spill(self, n_bytes: int, new_file: bool = False):
+        with self._lock:
+            self.spilled += n_bytes
+            if new_file:
+                self.n_spills += 1
+
+    def _unspill(self, n_bytes: int):
+        with self._lock:
+            self.spilled -= n_bytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"max_bytes": self.max_bytes, "used": self.used, "peak": self.peak, "spilled": self.spilled, "n_spills": self.n_spills}
+
+utterance_budget = MemoryBudget()
+
+class _Audio(bytearray):
+    """ bytearray that can be weakly referenced, to release its budget once collected."""
+    pass
+
+class UtteranceBuffer:
+    """ UtteranceBuffer accumulates the audio of an utterance in memory within a MemoryBudget, and in a temporary file beyond it.
+
+    view() returns the audio as a read-only memoryview, over the in-memory buffer or over a memory map of the spill file,
+    without copy. The memory or disk space is released when the view is no longer referenced.
+    Thread safe: utterance detection may be restarted or canceled from another thread while audio is appended.
+    """
+    def __init__(self, budget: MemoryBudget = None, spill_dir: str = None):
+        """ Keyword arguments:
+        ==================
+        budget (MemoryBudget) -- memory budget (default process wide utterance_budget)
+
+        spill_dir (str) -- directory of the spill files (default system temporary directory)
+        """
+        self.budget = utterance_budget if budget is None else budget
+        self.spill_dir = spill_dir
+        self._ram = _Audio()
+        self._file = None
+        self._size = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def spilled(self) -> bool:
+        """ True if the audio is held in a spill file"""
+        return self._file is not None
+
+    def append(self, data: bytes):
+        if len(data) == 0:
+            return
+        with self._lock:
+            if self._file is None and not self.budget.reserve(len(data)):
+                self._file = tempfile.TemporaryFile(dir=self.spill_dir)
+                self._file.write(self._ram)
+                self.budget._spill(self._size, new_file=True)
+                self.budget.release(self._size)
+                self._ram = None
+            if self._file is not None:
+                self._file.write(data)
+                self.budget._spill(len(data))
+            else:
+                self._ram += data
+            self._size += len(data)
+
+    def view(self) -> memoryview:
+        """ Return the audio as a read-only memoryview and hand its memory over to the view, the buffer is empty afterwards."""
+        with self._lock:
+            return self._view()
+
+    def _view(self) -> memoryview:
+        size = self._size
+        if self._file is None:
+            audio, self._ram = self._ram, _Audio()
+            weakref.finalize(audio, self.budget.release, size)
+            view = memoryview(audio).toreadonly()
+        else:
+            self._file.flush()
+            if size > 0:
+                audio = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+                weakref.finalize(audio, self.budget._unspill, size)
+                view = memoryview(audio)
+            else:
+                view = memoryview(b'')
+            self._file.close() # The map keeps the unlinked file alive
+            self._file = None
+            self._ram = _Audio()
+        self._size = 0
+        return view
+
+    def clear(self):
+        """ Discard the audio."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self.budget._unspill(self._size)
+                self._file = None
+                self._ram = _Audio()
+            else:
+                self.budget.release(self._size)
+                self._ram = _Audio()
+            self._size = 0
@@ -18,11 +18,15 @@ You should have received a copy of the GNU Affero General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 from enum import Enum
+from threading import Lock
 from collections import deque
 
+import numpy as np
+
 import webrtcvad
 
 from pyrtstools.base import _Processor
+from pyrtstools.vad.uttbuffer import UtteranceBuffer
 
 class Utt_Status(Enum):
     """ Return status of VADer Element"""
@@ -30,6 +34,66 @@ class Utt_Status(Enum):
     THREACHED = 1
     TIMEOUT = -1
 
+class SpeechActivity:
+    """ SpeechActivity is the speech activity signal of a VADer, it can be given to other elements to follow speech presence.
+
+    Speech is located by sample positions in the VADer output stream, so that a downstream element asks about the audio it is
+    processing, whatever its lag behind the VADer.
+    """
+    def __init__(self, sample_rate: int = 16000, max_segments: int = 1024):
+        """ Keyword arguments:
+        ==================
+        sample_rate (int) -- audio sample rate, to convert hangovers in s to samples (default 16000)
+
+        max_segments (int) -- number of recent speech segments kept, older speech is forgotten (default 1024)
+        """
+        self.sample_rate = sample_rate
+        self.speech = False # Last analysed window is speech
+        self.position = 0 # Number of output samples analysed
+        self._starts = deque([], maxlen=max_segments) # Speech segments [start, end[ in output samples
+        self._ends = deque([], maxlen=max_segments)
+        self._lock = Lock()
+
+    @property
+    def last_speech(self) -> int:
+        """ Output sample position of the end of the last speech window, None if no speech was detected"""
+        with self._lock:
+            return self._ends[-1] if len(self._ends) > 0 else None
+
+    def update(self, is_speech: bool, start: int, end: int):
+        """ Record the analysis of the window of output samples [start, end[."""
+        with self._lock:
+            if is_speech and start < end:
+                if len(self._ends) > 0 and self._ends[-1] == start:
+                    self._ends[-1] = end
+                else:
+                    self._starts.append(start)
+                    self._ends.append(end)
+            self.speech = is_speech
+            self.position = max(self.position, end)
+
+    def active(self, hangover: float = 0.0, position = None):
+        """ Return True if speech has been detected before position and at most hangover seconds of audio before it.
+
+        Keyword arguments:
+        ==================
+        hangover (float) -- audio duration in s after the end of speech during which activity is still reported (default 0.0)
+
+        position (int | numpy.array) -- output sample position(s) to check, an array returns an array of bool (default last analysed position)
+        """
+        with self._lock:
+            starts = np.array(self._starts, dtype=np.int64)
+            ends = np.array(self._ends, dtype=np.int64)
+            position = self.position if position is None else position
+        positions = np.asarray(position, dtype=np.int64)
+        if len(ends) == 0:
+            result = np.zeros(positions.shape, dtype=bool)
+        else:
+            # The last segment starting before a position is the latest speech it can see
+            last = np.searchsorted(starts, positions, side='left') - 1
+            result = (last >= 0) & (ends[np.maximum(last, 0)] >= positions - int(hangover * self.sample_rate))
+        return bool(result) if result.ndim == 0 else result
+
 class VADer(_Processor):
     """ VADer is a processing element that detect speech in input signal and forward it to the next element.
     It also permits to detect utterance using the detect_utterance function.
@@ -52,7 +116,10 @@ class VADer(_Processor):
                        window_length: int = 30,
                        head : int = 5,
                        tail : int = 5,
-                       mode : int = 3):
+                       mode : int = 3,
+                       filter : bool = True,
+                       budget = None,
+                       spill_dir: str = None):
         """ Initialize voice activity detection and utterance detection. Only support 16bits integer inputs
         
         Keyword arguments:
@@ -66,6 +133,13 @@ class VADer(_Processor):
         tail (int) -- number of frame to keep as speech after speech labeled frames (default 2)
 
         mode (int) -- webrtcvad mode: 0 is the least aggressive about filtering out non-speech, 3 is the most aggressive (default 3)
+
+        filter (bool) -- only forward speech to the next element. If False all the signal is forwarded and the VADer is only used
+        for utterance detection and as speech activity signal (see activity) (default True)
+
+        budget (MemoryBudget) -- memory budget of utterance capture, utterances beyond it spill to temporary files (default process wide utterance_budget)
+
+        spill_dir (str) -- directory of the utterance spill files (default system temporary directory)
         
         Raises:
         =======
@@ -80,7 +154,7 @@ class VADer(_Processor):
         self._window_length = 480 #frames
         self._sample_depth  = 2 #bytes
         self._utt_callback = lambda x, y : print(x, len(y))
-        self._utt_buffer = b'' #contains current utterance
+        self._utt_buffer = UtteranceBuffer(budget, spill_dir) #contains current utterance
         self._head_buffer = deque([], maxlen=head)
 
         self._utt_det = False
@@ -91,6 +165,10 @@ class VADer(_Processor):
         self._sil_c = 0
         self._sil_th = 0
         self._time_out = 0
+        self._filter = filter
+        self._sample_offset = 0
+        self._output_offset = 0 # Number of samples forwarded
+        self.activity = SpeechActivity()
 
         self.sample_rate = sample_rate
         self.window_length = window_length
@@ -98,51 +176,63 @@ class VADer(_Processor):
         self._vad.set_mode(mode)
 
     def input(self, data : bytes):
-        self._buffer += data
         with self._condition:
-            self._condition.notify()
+            self._buffer += data
+        self._trace_input()
+        self._notify()
 
     def _process(self):
         self._processing = True
-        data = self._buffer[:self._window_length * self._sample_depth]
-        self._buffer = self._buffer[self._window_length * self._sample_depth:]
+        trace = self._trace_start()
+        with self._condition:
+            data = self._buffer[:self._window_length * self._sample_depth]
+            self._buffer = self._buffer[self._window_length * self._sample_depth:]
+        self._sample_offset += self._window_length
         if self._utt_det:
-            self._utt_buffer += data
+            self._utt_buffer.append(data)
             if self._speech_c >= self._speech_th and self._sil_c > self._sil_th:
                 self._on_utterance(Utt_Status.THREACHED)
             elif self._sil_c > self._timeout:
                 self._on_utterance(Utt_Status.TIMEOUT)
-        if self._vad.is_speech(data, self._sample_rate):
-            if self._consumer is not None:
-                if self._sil_c > 0 and len(self._head_buffer) > 0:
-                    self._consumer.input(b''.join(list(self._head_buffer)[:self._sil_c]))
+        is_speech = self._vad.is_speech(data, self._sample_rate)
+        # Locate the window in the output stream and publish its activity before forwarding it
+        head = b''
+        if self._filter and is_speech and self._sil_c > 0 and len(self._head_buffer) > 0:
+            head = b''.join(list(self._head_buffer)[:self._sil_c])
+        forwarded = not self._filter or is_speech or self._tail_c < self._tail
+        start = self._output_offset + len(head) // self._sample_depth
+        end = start + self._window_length if forwarded else start
+        self.activity.update(is_speech, start, end)
+        self._output_offset = end
+        if not self._filter and self._consumer is not None:
+            self._consumer.input(data)
+        forward = self._filter and self._consumer is not None
+        if is_speech:
+            if forward:
+                if len(head) > 0:
+                    self._consumer.input(head)
                 self._consumer.input(data)
             self._tail_c = 0
             self._sil_c = 0
             self._speech_c += 1
         elif self._tail_c < self._tail:
-            if self._consumer is not None:
+            if forward:
                 self._consumer.input(data)
             self._tail_c +=1
         else:
             self._sil_c += 1
             self._head_buffer.append(data)
+        self._trace_end(trace, sample=self._sample_offset - self._window_length, n_samples=self._window_length)
         self._processing = False
-        with self._condition:
-            self._condition.notify()
-
-    def run(self):
-        self._running = True
-        while self._running:
-            if self._paused or self._processing:
-                with self._condition:
-                    self._condition.wait()
-                    continue
-            if len(self._buffer) >= self._window_length * self._sample_depth and not self._processing:
-                self._process()
-            else:
-                with self._condition:
-                    self._condition.wait()
+
+    def _ready(self) -> bool:
+        return len(self._buffer) >= self._window_length * self._sample_depth
+
+    def _step(self):
+        self._process()
+
+    def _finalize(self):
+        self._utt_buffer.clear()
 
     def detect_utterance(self, callback: callable, sil_th: int = 600, speech_th: int = 300, time_out: int = 10000):
         """ Start utterance detection. This call marks the beginning of an utterance.
@@ -151,8 +241,8 @@ class VADer(_Processor):
 
         Keyword arguments:
         ==================
-        callback (callable(Utt_Status, [bytes | None])) -- Function to call when the utterance's end is detected, if threshold has been reached 
-        the audio buffer is joined else returns None as second parameter.
+        callback (callable(Utt_Status, [memoryview | None])) -- Function to call when the utterance's end is detected, if threshold has been reached
+        the utterance audio is given as a read-only memoryview (in memory or mapped from a spill file, use bytes() for a copy) else returns None as second parameter.
 
         sil_th (int) -- the amount of consecutive silence -in ms- required to end the utterance after enough speech has been collected (default 600ms)
 
@@ -165,7 +255,7 @@ class VADer(_Processor):
         self._sil_th = sil_th // self.window_length
         self._speech_th = speech_th // self.window_length
         self._timeout = time_out // self.window_length
-        self._utt_buffer = b''
+        self._utt_buffer.clear()
         self._speech_c = 0
         self._sil_c = 0
         self._utt_det = True
@@ -178,9 +268,26 @@ class VADer(_Processor):
 
         
     def _on_utterance(self, status: int):
-        self._utt_callback(status, self._utt_buffer if status == Utt_Status.THREACHED else None)
-        self._utt_det = False
+        if self.tracer is not None and status == Utt_Status.THREACHED:
+            self.tracer.detection(self.__name__, sample=self._sample_offset - 1)
+        if status == Utt_Status.THREACHED:
+            audio = self._utt_buffer.view()
+        else:
+            audio = None
+            self._utt_buffer.clear()
+        self._utt_det = False # Before the callback, which may start a new detection
+        self._emit(self._utt_callback, status, audio)
         
+    @property
+    def utterance_bytes(self) -> int:
+        """ Size in bytes of the utterance being captured"""
+        return len(self._utt_buffer)
+
+    @property
+    def utterance_spilled(self) -> bool:
+        """ True if the utterance being captured has spilled to disk"""
+        return self._utt_buffer.spilled
+
     @property
     def sample_rate(self):
         return self._sample_rate
@@ -190,6 +297,7 @@ class VADer(_Processor):
         if value not in [8000,16000,32000,48000]:
             raise ValueError("supported sample_rate are [8000,1600,32000,48000], given {}".format(value))
         self._sample_rate = value
+        self.activity.sample_rate = value
     
     @property
     def window_length(self):